@@ -1,16 +1,33 @@
 import json
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, jwt_required
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity, jwt_required
 from auth_schemas import RegisterIn, LoginIn, AuthOut
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from flask import redirect, render_template, request
+from flask import Response, redirect, render_template, request, request_started, stream_with_context
 from apiflask import APIFlask, abort
 from config import Config
-from schemas import ShortenIn, ShortenOut
-from shortener import generate_short_code, r
+from schemas import ShortenIn, ShortenOut, MyLinksQuery, TimeseriesQuery, TrendingQuery
+from ratelimit import limiter_settings
+from shortener import prepare_link, r
+import clicks
+from clicks import flush_clicks
+import storage
 from models import User
-from datetime import datetime
-from worker import fetch_url_preview
+from passwords import PasswordPoolBusy
+from auth import CachingJWTManager
+from worker import fetch_url_previews
+import preview
+from marshmallow import ValidationError
+from migrations import (
+    migrate_ip_click_keys, migrate_user_link_sets, migrate_to_compact_layout, migrate_reverse_index,
+    migrate_user_password_hashes,
+)
+import timeseries
+import trending
+import time
+from click_stream import breakdown
+from fastpath import RedirectMiddleware
+import metrics
 
 
 app = APIFlask(__name__, title="URL Shortener API", version="1.0.0", docs_path="/docs")
@@ -19,14 +36,16 @@ app.config.from_object(Config)
 limiter = Limiter(
     app=app,
     key_func=get_remote_address,
-    storage_uri=Config.RATELIMIT_STORAGE_URL,
     default_limits=["200 per day", "50 per hour"],
-    storage_options={"socket_connect_timeout": 30},
-    strategy="fixed-window",
-    enabled=not app.config.get("TESTING", False)
+    enabled=not app.config.get("TESTING", False),
+    **limiter_settings()
 )
 
-jwt = JWTManager(app)
+if metrics.enabled:
+    metrics.instrument_limiter(limiter)
+    request_started.connect(metrics.label_flask_route, app)
+
+jwt = CachingJWTManager(app)
 app.config["JWT_SECRET_KEY"] = Config.JWT_SECRET_KEY
 app.config["JWT_ACCESS_TOKEN_EXPIRES"] = Config.JWT_ACCESS_TOKEN_EXPIRES
 
@@ -104,53 +123,32 @@ def get_current_user():
     }
 
 @app.get("/my-links")
+@app.input(MyLinksQuery, location="query")
 @app.doc(
     summary="Get user's shortened links",
-    description="Returns all shortened URLs created by the authenticated user",
+    description="Returns the authenticated user's shortened URLs, newest first by default, "
+                "one page at a time. Pass `next_cursor` back as `cursor` to get the next page.",
     tags=["User Links"]
 )
 @jwt_required()
 @limiter.limit("30 per minute")
-def get_my_links():
+def get_my_links(query_data):
     user_id = get_jwt_identity()
 
-    links_codes = r.smembers(f"user:{user_id}:links")
-
-    if not links_codes:
-        return {"links": [], "total": 0}
-    links = []
-
-    for short_code in links_codes:
-        metadata_raw = r.get(f"metadata:{short_code}")
-        if not metadata_raw:
-            continue
-
-        metadata = json.loads(metadata_raw)
-
-        clicks_key = f"clicks:{short_code}"
-        total_clicks = r.get(clicks_key) or 0
-
-        ip_keys = r.keys(f"clicks:{short_code}:ip:*")
-        unique_ips = len(ip_keys) if ip_keys else 0
-
-        ttl = r.ttl(f"url:{short_code}")
-
-        links.append({
-            "short_code": short_code,
-            "short_url": f"{Config.BASE_URL}/{short_code}",
-            "original_url": metadata.get("original_url"),
-            "created_at": metadata.get("created_at"),
-            "total_clicks": int(total_clicks),
-            "unique_ips": unique_ips,
-            "expires_in_seconds": ttl if ttl > 0 else 0
-        })
+    try:
+        links, total, next_cursor = storage.backend.links.user_links(
+            user_id, query_data["limit"], query_data["order"] == "desc", query_data.get("cursor")
+        )
+    except ValueError:
+        abort(400, "Invalid cursor")
 
-        links.sort(key=lambda x: x.get("created_at", ""), reverse=True)
-
-        return {
-            "links": links,
-            "total": len(links),
-        }
+    for link in links:
+        link["short_url"] = f"{Config.BASE_URL}/{link['short_code']}"
+    return {
+        "links": links,
+        "total": total,
+        "next_cursor": next_cursor,
+    }
 
 @app.route("/")
 @limiter.exempt
@@ -169,77 +167,147 @@ def root():
 @limiter.limit("10 per minute")
 @jwt_required(optional=True)
 def shorten(json_data):
-    long_url = json_data["url"]
-    custom = json_data.get("custom_code")
     user_id = get_jwt_identity()
 
-    if not long_url.startswith(('http://', 'https://')):
-        long_url = 'https://' + long_url
+    try:
+        long_url, custom = prepare_link(json_data["url"], json_data.get("custom_code"))
+    except ValueError as e:
+        abort(400, str(e))
 
     expiry_time = 604800 if user_id else 86400
 
-    if custom:
-        short_code = custom
-        key = f"url:{short_code}"
-
-        if r.exists(key):
-            existing_url = r.get(key)
-            clicks_key = f"clicks:{short_code}"
-            total_clicks = int(r.get(clicks_key) or 0)
-            ip_keys = r.keys(f"clicks:{short_code}:ip:*")
-            unique_ips = len(ip_keys)
-
-            return {
-                "short_url": f"{Config.BASE_URL}/{short_code}",
-                "original_url": existing_url,
-                "custom_used": True,
-                "already_existed": True,
-                "total_clicks": total_clicks,
-                "unique_ips": unique_ips,
-                "expires_in_seconds": int(r.ttl(key)),
-                "message": "This custom code is already in use."
-            }, 200
-
-        if not (4 <= len(custom) <= 16 and custom.isalnum()):
-            abort(400, "Invalid custom code")
-
-    existing_short_code = r.get(f"long_to_short:{long_url}")
-
-    if existing_short_code and not custom:
-        short_code = existing_short_code
-        already_existed = True
-        status_code = 200
-        current_expiry = int(r.ttl(f"url:{short_code}"))
-    else:
-        if not custom:
-            short_code = generate_short_code()
-
-        r.setex(f"url:{short_code}", expiry_time, long_url)
-        r.setex(f"long_to_short:{long_url}", expiry_time, short_code)
-
-        if user_id:
-            metadata = {
-                "user_id": str(user_id),
-                "created_at": datetime.now().isoformat(),
-                "original_url": long_url,
-            }
-            r.setex(f"metadata:{short_code}", expiry_time, json.dumps(metadata))
-            r.sadd(f"user:{user_id}:links", short_code)
-
-        already_existed = False
-        status_code = 201
-        current_expiry = expiry_time
-        if status_code == 201:
-            fetch_url_preview.delay(short_code, long_url)
+    link = storage.backend.links.shorten(long_url, expiry_time, custom=custom, user_id=user_id)
+
+    if link["status"] == "created":
+        enqueue_previews([link["original_url"]])
+
+    return shorten_response(link, custom, user_id)
+
+
+def enqueue_previews(urls):
+    """Queue one preview fetch for the pages of ``urls`` not cached or in flight."""
+    urls = preview.claim(r, urls)
+    if urls:
+        fetch_url_previews.delay(urls)
 
+
+def shorten_response(link, custom, user_id):
+    """Build the /shorten response body and status from a shorten_url result."""
+    short_url = f"{Config.BASE_URL}/{link['short_code']}"
+
+    if link["status"] == "taken":
+        return {
+            "short_url": short_url,
+            "original_url": link["original_url"],
+            "custom_used": True,
+            "already_existed": True,
+            "total_clicks": link["total_clicks"],
+            "unique_ips": link["unique_ips"],
+            "expires_in_seconds": link["expires_in_seconds"],
+            "message": "This custom code is already in use."
+        }, 200
+
+    created = link["status"] == "created"
     return {
-        "short_url": f"{Config.BASE_URL}/{short_code}",
-        "original_url": long_url,
+        "short_url": short_url,
+        "original_url": link["original_url"],
         "custom_used": bool(custom),
-        "already_existed": already_existed,
-        "expires_in_seconds": current_expiry,
+        "already_existed": not created,
+        "expires_in_seconds": link["expires_in_seconds"],
         "user_id": user_id,
-    }, status_code
+    }, 201 if created else 200
+
+def parse_batch_item(item):
+    """Validate one /shorten/batch item; returns (long_url, custom_code) or raises ValueError."""
+    if isinstance(item, str):
+        item = {"url": item}
+
+    try:
+        data = ShortenIn().load(item)
+    except ValidationError as e:
+        raise ValueError(e.messages)
+
+    return prepare_link(data["url"], data.get("custom_code"))
+
+
+def read_ndjson(stream):
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+@app.post("/shorten/batch")
+@app.doc(
+    summary="Shorten many URLs",
+    description="Accepts a JSON array of URLs or `{url, custom_code}` objects (also as "
+                "`{\"urls\": [...]}`), or an `application/x-ndjson` stream with one item per line. "
+                "Streams back one NDJSON result line per item, in input order.",
+    tags=["URL Shortener"],
+)
+@jwt_required()
+@limiter.limit("10 per minute")
+def shorten_batch():
+    user_id = get_jwt_identity()
+    expiry_time = 604800
+
+    if request.mimetype == "application/x-ndjson":
+        items = read_ndjson(request.stream)
+    else:
+        items = request.get_json(silent=True)
+        if isinstance(items, dict):
+            items = items.get("urls")
+        if not isinstance(items, list):
+            abort(400, "Expected a JSON array of URLs or an NDJSON stream")
+
+    def process(chunk):
+        valid = []
+        lines = []
+        for index, item in chunk:
+            try:
+                valid.append(parse_batch_item(item))
+                lines.append({"index": index})
+            except ValueError as e:
+                lines.append({"index": index, "status": "error", "error": e.args[0]})
+
+        links = iter(storage.backend.links.shorten_many(valid, expiry_time, user_id=user_id))
+        created = []
+        for line in lines:
+            if "status" in line:
+                continue
+            link = next(links)
+            line.update({
+                "status": link["status"],
+                "short_url": f"{Config.BASE_URL}/{link['short_code']}",
+                "original_url": link["original_url"],
+                "expires_in_seconds": link["expires_in_seconds"],
+            })
+            if link["status"] == "created":
+                created.append(link["original_url"])
+
+        if created:
+            enqueue_previews(created)
+        return lines
+
+    def generate():
+        chunk = []
+        for index, item in enumerate(items):
+            if index >= Config.BATCH_MAX_ITEMS:
+                yield json.dumps({"index": index, "status": "error",
+                                  "error": f"Batch limit of {Config.BATCH_MAX_ITEMS} items exceeded"}) + "\n"
+                break
+            chunk.append((index, item))
+            if len(chunk) >= Config.BATCH_CHUNK_SIZE:
+                yield "".join(json.dumps(line) + "\n" for line in process(chunk))
+                chunk = []
+        if chunk:
+            yield "".join(json.dumps(line) + "\n" for line in process(chunk))
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
 
 @app.get("/<short_code>")
 @app.doc(
@@ -250,26 +318,25 @@ def shorten(json_data):
 )
 @limiter.limit("100 per minute")
 def redirect_short(short_code):
-    key = f"url:{short_code}"
-    long_url = r.get(key)
+    long_url = storage.backend.links.resolve_and_count(
+        short_code,
+        request.remote_addr,
+        referrer=request.referrer,
+        user_agent=request.user_agent.string,
+        country=request.headers.get(Config.COUNTRY_HEADER),
+    )
 
     if not long_url:
         abort(404, "URL not found")
 
-    clicks_key = f"clicks:{short_code}"
-    r.incr(clicks_key)
-
-    ip = request.remote_addr
-    ip_key = f"clicks:{short_code}:ip:{ip}"
-    r.incr(ip_key)
-
     return redirect(long_url, code=302)
 
 @app.get("/preview/<short_code>")
 def get_preview(short_code):
-    data = r.get(f"preview:{short_code}")
+    long_url = storage.backend.links.get_url(short_code)
+    data = preview.cached(r, long_url) if long_url else None
     if data:
-        return json.loads(data)
+        return data
     return {"message": "Preview pending or not available"}, 404
 
 @app.get("/stats/<short_code>")
@@ -280,12 +347,7 @@ def get_preview(short_code):
 )
 @limiter.limit("30 per minute")
 def get_stats(short_code):
-    clicks_key = f"clicks:{short_code}"
-    total_clicks = r.get(clicks_key) or b"0"
-    total_clicks = int(total_clicks)
-
-    ip_keys = r.keys(f"clicks:{short_code}:ip:*")
-    unique_ips = len(ip_keys) if ip_keys else 0
+    total_clicks, unique_ips = storage.backend.counters.totals(short_code)
 
     return {
         "short_code": short_code,
@@ -293,6 +355,124 @@ def get_stats(short_code):
         "unique_ips": unique_ips
     }
 
+@app.get("/stats/<short_code>/timeseries")
+@app.input(TimeseriesQuery, location="query")
+@app.doc(
+    summary="Get clicks over time",
+    description="Returns click counts per minute, hour or day between start and end (Unix times).",
+    tags=["Statistics"]
+)
+@limiter.limit("30 per minute")
+def get_stats_timeseries(short_code, query_data):
+    granularity = query_data["granularity"]
+    size, _ = timeseries.GRANULARITIES[granularity]
+    end = query_data.get("end", int(time.time()))
+    start = query_data.get("start", end - 59 * size)
+
+    if start > end:
+        abort(400, "start must not be after end")
+    if (end - start) // size + 1 > Config.TIMESERIES_MAX_POINTS:
+        abort(400, f"At most {Config.TIMESERIES_MAX_POINTS} buckets per query")
+
+    flush_clicks()
+    points = timeseries.query(r, short_code, granularity, start, end)
+
+    return {
+        "short_code": short_code,
+        "granularity": granularity,
+        "points": [{"timestamp": ts, "clicks": n} for ts, n in points],
+    }
+
+@app.get("/stats/<short_code>/breakdown")
+@app.doc(
+    summary="Get click breakdowns",
+    description="Returns clicks by referrer domain, device, browser and country. "
+                "Only collected when CLICK_COUNT_MODE is stream.",
+    tags=["Statistics"]
+)
+@limiter.limit("30 per minute")
+def get_stats_breakdown(short_code):
+    return {"short_code": short_code, **breakdown(r, short_code)}
+
+@app.get("/trending")
+@app.input(TrendingQuery, location="query")
+@app.doc(
+    summary="Get trending links",
+    description="Returns the most clicked links over the last 5 minutes, hour or day. "
+                "Counts are approximate and lag clicks by up to TRENDING_FLUSH_INTERVAL seconds.",
+    tags=["Statistics"]
+)
+@limiter.limit("30 per minute")
+def get_trending(query_data):
+    trending.flush_trending()
+    links = trending.top(r, query_data["window"], query_data["limit"])
+    return {
+        "window": query_data["window"],
+        "links": [
+            {"short_code": code, "short_url": f"{Config.BASE_URL}/{code}", "clicks": n}
+            for code, n in links
+        ],
+    }
+
+@app.get("/cache/stats")
+@app.doc(
+    summary="Get link cache statistics",
+    description="Returns hit, miss and eviction counters of this worker's short code cache.",
+    tags=["Statistics"]
+)
+@limiter.limit("30 per minute")
+def get_cache_stats():
+    if clicks.link_cache is None:
+        return {"enabled": False}
+
+    return {"enabled": True, **clicks.link_cache.stats()}
+
+@app.get("/metrics")
+@app.doc(hide=True)
+@limiter.exempt
+def get_metrics():
+    """Prometheus text exposition of this process' metrics; see metrics.py."""
+    if not metrics.enabled:
+        abort(404)
+    return Response(metrics.render(r), mimetype="text/plain; version=0.0.4")
+
+@app.cli.command("migrate-unique-visitors")
+def migrate_unique_visitors():
+    """Fold legacy per-IP click keys into HyperLogLog visitor counters."""
+    migrated = migrate_ip_click_keys(r)
+    print(f"Migrated {migrated} per-IP click keys")
+
+@app.cli.command("migrate-user-link-index")
+def migrate_user_link_index():
+    """Convert per-user link sets into creation-time sorted indexes."""
+    migrated = migrate_user_link_sets(r)
+    print(f"Migrated link sets of {migrated} users")
+
+@app.cli.command("migrate-link-layout")
+def migrate_link_layout():
+    """Convert links to the compact layout (LINK_LAYOUT=compact)."""
+    migrated = migrate_to_compact_layout(r)
+    print(f"Migrated {migrated} links to the compact layout")
+
+@app.cli.command("migrate-reverse-index")
+def migrate_reverse_index_command():
+    """Re-key long URL lookups by URL digest."""
+    migrated = migrate_reverse_index(r)
+    print(f"Migrated {migrated} long URL lookups")
+
+@app.cli.command("migrate-user-passwords")
+def migrate_user_passwords():
+    """Move password hashes out of user profiles."""
+    migrated = migrate_user_password_hashes(r)
+    print(f"Migrated password hashes of {migrated} users")
+
+@app.errorhandler(PasswordPoolBusy)
+def password_pool_busy_handler(e):
+    return {
+        "error": "Service busy",
+        "message": "Too many password checks in progress, retry shortly",
+    }, 503, {"Retry-After": "1"}
+
 @app.errorhandler(429)
 def ratelimit_handler(e):
     return {
@@ -300,6 +480,11 @@ def ratelimit_handler(e):
         "message": str(e.description),
     }, 429
 
+# Serves redirects before Flask; see fastpath.py. Mounted last so it knows every route.
+app.wsgi_app = RedirectMiddleware(app.wsgi_app, app, limiter)
+if metrics.enabled:
+    app.wsgi_app = metrics.WSGIMetrics(app.wsgi_app)
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000)
 
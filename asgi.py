@@ -0,0 +1,248 @@
+"""ASGI entry point.
+
+Redirects, ``POST /shorten`` and ``GET /stats/<short_code>`` are served
+natively on the event loop with the asyncio Redis client from shortener.py;
+every other request, and every request with a non-Redis storage backend,
+falls through to the Flask app in a thread. Run with:
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000 --workers 4
+"""
+import asyncio
+import json
+
+from asgiref.wsgi import WsgiToAsgi
+from flask_jwt_extended import decode_token
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt import PyJWTError
+from limits import parse
+from marshmallow import ValidationError
+from werkzeug.urls import iri_to_uri
+
+from app import app, enqueue_previews, limiter, shorten_response
+from config import Config
+from clicks import resolve_and_count_async, invalidate_link, flush_clicks_async, queue_click_total
+from schemas import ShortenIn, ShortenOut
+import metrics
+import storage
+from shortener import ar, prepare_link, shorten_url_async
+
+wsgi_app = WsgiToAsgi(app)
+
+# Single-segment paths that belong to Flask routes rather than short codes.
+FLASK_PATHS = {rule.rule for rule in app.url_map.iter_rules() if not rule.arguments}
+
+# Same limits as the Flask routes.
+REDIRECT_LIMIT = "100 per minute"
+SHORTEN_LIMIT = "10 per minute"
+STATS_LIMIT = "30 per minute"
+
+
+async def respond(send, status, payload=None, headers=()):
+    body = json.dumps(payload).encode() if payload is not None else b""
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def error(send, status, message):
+    await respond(send, status, {"detail": {}, "message": message})
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+def client_ip(scope):
+    client = scope.get("client")
+    return client[0] if client else "127.0.0.1"
+
+
+def header(scope, name):
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+async def rate_limited(send, scope, route, limit):
+    """Check ``limit`` through the app's flask-limiter, like fastpath.py.
+
+    Hits use the app's storage and strategy (``RATELIMIT_STORAGE``). Both
+    storages can block on Redis (the hybrid one for tight limits, new keys
+    and syncs), so every hit runs in a thread rather than on the loop.
+    """
+    if not limiter.enabled:
+        return False
+
+    limit = parse(limit)
+    allowed = await asyncio.to_thread(limiter.limiter.hit, limit, "asgi", route, client_ip(scope))
+    if allowed:
+        return False
+
+    await respond(send, 429, {
+        "error": "Rate limit exceeded",
+        "message": str(limit),
+    })
+    return True
+
+
+def jwt_identity(scope):
+    """Return the identity of an optional bearer token, like ``jwt_required(optional=True)``."""
+    authorization = header(scope, b"authorization")
+    if not authorization or not authorization.startswith("Bearer "):
+        return None
+
+    with app.app_context():
+        return decode_token(authorization[len("Bearer "):])[app.config["JWT_IDENTITY_CLAIM"]]
+
+
+def jwt_error(e):
+    """Status and body the Flask app's JWT error handlers give ``e`` (422, or 401 if expired)."""
+    with app.test_request_context():
+        response = app.make_response(app.handle_user_exception(e))
+        return response.status_code, response.get_json()
+
+
+async def redirect_short(scope, receive, send, short_code):
+    if await rate_limited(send, scope, "redirect", REDIRECT_LIMIT):
+        return
+
+    long_url = await resolve_and_count_async(
+        short_code,
+        client_ip(scope),
+        referrer=header(scope, b"referer"),
+        user_agent=header(scope, b"user-agent"),
+        country=header(scope, Config.COUNTRY_HEADER.lower().encode()),
+    )
+
+    if not long_url:
+        return await error(send, 404, "URL not found")
+
+    await respond(send, 302, headers=[(b"location", iri_to_uri(long_url).encode("latin-1"))])
+
+
+async def get_stats(scope, receive, send, short_code):
+    if await rate_limited(send, scope, "stats", STATS_LIMIT):
+        return
+
+    await flush_clicks_async()
+
+    pipe = ar.pipeline(transaction=False)
+    queue_click_total(pipe, short_code)
+    pipe.pfcount(f"clicks:{short_code}:visitors")
+    total_clicks, unique_ips = await pipe.execute()
+
+    await respond(send, 200, {
+        "short_code": short_code,
+        "total_clicks": int(total_clicks or 0),
+        "unique_ips": unique_ips
+    })
+
+
+async def shorten(scope, receive, send):
+    if await rate_limited(send, scope, "shorten", SHORTEN_LIMIT):
+        return
+
+    try:
+        json_data = ShortenIn().load(json.loads(await read_body(receive) or b"{}"))
+    except (ValueError, ValidationError) as e:
+        detail = {"json": e.messages} if isinstance(e, ValidationError) else {}
+        return await respond(send, 422, {"detail": detail, "message": "Validation error"})
+
+    try:
+        user_id = jwt_identity(scope)
+    except (JWTExtendedException, PyJWTError) as e:
+        return await respond(send, *jwt_error(e))
+
+    try:
+        long_url, custom = prepare_link(json_data["url"], json_data.get("custom_code"))
+    except ValueError as e:
+        return await error(send, 400, str(e))
+
+    expiry_time = 604800 if user_id else 86400
+
+    if custom:
+        await flush_clicks_async()
+
+    link = await shorten_url_async(long_url, expiry_time, custom=custom, user_id=user_id)
+
+    if link["status"] == "created":
+        invalidate_link(link["short_code"])
+        await asyncio.to_thread(enqueue_previews, [link["original_url"]])
+
+    payload, status_code = shorten_response(link, custom, user_id)
+    await respond(send, status_code, ShortenOut().dump(payload))
+
+
+# Metrics route labels of the native handlers, the same as the Flask rules.
+ROUTE_LABELS = {}
+
+
+async def timed(handler, scope, receive, send, *args):
+    """Run a native handler under a ``metrics.RequestTimer``."""
+    with metrics.RequestTimer(ROUTE_LABELS[handler], scope["method"]) as timer:
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                timer.status = message["status"]
+            await send(message)
+
+        await handler(scope, receive, send_with_status, *args)
+
+
+def route(scope):
+    # The native routes talk to Redis directly; other backends go through Flask.
+    if storage.backend.name != "redis":
+        return None, ()
+
+    method = scope["method"]
+    path = scope["path"]
+    parts = path.strip("/").split("/")
+
+    if method == "POST" and path == "/shorten":
+        return shorten, ()
+    if method == "GET" and len(parts) == 2 and parts[0] == "stats" and parts[1]:
+        return get_stats, (parts[1],)
+    if method == "GET" and len(parts) == 1 and parts[0] and path not in FLASK_PATHS:
+        return redirect_short, (parts[0],)
+    return None, ()
+
+
+ROUTE_LABELS.update({shorten: "/shorten", get_stats: "/stats/<short_code>", redirect_short: "/<short_code>"})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await flush_clicks_async()
+            await ar.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+
+    if scope["type"] == "http":
+        handler, args = route(scope)
+        if handler is not None:
+            if metrics.enabled:
+                return await timed(handler, scope, receive, send, *args)
+            return await handler(scope, receive, send, *args)
+
+    await wsgi_app(scope, receive, send)
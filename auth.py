@@ -0,0 +1,37 @@
+"""JWT manager that remembers the claims of recently decoded tokens.
+
+Every authenticated request makes flask-jwt-extended parse the token twice
+and check its signature. A client sends the same token until it expires, so
+``CachingJWTManager`` keeps the decoded claims per token string for
+``JWT_CLAIMS_CACHE_TTL`` seconds, never past the token's own expiry. Only
+tokens that decoded successfully are cached, and the blocklist and
+user lookup callbacks still run on every request.
+"""
+import time
+
+from flask_jwt_extended import JWTManager
+
+from cache import MISSING, TTLCache
+from config import Config
+
+
+class CachingJWTManager(JWTManager):
+    def __init__(self, app=None, maxsize=None, ttl=None, **kwargs):
+        maxsize = Config.JWT_CLAIMS_CACHE_SIZE if maxsize is None else maxsize
+        ttl = Config.JWT_CLAIMS_CACHE_TTL if ttl is None else ttl
+        self.claims_cache = TTLCache(maxsize, ttl) if maxsize > 0 else None
+        super().__init__(app, **kwargs)
+
+    def _decode_jwt_from_config(self, encoded_token, csrf_value=None, allow_expired=False):
+        if self.claims_cache is None:
+            return super()._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)
+
+        key = (encoded_token, csrf_value, allow_expired)
+        claims = self.claims_cache.get(key)
+        if claims is not MISSING:
+            return claims
+
+        claims = super()._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)
+        ttl = claims["exp"] - time.time() if "exp" in claims else None
+        self.claims_cache.set(key, claims, ttl=ttl)
+        return claims
@@ -0,0 +1,39 @@
+"""Bulk link ingestion: one shorten_url call per link vs. chunked shorten_many.
+
+    python -m benchmarks.bench_batch [--redis-url redis://localhost:6379/15]
+"""
+import time
+
+from benchmarks.common import base_parser, make_redis, use_redis
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--links", type=int, default=20000)
+    parser.add_argument("--chunk-size", type=int, default=500)
+    args = parser.parse_args()
+
+    r = make_redis(args.redis_url)
+    import shortener
+    use_redis(r, shortener)
+
+    urls = [f"https://example.com/{i}" for i in range(args.links)]
+
+    start = time.perf_counter()
+    for url in urls:
+        shortener.shorten_url(url, 86400, user_id="1")
+    elapsed = time.perf_counter() - start
+    print(f"shorten_url   {args.links} links  {args.links / elapsed:8.0f} links/s")
+
+    r.flushdb()
+    start = time.perf_counter()
+    for i in range(0, args.links, args.chunk_size):
+        chunk = [(url, None) for url in urls[i:i + args.chunk_size]]
+        shortener.shorten_many(chunk, 86400, user_id="1")
+    elapsed = time.perf_counter() - start
+    print(f"shorten_many  {args.links} links  {args.links / elapsed:8.0f} links/s  "
+          f"(chunks of {args.chunk_size})")
+
+
+if __name__ == "__main__":
+    main()
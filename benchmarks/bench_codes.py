@@ -0,0 +1,115 @@
+"""Short code allocation throughput at 10%/50%/90% keyspace fill.
+
+Uses 3-character codes (62**3 = 238,328) so the keyspace can actually be
+filled. "legacy" is the old EXISTS-then-SETEX loop; the allocators go
+through shorten_url, which claims the code inside the shorten script.
+
+    python -m benchmarks.bench_codes [--redis-url redis://localhost:6379/15]
+"""
+import random
+import time
+
+from benchmarks.common import base_parser, make_redis, use_redis
+
+LENGTH = 3
+KEYSPACE = 62 ** LENGTH
+
+
+class Counting:
+    """Wraps an allocator to count allocation attempts."""
+
+    def __init__(self, allocator):
+        self.allocator = allocator
+        self.attempts = 0
+
+    def allocate(self, client, attempt=0):
+        self.attempts += 1
+        return self.allocator.allocate(client, attempt)
+
+
+def legacy_claim(r, long_url):
+    from shortener import random_short_code
+    attempts = 0
+    while True:
+        attempts += 1
+        short_code = random_short_code(LENGTH)
+        if not r.exists(f"url:{short_code}"):
+            r.setex(f"url:{short_code}", 86400, long_url)
+            return attempts
+
+
+def prefill(r, codes):
+    pipe = r.pipeline(transaction=False)
+    for i, code in enumerate(codes, 1):
+        pipe.set(f"url:{code}", "https://example.com")
+        if i % 10000 == 0:
+            pipe.execute()
+    pipe.execute()
+
+
+def report(label, fill, count, elapsed, attempts, extra=""):
+    print(f"{label:<10} fill={fill:>3.0%}  {count / elapsed:9.0f} codes/s  "
+          f"{attempts / count:6.2f} attempts/code{extra}")
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--allocations", type=int, default=2000)
+    args = parser.parse_args()
+
+    r = make_redis(args.redis_url)
+    import shortener
+    from shortener import (CounterCodeAllocator, PoolCodeAllocator, RandomCodeAllocator,
+                           encode_base62, refill_code_pool)
+    use_redis(r, shortener)
+
+    rng = random.Random(42)
+    everything = [encode_base62(n, LENGTH) for n in range(KEYSPACE)]
+    n = args.allocations
+
+    for fill in (0.1, 0.5, 0.9):
+        filled = int(KEYSPACE * fill)
+
+        r.flushdb()
+        prefill(r, rng.sample(everything, filled))
+        start = time.perf_counter()
+        attempts = sum(legacy_claim(r, f"https://example.com/{i}") for i in range(n))
+        report("legacy", fill, n, time.perf_counter() - start, attempts)
+
+        for grow_after in (10 ** 9, 3):
+            r.flushdb()
+            prefill(r, rng.sample(everything, filled))
+            shortener.allocator = Counting(RandomCodeAllocator(LENGTH, grow_after))
+            start = time.perf_counter()
+            codes = [shortener.shorten_url(f"https://example.com/{i}", 86400)["short_code"]
+                     for i in range(n)]
+            grown = sum(len(code) > LENGTH for code in codes)
+            label = "random" if grow_after > n else "random+grow"
+            report(label, fill, n, time.perf_counter() - start, shortener.allocator.attempts,
+                   f"  ({grown} grown)")
+
+        r.flushdb()
+        counter = CounterCodeAllocator(LENGTH, "bench")
+        prefill(r, [counter.encode(i) for i in range(filled)])
+        r.set(CounterCodeAllocator.COUNTER_KEY, filled)
+        shortener.allocator = Counting(counter)
+        start = time.perf_counter()
+        for i in range(n):
+            shortener.shorten_url(f"https://example.com/{i}", 86400)
+        report("counter", fill, n, time.perf_counter() - start, shortener.allocator.attempts)
+
+        r.flushdb()
+        prefill(r, rng.sample(everything, filled))
+        start = time.perf_counter()
+        refill_code_pool(r, n, length=LENGTH)
+        refill = time.perf_counter() - start
+        shortener.allocator = Counting(PoolCodeAllocator(RandomCodeAllocator(LENGTH)))
+        start = time.perf_counter()
+        for i in range(n):
+            shortener.shorten_url(f"https://example.com/{i}", 86400)
+        report("pool", fill, n, time.perf_counter() - start, shortener.allocator.attempts,
+               f"  (refill {n / refill:.0f} codes/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Redirect requests/sec through the WSGI fast path vs. the Flask route.
+
+Drives ``app.wsgi_app`` in-process, once with the RedirectMiddleware and
+once with the Flask app behind it, for the same traffic: mostly live codes
+and a share of unknown ones.
+
+    python -m benchmarks.bench_fastpath [--redis-url redis://localhost:6379/15]
+"""
+import random
+import time
+
+from werkzeug.test import EnvironBuilder
+
+from benchmarks.common import base_parser, make_redis, use_redis, timed, summarize, print_row
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--links", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=10000)
+    parser.add_argument("--missing", type=float, default=0.1, help="Share of unknown codes")
+    args = parser.parse_args()
+
+    r = make_redis(args.redis_url)
+    import shortener, clicks, storage, trending, app as app_module
+    from fastpath import RedirectMiddleware
+    use_redis(r, shortener, clicks, storage, trending, app_module)
+    app_module.limiter.enabled = False
+
+    codes = [f"bench{i}" for i in range(args.links)]
+    pipe = r.pipeline(transaction=False)
+    for code in codes:
+        pipe.set(f"url:{code}", f"https://example.com/{code}")
+    pipe.execute()
+
+    rng = random.Random(42)
+    environs = [
+        EnvironBuilder(
+            path=f"/{rng.choice(codes) if rng.random() >= args.missing else 'nope' + str(i)}",
+            environ_base={"REMOTE_ADDR": f"10.0.{rng.randrange(256)}.{rng.randrange(256)}"},
+        ).get_environ()
+        for i in range(args.iterations)
+    ]
+
+    def start_response(status, headers, exc_info=None):
+        pass
+
+    # Below the metrics middleware, if any.
+    middleware = app_module.app.wsgi_app
+    while not isinstance(middleware, RedirectMiddleware):
+        middleware = middleware.wsgi_app
+    for label, wsgi_app in (("flask route", middleware.wsgi_app), ("fast path", middleware)):
+        def request(i):
+            for _ in wsgi_app(dict(environs[i]), start_response):
+                pass
+
+        start = time.perf_counter()
+        samples = timed(request, args.iterations)
+        elapsed = time.perf_counter() - start
+        print_row(label, summarize(samples))
+        print(f"  {args.iterations / elapsed:,.0f} req/s")
+
+
+if __name__ == "__main__":
+    main()
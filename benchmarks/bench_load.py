@@ -0,0 +1,287 @@
+"""Mixed-traffic load test of the app, with JSON results that runs can be compared on.
+
+Seeds a large keyspace (``--links`` links, ``--users`` of them owning a
+share), then sends ``--requests`` requests through the full WSGI app in
+process: redirects, ``/stats/<code>``, ``POST /shorten`` and ``/my-links``
+in the ``--mix`` proportions. Codes and users are drawn from a Zipf
+distribution (``--zipf``), so a few hot links get most of the traffic as in
+production, and the whole run is seeded (``--seed``) so it is
+reproducible. Reports throughput, p50/p95/p99 latency and Redis commands
+and round trips per request for each route.
+
+    python -m benchmarks.bench_load [--redis-url redis://localhost:6379/15] --output run.json
+    python -m benchmarks.bench_load --compare baseline.json [--threshold 0.2]
+
+With ``--compare``, the run is checked against a saved one: a route whose
+p50, p99 or throughput is worse by more than ``--threshold`` is flagged,
+and the command exits with status 1. The p99 of a route with fewer than
+``MIN_P99_SAMPLES`` requests in either run is not checked. Only compare
+runs with the same settings on the same machine; back-to-back runs of one
+revision can differ by 10-20% on a busy machine, hence the default
+threshold.
+"""
+import itertools
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from werkzeug.test import EnvironBuilder
+
+from benchmarks.common import base_parser, make_redis, use_redis, summarize
+
+ROUTES = ("redirect", "stats", "shorten", "my_links")
+SEED_CHUNK = 500
+# Below this many requests a route's p99 is a handful of samples, and
+# back-to-back runs of one revision differ by far more than the threshold.
+MIN_P99_SAMPLES = 1000
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        route, _, weight = part.partition("=")
+        if route not in ROUTES:
+            raise ValueError(f"Unknown route {route!r}, expected one of {', '.join(ROUTES)}")
+        mix[route] = float(weight)
+    return mix
+
+
+def zipf_weights(n, s):
+    """Cumulative weights of ranks 1..n under a Zipf distribution with exponent ``s``."""
+    return list(itertools.accumulate(1 / rank ** s for rank in range(1, n + 1)))
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def seed(storage, links, users):
+    """Create ``links`` links, every tenth one owned by one of ``users``; returns codes and owners."""
+    codes = []
+    owners = {}
+    for start in range(0, links, SEED_CHUNK):
+        count = min(SEED_CHUNK, links - start)
+        owned = start // SEED_CHUNK % 10 == 0
+        user_id = str(start // SEED_CHUNK % users + 1) if owned else None
+        items = [(f"https://example.com/page/{start + i}", None) for i in range(count)]
+        created = storage.backend.links.shorten_many(items, 7 * 24 * 3600, user_id=user_id)
+        codes.extend(link["short_code"] for link in created)
+        if user_id:
+            owners.setdefault(user_id, 0)
+            owners[user_id] += count
+    return codes, sorted(owners, key=int)
+
+
+class RedisCounts:
+    """Redis commands and round trips this thread has recorded so far, from metrics.py."""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.shard = metrics.registry.shard()
+
+    def read(self):
+        commands = round_trips = 0
+        for (name, _), value in list(self.shard.items()):
+            if name == self.metrics.REDIS_COMMANDS.name:
+                commands += value
+            elif name == self.metrics.REDIS_DURATION.name:
+                round_trips += sum(value[:-1])
+        return commands, round_trips
+
+
+def run(args):
+    r = make_redis(args.redis_url)
+    import shortener, clicks, storage, trending, metrics, app as app_module
+    from flask_jwt_extended import create_access_token
+    from redis_client import InstrumentedRedis
+    from worker import celery
+
+    # Preview fetches are queued, not run: on the benchmarked Redis, or in memory with fakeredis.
+    celery.conf.broker_url = args.redis_url or "memory://"
+    client = InstrumentedRedis(connection_pool=r.connection_pool)
+    use_redis(client, shortener, clicks, storage, trending, app_module)
+    app_module.limiter.enabled = False
+    app = app_module.app
+
+    started = time.perf_counter()
+    codes, owners = seed(storage, args.links, args.users)
+    seed_seconds = time.perf_counter() - started
+    with app.app_context():
+        tokens = {user_id: f"Bearer {create_access_token(identity=user_id)}" for user_id in owners}
+
+    rng = random.Random(args.seed)
+    # Ranks are shuffled onto codes so the hot links are spread over the keyspace.
+    hot_codes = rng.sample(codes, len(codes))
+    code_weights = zipf_weights(len(hot_codes), args.zipf)
+    user_weights = zipf_weights(len(owners), args.zipf)
+    mix = parse_mix(args.mix)
+    routes = rng.choices(list(mix), weights=list(mix.values()), k=args.requests)
+
+    def build(i, route):
+        ip = f"10.{i % 7}.{rng.randrange(256)}.{rng.randrange(256)}"
+        base = {"REMOTE_ADDR": ip}
+        if route == "redirect":
+            code = rng.choices(hot_codes, cum_weights=code_weights)[0]
+            return EnvironBuilder(path=f"/{code}", environ_base=base).get_environ()
+        if route == "stats":
+            code = rng.choices(hot_codes, cum_weights=code_weights)[0]
+            return EnvironBuilder(path=f"/stats/{code}", environ_base=base).get_environ()
+        if route == "shorten":
+            # A quarter of shortens repeat a popular long URL and find the existing link.
+            url = (f"https://example.com/page/{rng.randrange(min(100, args.links))}" if rng.random() < 0.25
+                   else f"https://example.org/new/{i}")
+            return EnvironBuilder(path="/shorten", method="POST", json={"url": url},
+                                  environ_base=base).get_environ()
+        user_id = rng.choices(owners, cum_weights=user_weights)[0]
+        return EnvironBuilder(path="/my-links", query_string={"limit": 20}, environ_base=base,
+                              headers={"Authorization": tokens[user_id]}).get_environ()
+
+    requests = [(route, build(i, route)) for i, route in enumerate(routes)]
+
+    samples = {route: [] for route in mix}
+    redis_commands = dict.fromkeys(mix, 0)
+    redis_round_trips = dict.fromkeys(mix, 0)
+    errors = dict.fromkeys(mix, 0)
+    statuses = []
+    counts = RedisCounts(metrics)
+
+    def start_response(status, headers, exc_info=None):
+        statuses.append(int(status.split(" ", 1)[0]))
+
+    wall = time.perf_counter()
+    for route, environ in requests:
+        before = counts.read()
+        start = time.perf_counter()
+        for _ in app.wsgi_app(environ, start_response):
+            pass
+        elapsed = time.perf_counter() - start
+        after = counts.read()
+        samples[route].append(elapsed)
+        redis_commands[route] += after[0] - before[0]
+        redis_round_trips[route] += after[1] - before[1]
+        if statuses.pop() >= 500:
+            errors[route] += 1
+    wall = time.perf_counter() - wall
+
+    results = {}
+    for route, route_samples in samples.items():
+        if not route_samples:
+            continue
+        n = len(route_samples)
+        summary = summarize(route_samples)
+        results[route] = {
+            "requests": n,
+            "throughput_rps": n / sum(route_samples),
+            "mean_ms": summary["mean_ms"],
+            "p50_ms": summary["p50_ms"],
+            "p95_ms": summary["p95_ms"],
+            "p99_ms": summary["p99_ms"],
+            "redis_commands_per_request": redis_commands[route] / n,
+            "redis_round_trips_per_request": redis_round_trips[route] / n,
+            "errors": errors[route],
+        }
+
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "redis": "real" if args.redis_url else "fakeredis",
+        "settings": {
+            "links": args.links, "users": args.users, "requests": args.requests,
+            "mix": mix, "zipf": args.zipf, "seed": args.seed,
+        },
+        "seed_seconds": seed_seconds,
+        "total": {"requests": args.requests, "throughput_rps": args.requests / wall},
+        "routes": results,
+    }
+
+
+def compare(current, baseline, threshold):
+    """Return the regressions of ``current`` against ``baseline`` as printable lines."""
+    regressions = []
+    if current["settings"] != baseline["settings"]:
+        print("warning: the runs used different settings", file=sys.stderr)
+    for route, now in current["routes"].items():
+        before = baseline["routes"].get(route)
+        if before is None:
+            continue
+        checks = [
+            ("p50_ms", now["p50_ms"] / before["p50_ms"] - 1),
+            ("throughput_rps", before["throughput_rps"] / now["throughput_rps"] - 1),
+        ]
+        samples = min(now["requests"], before["requests"])
+        if samples >= MIN_P99_SAMPLES:
+            checks.append(("p99_ms", now["p99_ms"] / before["p99_ms"] - 1))
+        else:
+            print(f"note: {route} p99 not checked, {samples} requests < {MIN_P99_SAMPLES}",
+                  file=sys.stderr)
+        for metric, worse_by in checks:
+            if worse_by > threshold:
+                regressions.append(f"{route} {metric}: {before[metric]:.3f} -> {now[metric]:.3f} "
+                                   f"({worse_by:+.0%} worse)")
+    return regressions
+
+
+def print_results(results, baseline=None):
+    print(f"{'route':<10} {'req':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'cmds':>6} {'trips':>6}" + ("  vs baseline p50/p99" if baseline else ""))
+    for route, row in results["routes"].items():
+        line = (f"{route:<10} {row['requests']:>7} {row['throughput_rps']:>9,.0f} {row['p50_ms']:>8.3f} "
+                f"{row['p95_ms']:>8.3f} {row['p99_ms']:>8.3f} {row['redis_commands_per_request']:>6.2f} "
+                f"{row['redis_round_trips_per_request']:>6.2f}")
+        before = (baseline or {}).get("routes", {}).get(route)
+        if before:
+            line += (f"  {row['p50_ms'] / before['p50_ms'] - 1:+.0%}"
+                     f"/{row['p99_ms'] / before['p99_ms'] - 1:+.0%}")
+        print(line)
+    print(f"total: {results['total']['throughput_rps']:,.0f} req/s (seeded {results['settings']['links']} "
+          f"links in {results['seed_seconds']:.1f}s)")
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--links", type=int, default=50000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--mix", default="redirect=80,stats=10,shorten=7,my_links=3",
+                        help="Route weights, e.g. redirect=80,stats=10,shorten=7,my_links=3")
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent of code and user popularity")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Flag regressions against the results in this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Relative slowdown flagged as a regression (default 20%%)")
+    args = parser.parse_args()
+
+    results = run(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"results written to {args.output}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions beyond {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
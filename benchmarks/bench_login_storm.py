@@ -0,0 +1,70 @@
+"""Redirect latency during a login storm, with hashing inline vs. on the pool.
+
+Measures redirects through the app alone, then while ``--storm`` threads
+send logins as fast as they can: once with argon2 run on the request
+threads (``PASSWORD_HASH_WORKERS=0``) and once on the bounded pool, where
+logins beyond its capacity get a 503 and wait out its ``Retry-After``.
+The pool hashes on up to ``workers * ARGON2_PARALLELISM`` cores and leaves
+the rest to redirects, so on small machines lower ``ARGON2_PARALLELISM``.
+
+    python -m benchmarks.bench_login_storm [--redis-url redis://localhost:6379/15]
+"""
+import os
+import threading
+import time
+from collections import Counter
+
+from benchmarks.common import base_parser, make_redis, use_redis, timed, summarize, print_row
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--iterations", type=int, default=3000)
+    parser.add_argument("--storm", type=int, default=8,
+                        help="Concurrent login threads")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="Hashing pool size")
+    args = parser.parse_args()
+
+    r = make_redis(args.redis_url)
+    import shortener, clicks, storage, trending, app as app_module
+    from config import Config
+    use_redis(r, shortener, clicks, storage, trending, app_module)
+    app_module.limiter.enabled = False
+    app = app_module.app
+
+    r.set("url:bench", "https://example.com/bench")
+    credentials = {"email": "storm@example.com", "password": "password123"}
+    app.test_client().post("/auth/register", json=credentials)
+
+    def redirects(label):
+        client = app.test_client()
+        print_row(label, summarize(timed(lambda i: client.get("/bench"), args.iterations)))
+
+    def storm(statuses, stop):
+        client = app.test_client()
+        while not stop.is_set():
+            response = client.post("/auth/login", json=credentials)
+            statuses[response.status_code] += 1
+            if response.status_code == 503:
+                stop.wait(float(response.headers["Retry-After"]))
+
+    redirects("no logins")
+    for label, workers in (("storm, inline hashing", 0), ("storm, hashing pool", args.workers)):
+        Config.PASSWORD_HASH_WORKERS = workers
+        statuses, stop = Counter(), threading.Event()
+        threads = [threading.Thread(target=storm, args=(statuses, stop)) for _ in range(args.storm)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.5)
+        start = time.perf_counter()
+        redirects(label)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        for thread in threads:
+            thread.join()
+        print(f"  logins/s: {statuses[200] / elapsed:,.1f} ok, {statuses[503] / elapsed:,.1f} refused (503)")
+
+
+if __name__ == "__main__":
+    main()
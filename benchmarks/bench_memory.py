@@ -0,0 +1,70 @@
+"""Memory per link: the default key layout vs. LINK_LAYOUT=compact.
+
+Creates the same links in each layout, half of them owned by a user, adds a
+click to each, and reports Redis keys and bytes (``used_memory`` delta) per
+link. A third run creates the links in the default layout and converts them
+with the migration. fakeredis does not model memory, so without
+``--redis-url`` only key counts are reported.
+
+    python -m benchmarks.bench_memory --redis-url redis://localhost:6379/15
+"""
+from benchmarks.common import base_parser, make_redis, use_redis
+
+
+def used_memory(r):
+    try:
+        return r.info("memory")["used_memory"]
+    except Exception:
+        return None
+
+
+def create_links(shortener, clicks, n, chunk_size):
+    for start in range(0, n, chunk_size):
+        end = min(start + chunk_size, n)
+        owned = [(f"https://example.com/articles/{i}?ref=newsletter", None)
+                 for i in range(start, end) if i % 2]
+        anonymous = [(f"https://example.com/articles/{i}?ref=newsletter", None)
+                     for i in range(start, end) if not i % 2]
+        links = shortener.shorten_many(owned, 604800, user_id="42")
+        links += shortener.shorten_many(anonymous, 86400)
+        clicks.write_click_counts({link["short_code"]: 1 for link in links}, {}, {})
+
+
+def report(label, r, n, before):
+    after = used_memory(r)
+    line = f"{label:<20} {r.dbsize() / n:5.2f} keys/link"
+    if before is not None and after is not None:
+        line += f"  {(after - before) / n:7.1f} bytes/link"
+    print(line)
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--links", type=int, default=100000)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    r = make_redis(args.redis_url)
+    import shortener, clicks
+    from config import Config
+    from migrations import migrate_to_compact_layout
+    use_redis(r, shortener, clicks)
+
+    for layout in ("keys", "compact"):
+        r.flushdb()
+        Config.LINK_LAYOUT = layout
+        before = used_memory(r)
+        create_links(shortener, clicks, args.links, args.chunk_size)
+        report(layout, r, args.links, before)
+
+    r.flushdb()
+    Config.LINK_LAYOUT = "keys"
+    before = used_memory(r)
+    create_links(shortener, clicks, args.links, args.chunk_size)
+    migrate_to_compact_layout(r, batch_size=args.chunk_size)
+    report("keys -> migrated", r, args.links, before)
+    Config.LINK_LAYOUT = "keys"
+
+
+if __name__ == "__main__":
+    main()
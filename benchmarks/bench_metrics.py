@@ -0,0 +1,67 @@
+"""Cost of metrics on the redirect fast path.
+
+Drives the redirect fast path in-process with the same traffic twice: with
+plain clients and no metrics middleware, then with ``WSGIMetrics`` in front
+and the Redis client wrapped in ``InstrumentedRedis``.
+
+    python -m benchmarks.bench_metrics [--redis-url redis://localhost:6379/15]
+"""
+import random
+import time
+
+from werkzeug.test import EnvironBuilder
+
+from benchmarks.common import base_parser, make_redis, use_redis, timed, summarize, print_row
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--links", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=10000)
+    args = parser.parse_args()
+
+    r = make_redis(args.redis_url)
+    import shortener, clicks, storage, trending, metrics, app as app_module
+    from fastpath import RedirectMiddleware
+    from redis_client import InstrumentedRedis
+    app_module.limiter.enabled = False
+
+    codes = [f"bench{i}" for i in range(args.links)]
+    pipe = r.pipeline(transaction=False)
+    for code in codes:
+        pipe.set(f"url:{code}", f"https://example.com/{code}")
+    pipe.execute()
+    instrumented = InstrumentedRedis(connection_pool=r.connection_pool)
+
+    rng = random.Random(42)
+    environs = [
+        EnvironBuilder(path=f"/{rng.choice(codes)}", environ_base={"REMOTE_ADDR": f"10.0.0.{i % 256}"}).get_environ()
+        for i in range(args.iterations)
+    ]
+
+    def start_response(status, headers, exc_info=None):
+        pass
+
+    fast_path = app_module.app.wsgi_app
+    while not isinstance(fast_path, RedirectMiddleware):
+        fast_path = fast_path.wsgi_app
+
+    for label, client, wsgi_app in (
+        ("metrics off", r, fast_path),
+        ("metrics on", instrumented, metrics.WSGIMetrics(fast_path)),
+    ):
+        use_redis(client, shortener, clicks, storage, trending, app_module)
+
+        def request(i):
+            for _ in wsgi_app(dict(environs[i]), start_response):
+                pass
+
+        start = time.perf_counter()
+        samples = timed(request, args.iterations)
+        elapsed = time.perf_counter() - start
+        print_row(label, summarize(samples))
+        print(f"  {args.iterations / elapsed:,.0f} req/s")
+
+
+if __name__ == "__main__":
+    main()
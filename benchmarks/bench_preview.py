@@ -0,0 +1,55 @@
+"""Preview fetch throughput against the local stub server in tests/http_stub.py.
+
+Compares the old per-task fetch (a new connection per URL, whole body
+downloaded and parsed) with the PreviewFetcher, one URL at a time and as a
+concurrent batch. ``--delay`` adds server latency to model remote sites.
+The stub server shares this process' GIL, so it caps the concurrent rate;
+against real sites, where latency dominates, threads scale further.
+
+    python -m benchmarks.bench_preview [--urls 200] [--kb 256] [--delay 0.02]
+"""
+import argparse
+import time
+
+import requests
+
+import preview
+from tests.http_stub import StubServer
+
+
+def legacy_fetch(url):
+    response = requests.get(url, timeout=5)
+    parser = preview.HeadParser()
+    parser.feed(response.text)
+    return parser.title
+
+
+def rate(label, fn, urls):
+    start = time.perf_counter()
+    fn(urls)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {len(urls) / elapsed:8.1f} previews/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--urls", type=int, default=200)
+    parser.add_argument("--kb", type=int, default=256, help="Body size after the head")
+    parser.add_argument("--delay", type=float, default=0.02, help="Server latency in seconds")
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    with StubServer() as server:
+        urls = [f"{server.url}/large?kb={args.kb}&delay={args.delay}&n={i}" for i in range(args.urls)]
+        fetcher = preview.PreviewFetcher(timeout=5, max_bytes=65536,
+                                         concurrency=args.concurrency, pool_hosts=10,
+                                         per_host=args.concurrency)
+
+        rate("legacy (new conn, full body)", lambda batch: [legacy_fetch(url) for url in batch], urls)
+        rate("fetcher, sequential", lambda batch: [fetcher.fetch(url) for url in batch], urls)
+        rate(f"fetcher, {args.concurrency} threads", fetcher.fetch_many, urls)
+        print(f"  {fetcher.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Rate limiter overhead per request: Redis fixed window vs. the hybrid storage.
+
+Calls the limiter's ``hit`` the way flask-limiter does for each request, for
+a set of client IPs under the redirect limit, with the plain limits Redis
+storage and with ``HybridStorage``.
+
+    python -m benchmarks.bench_ratelimit [--redis-url redis://localhost:6379/15]
+"""
+import random
+import time
+
+from limits import parse
+from limits.storage import RedisStorage
+from limits.strategies import FixedWindowRateLimiter, SlidingWindowCounterRateLimiter
+
+from benchmarks.common import base_parser, make_redis, timed, summarize, print_row
+from ratelimit import HybridStorage
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--limit", default="100 per minute")
+    parser.add_argument("--local-share", type=float, default=0.1)
+    args = parser.parse_args()
+
+    r = make_redis(args.redis_url)
+    pool = r.connection_pool
+    limit = parse(args.limit)
+    rng = random.Random(42)
+    ips = [f"10.0.{rng.randrange(256)}.{rng.randrange(256)}" for _ in range(args.clients)]
+    traffic = [rng.choice(ips) for _ in range(args.iterations)]
+
+    hybrid = HybridStorage(connection_pool=pool, local_share=args.local_share)
+    limiters = (
+        ("redis fixed-window", FixedWindowRateLimiter(RedisStorage("redis://", connection_pool=pool))),
+        ("hybrid sliding-window", SlidingWindowCounterRateLimiter(hybrid)),
+    )
+    for label, limiter in limiters:
+        r.flushdb()
+        admitted = 0
+
+        def request(i):
+            nonlocal admitted
+            admitted += limiter.hit(limit, "bench", traffic[i])
+
+        start = time.perf_counter()
+        samples = timed(request, args.iterations)
+        elapsed = time.perf_counter() - start
+        print_row(label, summarize(samples))
+        print(f"  {args.iterations / elapsed:,.0f} checks/s, {admitted} admitted")
+    print(f"hybrid storage synced {hybrid.syncs} times")
+
+
+if __name__ == "__main__":
+    main()
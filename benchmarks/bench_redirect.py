@@ -0,0 +1,78 @@
+"""Redirect latency: legacy per-command calls vs. the single round-trip path.
+
+    python -m benchmarks.bench_redirect [--redis-url redis://localhost:6379/15]
+"""
+import random
+
+from benchmarks.common import base_parser, make_redis, use_redis, timed, summarize, print_row
+
+
+def legacy_redirect(r, short_code, ip):
+    long_url = r.get(f"url:{short_code}")
+    if not long_url:
+        return None
+    r.incr(f"clicks:{short_code}")
+    r.incr(f"clicks:{short_code}:ip:{ip}")
+    return long_url
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--links", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+
+    r = make_redis(args.redis_url)
+
+    import shortener, clicks, trending, app as app_module
+    from cache import LinkCache
+    from clicks import ClickBuffer
+    from config import Config
+    use_redis(r, shortener, clicks, trending, app_module)
+    app_module.limiter.enabled = False
+
+    codes = [f"bench{i}" for i in range(args.links)]
+    pipe = r.pipeline(transaction=False)
+    for code in codes:
+        pipe.set(f"url:{code}", f"https://example.com/{code}")
+    pipe.execute()
+
+    rng = random.Random(42)
+    traffic = [(rng.choice(codes), f"10.0.{rng.randrange(256)}.{rng.randrange(256)}")
+               for _ in range(args.iterations)]
+
+    print_row("legacy (GET+INCR+INCR)", summarize(
+        timed(lambda i: legacy_redirect(r, *traffic[i]), args.iterations)))
+
+    Config.CLICK_COUNT_MODE = "sync"
+    print_row("scripted (1 round trip)", summarize(
+        timed(lambda i: clicks.resolve_and_count(*traffic[i]), args.iterations)))
+
+    Config.CLICK_COUNT_MODE = "async"
+    print_row("async counting (1 GET)", summarize(
+        timed(lambda i: clicks.resolve_and_count(*traffic[i]), args.iterations)))
+
+    Config.CLICK_COUNT_MODE = "buffered"
+    clicks.click_buffer = ClickBuffer(flush_interval=1.0, flush_threshold=1000, max_pending=100000)
+    print_row("buffered counting (1 GET)", summarize(
+        timed(lambda i: clicks.resolve_and_count(*traffic[i]), args.iterations)))
+    clicks.click_buffer.flush()
+    print(f"  buffer: {clicks.click_buffer.flushes} flushes for {args.iterations} clicks")
+    clicks.click_buffer = None
+    Config.CLICK_COUNT_MODE = "sync"
+
+    clicks.link_cache = LinkCache(maxsize=args.links, ttl=60, negative_ttl=5)
+    print_row("cached lookup + counters", summarize(
+        timed(lambda i: clicks.resolve_and_count(*traffic[i]), args.iterations)))
+    print(f"  cache: {clicks.link_cache.stats()}")
+    clicks.link_cache = None
+
+    client = app_module.app.test_client()
+    print_row("GET /<code> (scripted)", summarize(
+        timed(lambda i: client.get(f"/{traffic[i][0]}",
+                                   environ_base={"REMOTE_ADDR": traffic[i][1]}),
+              args.iterations)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Redirect throughput of the WSGI (threaded) and ASGI (asyncio) serving modes.
+
+Drives the apps in-process, without an HTTP server, at the same concurrency
+and reports requests/sec of wall time and of CPU time; the latter is the
+requests/sec one fully busy core sustains.
+
+    python -m benchmarks.bench_serving [--redis-url redis://localhost:6379/15]
+"""
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.test import EnvironBuilder
+
+from benchmarks.common import base_parser, make_redis, use_redis
+
+
+def report(label, requests, wall, cpu):
+    print(f"{label:<8} {requests} requests  {requests / wall:9.0f} req/s  "
+          f"{requests / cpu:9.0f} req/s per core  (wall {wall:.2f}s, cpu {cpu:.2f}s)")
+
+
+def run_wsgi(app, paths, concurrency):
+    environs = [EnvironBuilder(path=path, environ_base={"REMOTE_ADDR": ip}).get_environ()
+                for path, ip in paths]
+
+    def start_response(status, headers, exc_info=None):
+        pass
+
+    def request(environ):
+        for _ in app.wsgi_app(dict(environ), start_response):
+            pass
+
+    wall, cpu = time.perf_counter(), time.process_time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(request, environs))
+    return time.perf_counter() - wall, time.process_time() - cpu
+
+
+def run_asgi(application, paths, concurrency):
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    async def request(path, ip):
+        scope = {"type": "http", "method": "GET", "path": path, "query_string": b"",
+                 "headers": [], "client": (ip, 1234)}
+        await application(scope, receive, send)
+
+    async def main():
+        queue = iter(paths)
+
+        async def worker():
+            for path, ip in queue:
+                await request(path, ip)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    wall, cpu = time.perf_counter(), time.process_time()
+    asyncio.run(main())
+    return time.perf_counter() - wall, time.process_time() - cpu
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--links", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    r = make_redis(args.redis_url)
+    if args.redis_url:
+        import redis.asyncio
+        ar = redis.asyncio.Redis.from_url(args.redis_url, decode_responses=True)
+    else:
+        import fakeredis
+        ar = fakeredis.aioredis.FakeRedis(
+            server=r.connection_pool.connection_kwargs["server"], decode_responses=True)
+
+    import shortener, clicks, trending, asgi, app as app_module
+    use_redis(r, shortener, clicks, trending, app_module)
+    for module in (shortener, clicks, asgi):
+        module.ar = ar
+    app_module.limiter.enabled = False
+
+    codes = [f"bench{i}" for i in range(args.links)]
+    pipe = r.pipeline(transaction=False)
+    for code in codes:
+        pipe.set(f"url:{code}", f"https://example.com/{code}")
+    pipe.execute()
+
+    rng = random.Random(42)
+    paths = [(f"/{rng.choice(codes)}", f"10.0.{rng.randrange(256)}.{rng.randrange(256)}")
+             for _ in range(args.requests)]
+
+    report("wsgi", args.requests, *run_wsgi(app_module.app, paths, args.concurrency))
+    report("asgi", args.requests, *run_asgi(asgi.application, paths, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Storage backends: shorten and redirect throughput, Redis vs. SQLite.
+
+Runs the same workload through ``storage.make_storage`` for each backend:
+creating links, then resolving and counting random clicks on them, from one
+thread and from ``--threads`` threads at once.
+
+    python -m benchmarks.bench_storage --redis-url redis://localhost:6379/15
+"""
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import base_parser, make_redis, use_redis, timed, summarize, print_row
+
+
+def throughput(fn, n, threads):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(fn, range(n)))
+    return n / (time.perf_counter() - start)
+
+
+def run(label, backend, args):
+    rng = random.Random(42)
+    codes = [backend.links.shorten(f"https://example.com/{label}/{i}", 86400)["short_code"]
+             for i in range(args.links)]
+    traffic = [(rng.choice(codes), f"10.0.{rng.randrange(256)}.{rng.randrange(256)}")
+               for _ in range(args.iterations)]
+
+    print_row(f"{label} shorten", summarize(timed(
+        lambda i: backend.links.shorten(f"https://example.com/{label}/new/{i}", 86400),
+        args.iterations)))
+    print_row(f"{label} redirect", summarize(timed(
+        lambda i: backend.links.resolve_and_count(*traffic[i]), args.iterations)))
+    rate = throughput(lambda i: backend.links.resolve_and_count(*traffic[i]),
+                      args.iterations, args.threads)
+    print(f"  {args.threads} threads: {rate:,.0f} redirects/s")
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--links", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    r = make_redis(args.redis_url)
+    import shortener, clicks, storage, trending
+    from config import Config
+    use_redis(r, shortener, clicks, storage, trending)
+    Config.CLICK_COUNT_MODE = "sync"
+
+    run("redis", storage.make_storage("redis"), args)
+    with tempfile.TemporaryDirectory() as tmp:
+        run("sqlite", storage.make_storage("sqlite", os.path.join(tmp, "bench.db")), args)
+
+
+if __name__ == "__main__":
+    main()
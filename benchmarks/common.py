@@ -0,0 +1,60 @@
+import argparse
+import statistics
+import time
+
+import redis
+
+
+def base_parser(description):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "--redis-url",
+        help="Benchmark against a real Redis (e.g. redis://localhost:6379/15). "
+             "Defaults to an in-process fakeredis instance.",
+    )
+    return parser
+
+
+def make_redis(redis_url=None):
+    if redis_url:
+        client = redis.Redis.from_url(redis_url, decode_responses=True)
+        client.flushdb()
+        return client
+
+    import fakeredis
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def use_redis(client, *modules):
+    """Point the module-level ``r`` of each given module at ``client``."""
+    for module in modules:
+        module.r = client
+
+
+def timed(fn, iterations):
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    n = len(ordered)
+    return {
+        "count": n,
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": ordered[int(n * 0.50)] * 1000,
+        "p95_ms": ordered[min(n - 1, int(n * 0.95))] * 1000,
+        "p99_ms": ordered[min(n - 1, int(n * 0.99))] * 1000,
+    }
+
+
+def print_row(label, summary):
+    print(
+        f"{label:<28} n={summary['count']:<7} "
+        f"p50={summary['p50_ms']:.3f}ms p99={summary['p99_ms']:.3f}ms "
+        f"mean={summary['mean_ms']:.3f}ms"
+    )
@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache with a per-entry expiry.
+
+    ``get`` returns ``MISSING`` when the key is absent or expired, so
+    ``None`` can be cached as a negative result.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+
+            value, expires_at = entry
+            if expires_at <= now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return MISSING
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class LinkCache(TTLCache):
+    """Short code -> long URL cache with negative caching of unknown codes."""
+
+    def __init__(self, maxsize, ttl, negative_ttl):
+        super().__init__(maxsize, ttl)
+        self.negative_ttl = negative_ttl
+        self.negative_hits = 0
+
+    def get(self, key):
+        value = super().get(key)
+        if value is None:
+            self.negative_hits += 1
+        return value
+
+    def set_missing(self, key):
+        self.set(key, None, ttl=self.negative_ttl)
+
+    def stats(self):
+        stats = super().stats()
+        stats["negative_hits"] = self.negative_hits
+        return stats
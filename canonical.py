@@ -0,0 +1,69 @@
+"""Canonical form of long URLs, so one page gets one short code.
+
+Links keep the URL they were submitted with, which is what redirects send
+visitors to; the canonical form only keys the dedup index. Both key layouts
+and the SQLite backend find an existing link through a digest of it
+(``long_to_short:{digest}``, or the compact layout's ``l2s:`` buckets)
+rather than the URL itself.
+"""
+import hashlib
+from urllib.parse import unquote_plus, urlsplit, urlunsplit
+
+from config import Config
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def is_stripped(name):
+    """Whether the query parameter ``name`` matches ``URL_STRIP_PARAMS``."""
+    name = name.lower()
+    return any(name.startswith(pattern[:-1]) if pattern.endswith("*") else name == pattern
+               for pattern in Config.URL_STRIP_PARAMS)
+
+
+def canonicalize(url):
+    """Return the canonical form of an absolute http(s) URL; raises ValueError.
+
+    The scheme and host are lowercased, an internationalized host is IDNA
+    encoded, the default port is dropped and an empty path becomes ``/``.
+    Query parameters matching ``URL_STRIP_PARAMS`` are removed and the rest
+    sorted by name, keeping their encoding and the order of repeated names.
+    The fragment is kept, since it can change what the page shows.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS or not parts.hostname:
+        raise ValueError("Invalid URL")
+    try:
+        port = parts.port
+        host = parts.hostname
+        if not host.isascii():
+            host = host.encode("idna").decode("ascii")
+    except (ValueError, UnicodeError):
+        raise ValueError("Invalid URL")
+
+    if ":" in host:
+        host = f"[{host}]"
+    if port is not None and port != DEFAULT_PORTS[scheme]:
+        host = f"{host}:{port}"
+    if "@" in parts.netloc:
+        host = f"{parts.netloc.rpartition('@')[0]}@{host}"
+
+    params = [param for param in parts.query.split("&")
+              if param and not is_stripped(unquote_plus(param.partition("=")[0]))]
+    query = "&".join(sorted(params, key=lambda param: param.partition("=")[0]))
+    return urlunsplit((scheme, host, parts.path or "/", query, parts.fragment))
+
+
+def dedup_key(long_url):
+    """What two long URLs must share to be one link: the canonical form, or
+    the URL itself if it has none (links stored before canonicalization)."""
+    try:
+        return canonicalize(long_url)
+    except ValueError:
+        return long_url
+
+
+def url_digest(long_url):
+    """64-bit hex digest that indexes a link by its canonical long URL."""
+    return hashlib.blake2b(dedup_key(long_url).encode(), digest_size=8).hexdigest()
@@ -0,0 +1,204 @@
+"""Removal of expired links from the ``user:{id}:link_index`` sorted sets.
+
+Links expire on their own but index entries do not, so they are unlinked in
+three complementary ways:
+
+* ``run_expiry_listener`` follows Redis keyspace expiry notifications and
+  unlinks each link as soon as its ``url:{code}`` (or, in the compact
+  layout, ``link:{code}``) key expires;
+* ``drain_expired_links`` walks the ``links:expiring`` schedule written by the
+  shorten script, catching whatever expired while no listener was running;
+* ``sweep_link_indexes`` scans every index in small slices from a persisted
+  cursor, for entries older than the schedule or otherwise left behind.
+
+Run the listener with ``python cleanup.py``.
+"""
+import json
+import logging
+import time
+
+from redis.exceptions import ResponseError
+
+import compact
+from config import Config
+from redis_client import get_redis
+from shortener import EXPIRING_KEY, OWNER_KEY
+
+logger = logging.getLogger(__name__)
+
+SWEEP_CURSOR_KEY = "cleanup:cursor"
+STATS_KEY = "cleanup:stats"
+
+# Unlinks an expired link from its owner's index and the expiry schedule.
+# A link that is still alive is rescheduled (or dropped from the schedule when
+# it no longer expires) instead.
+# KEYS: url:{code} (link:{code} in the compact layout), links:expiring, links:owner
+# ARGV: code, now
+# Returns 1 when an index entry was removed, 0 otherwise.
+# The script also writes user:{owner}:link_index, a key it only learns from
+# links:owner and so cannot declare in KEYS. Like the shorten script it
+# assumes a single Redis instance (or a replicated primary); on Redis Cluster
+# the keys would need a common hash tag to be in one slot.
+UNLINK_LUA = """
+local ttl = redis.call('TTL', KEYS[1])
+if ttl > 0 then
+    redis.call('ZADD', KEYS[2], tonumber(ARGV[2]) + ttl, ARGV[1])
+    return 0
+elseif ttl == -1 then
+    redis.call('ZREM', KEYS[2], ARGV[1])
+    return 0
+end
+
+local owner = redis.call('HGET', KEYS[3], ARGV[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[3], ARGV[1])
+if owner then
+    return redis.call('ZREM', 'user:' .. owner .. ':link_index', ARGV[1])
+end
+return 0
+"""
+UNLINK_SCRIPT = get_redis().register_script(UNLINK_LUA)
+
+
+def _unlink(client, short_code, now):
+    link_key = compact.link_key(short_code) if compact.enabled() else f"url:{short_code}"
+    keys = [link_key, EXPIRING_KEY, OWNER_KEY]
+    return UNLINK_SCRIPT(keys=keys, args=[short_code, now], client=client)
+
+
+def drain_expired_links(client, batch_size=500, max_links=10000):
+    """Unlink every scheduled link whose expiry has passed.
+
+    Works through ``links:expiring`` oldest first, one pipeline of unlink
+    scripts per batch, and stops after ``max_links`` so a backlog is spread
+    over several runs. Returns ``{"scanned": n, "removed": n}``.
+    """
+    stats = {"scanned": 0, "removed": 0}
+    now = time.time()
+
+    while stats["scanned"] < max_links:
+        count = min(batch_size, max_links - stats["scanned"])
+        due = client.zrangebyscore(EXPIRING_KEY, "-inf", now, start=0, num=count)
+        if not due:
+            break
+
+        pipe = client.pipeline(transaction=False)
+        for short_code in due:
+            _unlink(pipe, short_code, now)
+        stats["scanned"] += len(due)
+        stats["removed"] += sum(pipe.execute())
+
+        if len(due) < count:
+            break
+
+    return stats
+
+
+def _sweep_index(client, key, batch_size, stats):
+    user_id = key.split(":")[1]
+    codes = [code for code, _ in client.zscan_iter(key, count=batch_size)]
+
+    for i in range(0, len(codes), batch_size):
+        batch = codes[i:i + batch_size]
+        pipe = client.pipeline(transaction=False)
+        for short_code in batch:
+            if compact.enabled():
+                pipe.hget(compact.link_key(short_code), "o")
+            else:
+                pipe.get(f"metadata:{short_code}")
+        owners = pipe.execute()
+        if not compact.enabled():
+            owners = [json.loads(metadata).get("user_id") if metadata else None for metadata in owners]
+
+        # A missing or foreign owner means the link expired, and its code may
+        # since have been reused for someone else's link.
+        dead = [short_code for short_code, owner in zip(batch, owners) if owner != user_id]
+        if dead:
+            stats["removed"] += client.zrem(key, *dead)
+        stats["links"] += len(batch)
+
+
+def sweep_link_indexes(client, batch_size=500, max_indexes=1000):
+    """Remove dead entries from the next slice of link indexes.
+
+    Resumes the SCAN from the cursor saved by the previous run and saves
+    where it stopped, so a full pass over all users is spread across runs
+    of at most ``max_indexes`` indexes each. Returns
+    ``{"indexes": n, "links": n, "removed": n, "pass_completed": bool}``.
+    """
+    stats = {"indexes": 0, "links": 0, "removed": 0}
+    cursor = int(client.get(SWEEP_CURSOR_KEY) or 0)
+
+    while True:
+        cursor, keys = client.scan(cursor, match="user:*:link_index", count=batch_size)
+        for key in keys:
+            _sweep_index(client, key, batch_size, stats)
+        stats["indexes"] += len(keys)
+        if cursor == 0 or stats["indexes"] >= max_indexes:
+            break
+
+    client.set(SWEEP_CURSOR_KEY, cursor)
+    stats["pass_completed"] = cursor == 0
+    return stats
+
+
+def record_run(client, stats):
+    """Add a run's counters to the running totals in ``cleanup:stats``."""
+    pipe = client.pipeline(transaction=False)
+    for name, value in stats.items():
+        pipe.hincrby(STATS_KEY, name, int(value))
+        pipe.hset(STATS_KEY, f"last_{name}", int(value))
+    pipe.hincrby(STATS_KEY, "runs", 1)
+    pipe.hset(STATS_KEY, "last_run_at", int(time.time()))
+    pipe.execute()
+
+
+def handle_expired_key(client, key):
+    """Unlink the link behind an expired ``url:{code}`` or ``link:{code}`` key; other keys are ignored."""
+    prefix, _, short_code = key.partition(":")
+    if prefix != ("link" if compact.enabled() else "url") or not short_code:
+        return 0
+    return _unlink(client, short_code, time.time())
+
+
+def enable_expiry_notifications(client):
+    """Turn on expired-key events, keeping any notification classes already set."""
+    flags = client.config_get("notify-keyspace-events").get("notify-keyspace-events", "")
+    wanted = flags
+    if "E" not in wanted:
+        wanted += "E"
+    if "x" not in wanted and "A" not in wanted:
+        wanted += "x"
+    if wanted != flags:
+        client.config_set("notify-keyspace-events", wanted)
+
+
+def run_expiry_listener(client=None, should_stop=lambda: False):
+    """Unlink links as Redis expires them, until ``should_stop()`` is true.
+
+    Pub/sub delivery is at-most-once, so events missed while the listener is
+    down are picked up by the periodic ``drain_expired_links``.
+    """
+    client = client or get_redis()
+
+    if Config.CLEANUP_CONFIGURE_NOTIFICATIONS:
+        try:
+            enable_expiry_notifications(client)
+        except ResponseError as e:
+            # Managed Redis often disables CONFIG; set the option there instead.
+            logger.warning("Could not enable keyspace notifications: %s", e)
+
+    pubsub = client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(f"__keyevent@{Config.REDIS_DB}__:expired")
+    try:
+        while not should_stop():
+            message = pubsub.get_message(timeout=1.0)
+            if message:
+                handle_expired_key(client, message["data"])
+    finally:
+        pubsub.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    run_expiry_listener()
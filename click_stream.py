@@ -0,0 +1,315 @@
+"""Consumer of the click event stream written in ``stream`` mode.
+
+Redirects only append a compact event to ``clicks:stream``; this consumer
+reads them in batches through a consumer group and applies each batch in
+one transaction: the click counters, unique visitors and time series that
+the other modes write inline, plus per-link breakdowns by referrer, device,
+browser and country in ``analytics:{code}``, which expire with their link.
+
+    python click_stream.py consume          # run a consumer
+    python click_stream.py lag              # print consumer group metrics
+    python click_stream.py replay [START [END]] [--with-totals]
+"""
+import argparse
+import json
+import os
+import socket
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urlsplit
+
+from redis.exceptions import ResponseError
+
+import compact
+from clicks import STREAM_KEY, queue_click_counts
+from config import Config
+from redis_client import get_redis
+
+GROUP = "click-counters"
+STATS_KEY = "clicks:stream:stats"
+
+# Adds a batch's breakdown counts to a link that still exists and gives the
+# hash the link's remaining lifetime, so breakdowns never outlive their link.
+# KEYS: analytics:{code}, url:{code} (link:{code} in the compact layout)
+# ARGV: field/count pairs
+ADD_BREAKDOWN_LUA = """
+local ttl = redis.call('PTTL', KEYS[2])
+if ttl == -2 then
+    return
+end
+for i = 1, #ARGV, 2 do
+    redis.call('HINCRBY', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+if ttl > 0 then
+    redis.call('PEXPIRE', KEYS[1], ttl)
+end
+"""
+ADD_BREAKDOWN_SCRIPT = get_redis().register_script(ADD_BREAKDOWN_LUA)
+
+BOT_MARKERS = ("bot", "crawler", "spider", "slurp", "curl", "wget", "python-requests")
+# Checked in order: most browsers also claim to be the ones after them.
+BROWSERS = (
+    ("Edg/", "Edge"),
+    ("OPR/", "Opera"),
+    ("Firefox/", "Firefox"),
+    ("Chrome/", "Chrome"),
+    ("Safari/", "Safari"),
+)
+
+
+def referrer_domain(referrer):
+    host = urlsplit(referrer).hostname if referrer else None
+    if not host:
+        return "direct"
+    return host[4:] if host.startswith("www.") else host
+
+
+def device_type(user_agent):
+    ua = user_agent.lower()
+    if not ua:
+        return "unknown"
+    if any(marker in ua for marker in BOT_MARKERS):
+        return "bot"
+    if "ipad" in ua or "tablet" in ua:
+        return "tablet"
+    if "mobi" in ua or "iphone" in ua or "android" in ua:
+        return "mobile"
+    return "desktop"
+
+
+def browser_name(user_agent):
+    for token, name in BROWSERS:
+        if token in user_agent:
+            return name
+    return "other"
+
+
+def enrich(event):
+    """Return the breakdown fields a click event counts towards."""
+    user_agent = event.get("u", "")
+    return (
+        f"referrer:{referrer_domain(event.get('r', ''))}",
+        f"device:{device_type(user_agent)}",
+        f"browser:{browser_name(user_agent)}",
+        f"country:{event.get('g') or 'unknown'}",
+    )
+
+
+def breakdown(client, short_code):
+    """Return ``{"referrer": {...}, "device": {...}, ...}`` for one link."""
+    result = {"referrer": {}, "device": {}, "browser": {}, "country": {}}
+    for field, count in client.hgetall(f"analytics:{short_code}").items():
+        dimension, _, value = field.partition(":")
+        result.setdefault(dimension, {})[value] = int(count)
+    return result
+
+
+def apply_events(client, entries, ack=True, totals=True):
+    """Aggregate ``[(id, event), ...]`` and write the batch in one transaction.
+
+    With ``ack`` the entries are acknowledged in the same transaction, so a
+    batch is counted exactly once even if the consumer dies mid-way. Without
+    ``totals`` only the breakdowns are written, which is what a replay wants.
+    """
+    counts = Counter()
+    visitors = defaultdict(set)
+    minutes = Counter()
+    dimensions = defaultdict(Counter)
+
+    for entry_id, event in entries:
+        short_code = event["c"]
+        counts[short_code] += 1
+        visitors[short_code].add(event["i"])
+        minutes[(short_code, int(entry_id.split("-")[0]) // 60000 * 60)] += 1
+        dimensions[short_code].update(enrich(event))
+
+    pipe = client.pipeline()
+    if totals:
+        queue_click_counts(pipe, counts, visitors, minutes)
+    for short_code, fields in dimensions.items():
+        link_key = compact.link_key(short_code) if compact.enabled() else f"url:{short_code}"
+        args = [value for field, n in fields.items() for value in (field, n)]
+        ADD_BREAKDOWN_SCRIPT(keys=[f"analytics:{short_code}", link_key], args=args, client=pipe)
+    if ack and entries:
+        pipe.xack(STREAM_KEY, GROUP, *[entry_id for entry_id, _ in entries])
+        pipe.hincrby(STATS_KEY, "processed", len(entries))
+        pipe.hincrby(STATS_KEY, "batches", 1)
+        pipe.hset(STATS_KEY, "last_batch_size", len(entries))
+        pipe.hset(STATS_KEY, "last_batch_at", int(time.time()))
+    pipe.execute()
+
+
+def ensure_group(client):
+    try:
+        client.xgroup_create(STREAM_KEY, GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def _stream_id(entry_id):
+    ms, _, seq = entry_id.partition("-")
+    return int(ms), int(seq or 0)
+
+
+def claim_stale(client, consumer, batch_size, max_rounds=100):
+    """Process entries another consumer read but never acknowledged.
+
+    Walks the pending entries list with XAUTOCLAIM for at most ``max_rounds``
+    calls. Each entry is applied at most once per call, even if the cursor
+    hands it back again. Returns the number of entries claimed.
+    """
+    claimed = trimmed = 0
+    seen = set()
+    start = "0-0"
+    for _ in range(max_rounds):
+        cursor, entries, *_ = client.xautoclaim(
+            STREAM_KEY, GROUP, consumer, Config.CLICK_STREAM_CLAIM_IDLE_MS,
+            start_id=start, count=batch_size,
+        )
+        entries = [(entry_id, event) for entry_id, event in entries if entry_id not in seen]
+        seen.update(entry_id for entry_id, _ in entries)
+
+        # Entries trimmed away while pending come back empty: those clicks
+        # are lost, so they are acked and counted.
+        live = [(entry_id, event) for entry_id, event in entries if event]
+        dead = [entry_id for entry_id, event in entries if not event]
+        if dead:
+            client.xack(STREAM_KEY, GROUP, *dead)
+            trimmed += len(dead)
+        if live:
+            apply_events(client, live)
+            claimed += len(live)
+
+        if not entries or cursor == "0-0" or _stream_id(cursor) <= _stream_id(start):
+            break
+        start = cursor
+
+    if claimed or trimmed:
+        pipe = client.pipeline(transaction=False)
+        pipe.hincrby(STATS_KEY, "claimed", claimed)
+        pipe.hincrby(STATS_KEY, "trimmed", trimmed)
+        pipe.execute()
+    return claimed
+
+
+def consume(client, consumer, batch_size, block_ms=None):
+    """Read and apply one batch; returns the number of events processed."""
+    reply = client.xreadgroup(GROUP, consumer, {STREAM_KEY: ">"}, count=batch_size, block=block_ms)
+    entries = reply[0][1] if reply else []
+    if entries:
+        apply_events(client, entries)
+    return len(entries)
+
+
+def run_consumer(client=None, name=None, should_stop=lambda: False):
+    """Consume click events until ``should_stop()`` is true.
+
+    The batch size doubles, up to ``CLICK_STREAM_MAX_BATCH_SIZE``, while
+    reads keep coming back full and falls back once the consumer has caught
+    up, so a backlog is worked off in fewer, larger transactions. Entries
+    left pending by a crashed consumer are claimed every claim interval.
+    """
+    client = client or get_redis()
+    name = name or f"{socket.gethostname()}-{os.getpid()}"
+    ensure_group(client)
+
+    batch_size = Config.CLICK_STREAM_BATCH_SIZE
+    next_claim = 0
+    while not should_stop():
+        if time.monotonic() >= next_claim:
+            claim_stale(client, name, batch_size)
+            next_claim = time.monotonic() + Config.CLICK_STREAM_CLAIM_IDLE_MS / 1000
+
+        processed = consume(client, name, batch_size, Config.CLICK_STREAM_BLOCK_MS)
+        if processed >= batch_size:
+            batch_size = min(batch_size * 2, Config.CLICK_STREAM_MAX_BATCH_SIZE)
+        else:
+            batch_size = Config.CLICK_STREAM_BATCH_SIZE
+
+
+def stream_lag(client):
+    """Consumer group metrics: backlog, pending entries and how far behind it is.
+
+    ``unread_trimmed`` is the number of events the length cap trimmed before
+    the group read them, i.e. clicks lost because the consumers fell too far
+    behind; ``trimmed`` counts read but unacknowledged entries lost the same
+    way.
+    """
+    ensure_group(client)
+    info = client.xinfo_stream(STREAM_KEY)
+    group = next(g for g in client.xinfo_groups(STREAM_KEY) if g["name"] == GROUP)
+
+    # Trimming removes the oldest entries first, so unread events can only
+    # have been lost once everything left in the stream is unread.
+    unread_trimmed = 0
+    first_entry = info.get("first-entry")
+    entries_read = group.get("entries-read")
+    if entries_read is None and group["last-delivered-id"] == "0-0":
+        entries_read = 0
+    if first_entry and entries_read is not None and (
+        _stream_id(first_entry[0]) > _stream_id(group["last-delivered-id"])
+    ):
+        unread_trimmed = max(0, info["entries-added"] - entries_read - info["length"])
+
+    oldest_unread_age_ms = 0
+    unread = client.xrange(STREAM_KEY, f"({group['last-delivered-id']}", "+", count=1)
+    if unread:
+        oldest_unread_age_ms = max(0, int(time.time() * 1000) - int(unread[0][0].split("-")[0]))
+
+    stats = client.hgetall(STATS_KEY)
+    return {
+        "length": info["length"],
+        "lag": group.get("lag"),
+        "pending": group["pending"],
+        "consumers": group["consumers"],
+        "oldest_unread_age_ms": oldest_unread_age_ms,
+        "unread_trimmed": unread_trimmed,
+        "processed": int(stats.get("processed", 0)),
+        "claimed": int(stats.get("claimed", 0)),
+        "trimmed": int(stats.get("trimmed", 0)),
+        "last_batch_at": int(stats.get("last_batch_at", 0)),
+    }
+
+
+def replay(client, start="-", end="+", totals=False, batch_size=1000):
+    """Re-apply the retained events between two stream IDs.
+
+    Meant for rebuilding breakdowns, e.g. after changing ``enrich``: delete
+    the ``analytics:*`` keys first. Breakdowns of links that have expired
+    since are not rebuilt. ``totals`` also re-adds click counts, which double
+    counts unless those keys were cleared too. Returns the number of events
+    replayed.
+    """
+    replayed = 0
+    while True:
+        entries = client.xrange(STREAM_KEY, start, end, count=batch_size)
+        if not entries:
+            return replayed
+        apply_events(client, entries, ack=False, totals=totals)
+        replayed += len(entries)
+        start = f"({entries[-1][0]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("consume")
+    commands.add_parser("lag")
+    replay_parser = commands.add_parser("replay")
+    replay_parser.add_argument("start", nargs="?", default="-")
+    replay_parser.add_argument("end", nargs="?", default="+")
+    replay_parser.add_argument("--with-totals", action="store_true")
+    args = parser.parse_args()
+
+    client = get_redis()
+    if args.command == "consume":
+        run_consumer(client)
+    elif args.command == "lag":
+        print(json.dumps(stream_lag(client), indent=2))
+    else:
+        print(f"Replayed {replay(client, args.start, args.end, args.with_totals)} events")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,493 @@
+import asyncio
+import atexit
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from cache import LinkCache, MISSING
+from config import Config
+import compact
+from shortener import r, ar
+import trending
+from timeseries import add_minute_counts
+
+logger = logging.getLogger(__name__)
+
+# Resolves a short code and records the click in a single round trip. The
+# minute buckets of the time series are not written here but aggregated in
+# ``minute_buffer`` and flushed in batches, so a click costs two writes. The
+# counters get the link's TTL so they never outlive it.
+# KEYS: url:{code}, clicks:{code}, clicks:{code}:visitors
+# ARGV: visitor ip
+# Returns {long_url, pttl} or nil when the code does not exist.
+REDIRECT_LUA = """
+local long_url = redis.call('GET', KEYS[1])
+if not long_url then
+    return false
+end
+local pttl = redis.call('PTTL', KEYS[1])
+redis.call('INCR', KEYS[2])
+redis.call('PFADD', KEYS[3], ARGV[1])
+if pttl > 0 then
+    redis.call('PEXPIRE', KEYS[2], pttl)
+    redis.call('PEXPIRE', KEYS[3], pttl)
+end
+return {long_url, pttl}
+"""
+REDIRECT_SCRIPT = r.register_script(REDIRECT_LUA)
+ASYNC_REDIRECT_SCRIPT = ar.register_script(REDIRECT_LUA)
+
+# Records one click for ``async`` mode, the counting half of REDIRECT_LUA.
+# The click is dropped if the link expired since its lookup.
+# KEYS: url:{code}, clicks:{code}, clicks:{code}:visitors
+# ARGV: visitor ip
+COUNT_CLICK_LUA = """
+local pttl = redis.call('PTTL', KEYS[1])
+if pttl == -2 then
+    return
+end
+redis.call('INCR', KEYS[2])
+redis.call('PFADD', KEYS[3], ARGV[1])
+if pttl > 0 then
+    redis.call('PEXPIRE', KEYS[2], pttl)
+    redis.call('PEXPIRE', KEYS[3], pttl)
+end
+"""
+COUNT_CLICK_SCRIPT = r.register_script(COUNT_CLICK_LUA)
+ASYNC_COUNT_CLICK_SCRIPT = ar.register_script(COUNT_CLICK_LUA)
+
+# Adds a batch of aggregated clicks to a link that still exists, in
+# ``buffered`` and ``stream`` modes.
+# KEYS: url:{code}, clicks:{code}, clicks:{code}:visitors
+# ARGV: clicks, then the visitor ips
+ADD_CLICKS_LUA = """
+local pttl = redis.call('PTTL', KEYS[1])
+if pttl == -2 then
+    return
+end
+redis.call('INCRBY', KEYS[2], ARGV[1])
+for i = 2, #ARGV, 1000 do
+    redis.call('PFADD', KEYS[3], unpack(ARGV, i, math.min(i + 999, #ARGV)))
+end
+if pttl > 0 then
+    redis.call('PEXPIRE', KEYS[2], pttl)
+    redis.call('PEXPIRE', KEYS[3], pttl)
+end
+"""
+ADD_CLICKS_SCRIPT = r.register_script(ADD_CLICKS_LUA)
+
+# Click events for the consumer in click_stream.py, in ``stream`` mode.
+STREAM_KEY = "clicks:stream"
+
+# Resolves a short code and appends its click event to the stream in a single
+# round trip.
+# KEYS: url:{code}, clicks:stream
+# ARGV: stream max length, then the event's field/value pairs
+# Returns {long_url, pttl} or nil when the code does not exist.
+STREAM_REDIRECT_LUA = """
+local long_url = redis.call('GET', KEYS[1])
+if not long_url then
+    return false
+end
+redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[1], '*', unpack(ARGV, 2))
+return {long_url, redis.call('PTTL', KEYS[1])}
+"""
+STREAM_REDIRECT_SCRIPT = r.register_script(STREAM_REDIRECT_LUA)
+ASYNC_STREAM_REDIRECT_SCRIPT = ar.register_script(STREAM_REDIRECT_LUA)
+
+
+def _count_call(short_code, ip):
+    visitors = f"clicks:{short_code}:visitors"
+    if compact.enabled():
+        # The link hash is both the lookup and the click counter.
+        return [compact.link_key(short_code), visitors], [ip]
+    return [f"url:{short_code}", f"clicks:{short_code}", visitors], [ip]
+
+
+def _url_key(short_code):
+    return compact.link_key(short_code) if compact.enabled() else f"url:{short_code}"
+
+
+def _queue_lookup(pipe, short_code):
+    if compact.enabled():
+        pipe.hget(compact.link_key(short_code), "u")
+    else:
+        pipe.get(f"url:{short_code}")
+    pipe.pttl(_url_key(short_code))
+
+
+def click_event(short_code, ip, referrer="", user_agent="", country=""):
+    """The compact stream entry of a click; the stream ID carries its time."""
+    return {
+        "c": short_code,
+        "i": ip,
+        "r": (referrer or "")[:256],
+        "u": (user_agent or "")[:256],
+        "g": (country or "")[:2].upper(),
+    }
+
+
+def _stream_call(short_code, event):
+    args = [Config.CLICK_STREAM_MAXLEN]
+    for field, value in event.items():
+        args += [field, value]
+    return [_url_key(short_code), STREAM_KEY], args
+
+
+def queue_click_counts(pipe, counts, visitors, minutes):
+    """Queue aggregated click deltas on a pipeline: ``{code: n}``,
+    ``{code: {ip, ...}}`` and ``{(code, timestamp): n}`` for the minute buckets."""
+    for short_code in counts.keys() | visitors.keys():
+        keys, _ = _count_call(short_code, None)
+        script = compact.ADD_CLICKS_SCRIPT if compact.enabled() else ADD_CLICKS_SCRIPT
+        script(keys=keys, args=[counts.get(short_code, 0), *visitors.get(short_code, ())], client=pipe)
+    add_minute_counts(pipe, minutes)
+
+
+def queue_click_total(pipe, short_code):
+    """Queue the read of a link's click count (a string, or None when never clicked)."""
+    if compact.enabled():
+        pipe.hget(compact.link_key(short_code), "c")
+    else:
+        pipe.get(f"clicks:{short_code}")
+
+
+def write_click_counts(counts, visitors, minutes):
+    pipe = r.pipeline(transaction=False)
+    queue_click_counts(pipe, counts, visitors, minutes)
+    pipe.execute()
+
+
+def count_click(short_code, ip):
+    keys, args = _count_call(short_code, ip)
+    script = compact.COUNT_CLICK_SCRIPT if compact.enabled() else COUNT_CLICK_SCRIPT
+    script(keys=keys, args=args, client=r)
+
+
+async def count_click_async(short_code, ip):
+    keys, args = _count_call(short_code, ip)
+    script = compact.ASYNC_COUNT_CLICK_SCRIPT if compact.enabled() else ASYNC_COUNT_CLICK_SCRIPT
+    await script(keys=keys, args=args, client=ar)
+
+
+class ClickBuffer:
+    """Aggregates clicks in memory and writes them to Redis in batches.
+
+    A background thread flushes every ``flush_interval`` seconds, or as soon
+    as ``flush_threshold`` clicks are pending, and once more at interpreter
+    exit. Each flush costs two commands per distinct short code, plus two
+    per code and minute for the time series, in one pipeline, however many
+    clicks it carries. In ``sync`` and ``async`` modes, where the counters
+    are written per click, a buffer fed through ``add_minute`` carries only
+    the time series.
+
+    Loss guarantees: clicks that have not been flushed when the process dies
+    without running exit handlers (SIGKILL, OOM kill, power loss) are lost,
+    so at most ``flush_threshold`` clicks or ``flush_interval`` seconds of
+    traffic per worker. A failed flush keeps its batch and retries it; while
+    Redis stays unreachable the buffer holds at most ``max_pending`` clicks
+    and drops (and counts in ``dropped``) anything beyond that.
+    """
+
+    def __init__(self, flush_interval, flush_threshold, max_pending):
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.max_pending = max_pending
+        self._counts = Counter()
+        self._visitors = defaultdict(set)
+        self._minutes = Counter()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.flushes = 0
+        self.dropped = 0
+
+    def add(self, short_code, ip):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.dropped += 1
+                return
+            self._counts[short_code] += 1
+            self._visitors[short_code].add(ip)
+            self._minutes[(short_code, int(time.time()) // 60 * 60)] += 1
+            self._pending += 1
+            pending = self._pending
+            if self._thread is None:
+                self._start()
+
+        if pending >= self.flush_threshold:
+            self._wake.set()
+
+    def add_minute(self, short_code):
+        """Count a click towards its minute bucket only."""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.dropped += 1
+                return
+            self._minutes[(short_code, int(time.time()) // 60 * 60)] += 1
+            self._pending += 1
+            pending = self._pending
+            if self._thread is None:
+                self._start()
+
+        if pending >= self.flush_threshold:
+            self._wake.set()
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name="click-flush", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Click buffer flush failed, will retry")
+
+    def _merge(self, counts, visitors, minutes):
+        with self._lock:
+            self._counts.update(counts)
+            self._minutes.update(minutes)
+            for short_code, ips in visitors.items():
+                self._visitors[short_code].update(ips)
+            self._pending += sum(minutes.values())
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                counts, self._counts = self._counts, Counter()
+                visitors, self._visitors = self._visitors, defaultdict(set)
+                minutes, self._minutes = self._minutes, Counter()
+                self._pending = 0
+
+            try:
+                write_click_counts(counts, visitors, minutes)
+            except Exception:
+                self._merge(counts, visitors, minutes)
+                raise
+            self.flushes += 1
+
+    @property
+    def pending(self):
+        return self._pending
+
+
+link_cache = None
+if Config.LINK_CACHE_SIZE > 0:
+    link_cache = LinkCache(
+        maxsize=Config.LINK_CACHE_SIZE,
+        ttl=Config.LINK_CACHE_TTL,
+        negative_ttl=Config.LINK_CACHE_NEGATIVE_TTL,
+    )
+
+click_buffer = None
+if Config.CLICK_COUNT_MODE == "buffered":
+    click_buffer = ClickBuffer(
+        flush_interval=Config.CLICK_FLUSH_INTERVAL,
+        flush_threshold=Config.CLICK_FLUSH_THRESHOLD,
+        max_pending=Config.CLICK_BUFFER_MAX_PENDING,
+    )
+
+# Time series of ``sync`` and ``async`` mode clicks; the buffered flush and
+# the stream consumer write their own.
+minute_buffer = None
+if Config.CLICK_COUNT_MODE in ("sync", "async"):
+    minute_buffer = ClickBuffer(
+        flush_interval=Config.CLICK_FLUSH_INTERVAL,
+        flush_threshold=Config.CLICK_FLUSH_THRESHOLD,
+        max_pending=Config.CLICK_BUFFER_MAX_PENDING,
+    )
+
+_executor = None
+
+# Clicks handed to the executor or event loop in ``async`` mode and not
+# written yet; beyond CLICK_ASYNC_MAX_PENDING new clicks are dropped.
+_async_lock = threading.Lock()
+_async_pending = 0
+async_dropped = 0
+
+
+def _claim_async_slot():
+    global _async_pending, async_dropped
+    with _async_lock:
+        if _async_pending >= Config.CLICK_ASYNC_MAX_PENDING:
+            async_dropped += 1
+            return False
+        _async_pending += 1
+        return True
+
+
+def _release_async_slot(_):
+    global _async_pending
+    with _async_lock:
+        _async_pending -= 1
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=Config.CLICK_COUNT_WORKERS,
+            thread_name_prefix="click-count",
+        )
+        atexit.register(_executor.shutdown, wait=True)
+    return _executor
+
+
+def _record(short_code, ip, event):
+    if Config.CLICK_COUNT_MODE == "stream":
+        r.xadd(STREAM_KEY, event, maxlen=Config.CLICK_STREAM_MAXLEN, approximate=True)
+    elif click_buffer is not None:
+        click_buffer.add(short_code, ip)
+    elif Config.CLICK_COUNT_MODE == "async":
+        if _claim_async_slot():
+            _get_executor().submit(count_click, short_code, ip).add_done_callback(_release_async_slot)
+    else:
+        count_click(short_code, ip)
+
+
+def flush_clicks():
+    """Write this worker's buffered clicks so reads see its own traffic."""
+    for buffer in (click_buffer, minute_buffer):
+        if buffer is not None:
+            try:
+                buffer.flush()
+            except Exception:
+                logger.exception("Click buffer flush failed, will retry")
+
+
+def _count_minute(short_code):
+    if minute_buffer is not None:
+        minute_buffer.add_minute(short_code)
+
+
+def _remember(short_code, long_url, pttl):
+    if link_cache is None:
+        return
+    if not long_url:
+        link_cache.set_missing(short_code)
+    elif pttl >= 0:
+        link_cache.set(short_code, long_url, ttl=pttl / 1000)
+    else:
+        link_cache.set(short_code, long_url)
+
+
+def invalidate_link(short_code):
+    if link_cache is not None:
+        link_cache.invalidate(short_code)
+
+
+def resolve_and_count(short_code, ip, referrer="", user_agent="", country=""):
+    """Return the long URL for ``short_code`` and record the click.
+
+    Cached codes skip the lookup entirely and only record the click. In
+    ``sync`` mode the lookup and both counters run as one server-side script;
+    in ``async`` and ``buffered`` modes the lookup is a single round trip and
+    the click is handed to a background thread or the click buffer, so the
+    redirect never waits on the counters. In ``stream`` mode the script
+    appends a click event instead, and click_stream.py does the counting.
+    Every click also goes to this process' trending tracker.
+    """
+    event = click_event(short_code, ip, referrer, user_agent, country)
+    if link_cache is not None:
+        long_url = link_cache.get(short_code)
+        if long_url is not MISSING:
+            if long_url:
+                trending.record(short_code)
+                _count_minute(short_code)
+                _record(short_code, ip, event)
+            return long_url
+
+    if Config.CLICK_COUNT_MODE == "sync":
+        keys, args = _count_call(short_code, ip)
+        script = compact.REDIRECT_SCRIPT if compact.enabled() else REDIRECT_SCRIPT
+        result = script(keys=keys, args=args, client=r)
+        long_url, pttl = result or (None, -2)
+    elif Config.CLICK_COUNT_MODE == "stream":
+        keys, args = _stream_call(short_code, event)
+        script = compact.STREAM_REDIRECT_SCRIPT if compact.enabled() else STREAM_REDIRECT_SCRIPT
+        result = script(keys=keys, args=args, client=r)
+        long_url, pttl = result or (None, -2)
+    else:
+        pipe = r.pipeline(transaction=False)
+        _queue_lookup(pipe, short_code)
+        long_url, pttl = pipe.execute()
+        if long_url:
+            _record(short_code, ip, event)
+
+    if long_url:
+        trending.record(short_code)
+        _count_minute(short_code)
+    _remember(short_code, long_url, pttl)
+    return long_url
+
+
+_background_tasks = set()
+
+
+async def _record_async(short_code, ip, event):
+    if Config.CLICK_COUNT_MODE == "stream":
+        await ar.xadd(STREAM_KEY, event, maxlen=Config.CLICK_STREAM_MAXLEN, approximate=True)
+    elif click_buffer is not None:
+        click_buffer.add(short_code, ip)
+    elif Config.CLICK_COUNT_MODE == "async":
+        if _claim_async_slot():
+            task = asyncio.create_task(count_click_async(short_code, ip))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+            task.add_done_callback(_release_async_slot)
+    else:
+        await count_click_async(short_code, ip)
+
+
+async def resolve_and_count_async(short_code, ip, referrer="", user_agent="", country=""):
+    """Asyncio counterpart of ``resolve_and_count`` for the ASGI entry point.
+
+    In ``async`` mode the counters are written from a task on the event loop
+    instead of a thread.
+    """
+    event = click_event(short_code, ip, referrer, user_agent, country)
+    if link_cache is not None:
+        long_url = link_cache.get(short_code)
+        if long_url is not MISSING:
+            if long_url:
+                trending.record(short_code)
+                _count_minute(short_code)
+                await _record_async(short_code, ip, event)
+            return long_url
+
+    if Config.CLICK_COUNT_MODE == "sync":
+        keys, args = _count_call(short_code, ip)
+        script = compact.ASYNC_REDIRECT_SCRIPT if compact.enabled() else ASYNC_REDIRECT_SCRIPT
+        result = await script(keys=keys, args=args, client=ar)
+        long_url, pttl = result or (None, -2)
+    elif Config.CLICK_COUNT_MODE == "stream":
+        keys, args = _stream_call(short_code, event)
+        script = compact.ASYNC_STREAM_REDIRECT_SCRIPT if compact.enabled() else ASYNC_STREAM_REDIRECT_SCRIPT
+        result = await script(keys=keys, args=args, client=ar)
+        long_url, pttl = result or (None, -2)
+    else:
+        pipe = ar.pipeline(transaction=False)
+        _queue_lookup(pipe, short_code)
+        long_url, pttl = await pipe.execute()
+        if long_url:
+            await _record_async(short_code, ip, event)
+
+    if long_url:
+        trending.record(short_code)
+        _count_minute(short_code)
+    _remember(short_code, long_url, pttl)
+    return long_url
+
+
+async def flush_clicks_async():
+    if click_buffer is not None:
+        await asyncio.to_thread(flush_clicks)
@@ -0,0 +1,192 @@
+"""Compact key layout for links, selected with ``LINK_LAYOUT=compact``.
+
+The default layout gives every field of a link its own string key (``url:``,
+``long_to_short:``, ``metadata:``, ``clicks:``), each paying Redis' per-key
+overhead and TTL; at tens of millions of links that overhead is most of the
+memory. The compact layout keeps a link in one small, listpack-encoded hash
+and its reverse lookup in shared buckets:
+
+    link:{code}           u: long URL, c: clicks, plus o: owner id and
+                          t: created_at (Unix time) for user links
+    l2s:{digest[:n]}      digest[n:] -> code, one field per long URL
+
+The reverse lookup is keyed by a 64-bit digest of the long URL instead of
+the URL itself, and each field expires with its link (HEXPIRE, Redis 7.4+).
+Lookups always compare the canonical form of the code's URL, so a digest
+collision only costs a new code. Unique visitors, time series and the user
+indexes are the same in both layouts.
+
+A bucket only saves memory while it stays listpack-encoded, i.e. under
+``hash-max-listpack-entries`` (128) fields, so the bucket count is sized for
+about ``LINK_BUCKET_TARGET`` links per bucket at ``LINK_EXPECTED_COUNT``
+links: the digest prefix is the fewest hex characters with
+``16**n >= LINK_EXPECTED_COUNT / LINK_BUCKET_TARGET``. At the default 10
+million links that is 5 characters, about 1 million buckets of ~10 fields.
+Set ``LINK_DIGEST_BUCKET_CHARS`` to pin the prefix length; changing it later
+only costs dedup misses for links created before the change.
+
+Existing links are converted by ``migrate_to_compact_layout`` in
+migrations.py.
+"""
+import math
+from datetime import datetime
+
+from canonical import url_digest
+from config import Config
+from redis_client import get_redis, get_async_redis
+
+
+# Links per l2s: bucket to size for, well below the 128-entry listpack limit.
+LINK_BUCKET_TARGET = 100
+
+
+def enabled():
+    return Config.LINK_LAYOUT == "compact"
+
+
+def bucket_chars():
+    """Hex characters of the digest that pick a link's ``l2s:`` bucket."""
+    if Config.LINK_DIGEST_BUCKET_CHARS:
+        return Config.LINK_DIGEST_BUCKET_CHARS
+    buckets = max(1, Config.LINK_EXPECTED_COUNT / LINK_BUCKET_TARGET)
+    return max(1, math.ceil(math.log(buckets, 16)))
+
+
+def link_key(short_code):
+    return f"link:{short_code}"
+
+
+def reverse_lookup(long_url):
+    """Return the ``(bucket key, field)`` that maps ``long_url`` to its code."""
+    digest = url_digest(long_url)
+    n = bucket_chars()
+    return f"l2s:{digest[:n]}", digest[n:]
+
+
+def metadata(owner, created_at, long_url):
+    """The ``metadata:{code}`` document of the default layout, or None for anonymous links."""
+    if owner is None:
+        return None
+    return {
+        "user_id": owner,
+        "created_at": datetime.fromtimestamp(float(created_at)).isoformat(),
+        "original_url": long_url,
+    }
+
+
+# Compact counterpart of shortener.SHORTEN_LUA, with the same replies. The
+# click counter is a field of the new link hash, so only the visitors reset.
+# KEYS: link:{code}, reverse lookup bucket, user:{id}:link_index,
+#       clicks:{code}:visitors, links:expiring, links:owner
+# ARGV: long_url, code, expiry, custom ("1"/"0"), user id ("" when anonymous),
+#       created_at score, expires_at score, reverse lookup field,
+#       look up existing ("1"/"0")
+# Like SHORTEN_LUA it reads link:{existing code}, which it cannot declare in
+# KEYS, so it assumes a single Redis instance.
+SHORTEN_LUA = """
+if ARGV[4] == '1' then
+    local existing_url = redis.call('HGET', KEYS[1], 'u')
+    if existing_url then
+        return {'taken', ARGV[2], existing_url, redis.call('TTL', KEYS[1]),
+                redis.call('HGET', KEYS[1], 'c') or '0', redis.call('PFCOUNT', KEYS[4])}
+    end
+else
+    local existing_code = ARGV[9] == '1' and redis.call('HGET', KEYS[2], ARGV[8])
+    if existing_code then
+        local existing_key = 'link:' .. existing_code
+        local existing_url = redis.call('HGET', existing_key, 'u')
+        if existing_url then
+            return {'existing', existing_code, existing_url, redis.call('TTL', existing_key)}
+        end
+    end
+    if redis.call('EXISTS', KEYS[1]) == 1 then
+        return {'collision'}
+    end
+end
+
+if ARGV[5] == '' then
+    redis.call('HSET', KEYS[1], 'u', ARGV[1])
+else
+    redis.call('HSET', KEYS[1], 'u', ARGV[1], 'o', ARGV[5], 't', ARGV[6])
+    redis.call('ZADD', KEYS[3], ARGV[6], ARGV[2])
+    redis.call('ZADD', KEYS[5], ARGV[7], ARGV[2])
+    redis.call('HSET', KEYS[6], ARGV[2], ARGV[5])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('DEL', KEYS[4])
+redis.call('HSET', KEYS[2], ARGV[8], ARGV[2])
+redis.call('HEXPIRE', KEYS[2], ARGV[3], 'FIELDS', 1, ARGV[8])
+return {'created', ARGV[2], ARGV[1], tonumber(ARGV[3])}
+"""
+
+# Compact counterpart of clicks.REDIRECT_LUA.
+# KEYS: link:{code}, clicks:{code}:visitors
+# ARGV: visitor ip
+REDIRECT_LUA = """
+local long_url = redis.call('HGET', KEYS[1], 'u')
+if not long_url then
+    return false
+end
+local pttl = redis.call('PTTL', KEYS[1])
+redis.call('HINCRBY', KEYS[1], 'c', 1)
+redis.call('PFADD', KEYS[2], ARGV[1])
+if pttl > 0 then
+    redis.call('PEXPIRE', KEYS[2], pttl)
+end
+return {long_url, pttl}
+"""
+
+# Compact counterpart of clicks.COUNT_CLICK_LUA. The click is dropped if the
+# link expired since its lookup, so the counter never recreates the hash
+# without a TTL.
+COUNT_CLICK_LUA = """
+local pttl = redis.call('PTTL', KEYS[1])
+if pttl == -2 then
+    return
+end
+redis.call('HINCRBY', KEYS[1], 'c', 1)
+redis.call('PFADD', KEYS[2], ARGV[1])
+if pttl > 0 then
+    redis.call('PEXPIRE', KEYS[2], pttl)
+end
+"""
+
+# Compact counterpart of clicks.ADD_CLICKS_LUA.
+# KEYS: link:{code}, clicks:{code}:visitors
+# ARGV: clicks, then the visitor ips
+ADD_CLICKS_LUA = """
+local pttl = redis.call('PTTL', KEYS[1])
+if pttl == -2 then
+    return
+end
+redis.call('HINCRBY', KEYS[1], 'c', ARGV[1])
+for i = 2, #ARGV, 1000 do
+    redis.call('PFADD', KEYS[2], unpack(ARGV, i, math.min(i + 999, #ARGV)))
+end
+if pttl > 0 then
+    redis.call('PEXPIRE', KEYS[2], pttl)
+end
+"""
+
+# Compact counterpart of clicks.STREAM_REDIRECT_LUA.
+# KEYS: link:{code}, clicks:stream
+# ARGV: stream max length, then the event's field/value pairs
+STREAM_REDIRECT_LUA = """
+local long_url = redis.call('HGET', KEYS[1], 'u')
+if not long_url then
+    return false
+end
+redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[1], '*', unpack(ARGV, 2))
+return {long_url, redis.call('PTTL', KEYS[1])}
+"""
+
+SHORTEN_SCRIPT = get_redis().register_script(SHORTEN_LUA)
+ASYNC_SHORTEN_SCRIPT = get_async_redis().register_script(SHORTEN_LUA)
+REDIRECT_SCRIPT = get_redis().register_script(REDIRECT_LUA)
+ASYNC_REDIRECT_SCRIPT = get_async_redis().register_script(REDIRECT_LUA)
+COUNT_CLICK_SCRIPT = get_redis().register_script(COUNT_CLICK_LUA)
+ASYNC_COUNT_CLICK_SCRIPT = get_async_redis().register_script(COUNT_CLICK_LUA)
+ADD_CLICKS_SCRIPT = get_redis().register_script(ADD_CLICKS_LUA)
+STREAM_REDIRECT_SCRIPT = get_redis().register_script(STREAM_REDIRECT_LUA)
+ASYNC_STREAM_REDIRECT_SCRIPT = get_async_redis().register_script(STREAM_REDIRECT_LUA)
+
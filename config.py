@@ -7,10 +7,93 @@ class Config:
     REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
     REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
     REDIS_DB = int(os.getenv("REDIS_DB", 0))
+    REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))
+    REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", 5))
+    REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", 2))
+    REDIS_SOCKET_CONNECT_TIMEOUT = float(os.getenv("REDIS_SOCKET_CONNECT_TIMEOUT", 2))
+    REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30))
+    REDIS_RETRY_ATTEMPTS = int(os.getenv("REDIS_RETRY_ATTEMPTS", 3))
+    REDIS_RETRY_BACKOFF_BASE = float(os.getenv("REDIS_RETRY_BACKOFF_BASE", 0.05))
+    REDIS_RETRY_BACKOFF_CAP = float(os.getenv("REDIS_RETRY_BACKOFF_CAP", 1.0))
     BASE_URL = os.getenv("BASE_URL", "http://127.0.0.1:5000").rstrip("/")
     URL_EXPIRY_SECONDS = int(os.getenv("URL_EXPIRY_SECONDS", 7 * 24 * 3600))
     RATELIMIT_STORAGE_URL = f"redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}"
+    RATELIMIT_STORAGE = os.getenv("RATELIMIT_STORAGE", "hybrid").lower()
+    RATELIMIT_SYNC_INTERVAL = float(os.getenv("RATELIMIT_SYNC_INTERVAL", 1.0))
+    RATELIMIT_LOCAL_SHARE = float(os.getenv("RATELIMIT_LOCAL_SHARE", 0.1))
     JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "change-this-secret-key")
     JWT_ACCESS_TOKEN_EXPIRES = int(os.getenv("JWT_ACCESS_TOKEN_EXPIRES", 3600 * 24 * 7))
+    JWT_CLAIMS_CACHE_SIZE = int(os.getenv("JWT_CLAIMS_CACHE_SIZE", 10000))
+    JWT_CLAIMS_CACHE_TTL = int(os.getenv("JWT_CLAIMS_CACHE_TTL", 300))
+    USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+    USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 30))
+    ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", 3))
+    ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", 65536))
+    ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", 4))
+    PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+    PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", 16))
+    PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", 5.0))
+    STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "redis").lower()
+    SQLITE_PATH = os.getenv("SQLITE_PATH", "shortener.db")
+    SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", 5))
+    PREVIEW_TIMEOUT = float(os.getenv("PREVIEW_TIMEOUT", 5))
+    PREVIEW_MAX_BYTES = int(os.getenv("PREVIEW_MAX_BYTES", 65536))
+    PREVIEW_CONCURRENCY = int(os.getenv("PREVIEW_CONCURRENCY", 16))
+    PREVIEW_POOL_HOSTS = int(os.getenv("PREVIEW_POOL_HOSTS", 100))
+    PREVIEW_PER_HOST = int(os.getenv("PREVIEW_PER_HOST", 2))
+    PREVIEW_TTL = int(os.getenv("PREVIEW_TTL", 7 * 24 * 3600))
+    PREVIEW_NEGATIVE_TTL = int(os.getenv("PREVIEW_NEGATIVE_TTL", 3600))
+    PREVIEW_LOCK_TTL = int(os.getenv("PREVIEW_LOCK_TTL", 300))
+    URL_STRIP_PARAMS = tuple(
+        param.strip().lower()
+        for param in os.getenv(
+            "URL_STRIP_PARAMS",
+            "utm_*,fbclid,gclid,dclid,gbraid,wbraid,msclkid,yclid,igshid,mc_cid,mc_eid,_ga",
+        ).split(",")
+        if param.strip()
+    )
+    LINK_LAYOUT = os.getenv("LINK_LAYOUT", "keys").lower()
+    LINK_EXPECTED_COUNT = int(os.getenv("LINK_EXPECTED_COUNT", 10_000_000))
+    # 0 derives it from LINK_EXPECTED_COUNT (see compact.bucket_chars).
+    LINK_DIGEST_BUCKET_CHARS = int(os.getenv("LINK_DIGEST_BUCKET_CHARS", 0))
+    SHORT_CODE_ALLOCATOR = os.getenv("SHORT_CODE_ALLOCATOR", "random").lower()
+    SHORT_CODE_LENGTH = int(os.getenv("SHORT_CODE_LENGTH", 6))
+    SHORT_CODE_GROW_AFTER = int(os.getenv("SHORT_CODE_GROW_AFTER", 3))
+    SHORT_CODE_SECRET = os.getenv("SHORT_CODE_SECRET", "change-this-code-secret")
+    CODE_POOL_TARGET = int(os.getenv("CODE_POOL_TARGET", 10000))
+    BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", 500))
+    BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 100000))
+    CLICK_COUNT_MODE = os.getenv("CLICK_COUNT_MODE", "sync").lower()
+    CLICK_COUNT_WORKERS = int(os.getenv("CLICK_COUNT_WORKERS", 2))
+    CLICK_ASYNC_MAX_PENDING = int(os.getenv("CLICK_ASYNC_MAX_PENDING", 10000))
+    CLICK_FLUSH_INTERVAL = float(os.getenv("CLICK_FLUSH_INTERVAL", 1.0))
+    CLICK_FLUSH_THRESHOLD = int(os.getenv("CLICK_FLUSH_THRESHOLD", 1000))
+    CLICK_BUFFER_MAX_PENDING = int(os.getenv("CLICK_BUFFER_MAX_PENDING", 100000))
+    CLICK_STREAM_MAXLEN = int(os.getenv("CLICK_STREAM_MAXLEN", 1000000))
+    CLICK_STREAM_BATCH_SIZE = int(os.getenv("CLICK_STREAM_BATCH_SIZE", 500))
+    CLICK_STREAM_MAX_BATCH_SIZE = int(os.getenv("CLICK_STREAM_MAX_BATCH_SIZE", 5000))
+    CLICK_STREAM_BLOCK_MS = int(os.getenv("CLICK_STREAM_BLOCK_MS", 1000))
+    CLICK_STREAM_DRAIN_INTERVAL = float(os.getenv("CLICK_STREAM_DRAIN_INTERVAL", 5.0))
+    CLICK_STREAM_CLAIM_IDLE_MS = int(os.getenv("CLICK_STREAM_CLAIM_IDLE_MS", 60000))
+    COUNTRY_HEADER = os.getenv("COUNTRY_HEADER", "CF-IPCountry")
+    LINK_CACHE_SIZE = int(os.getenv("LINK_CACHE_SIZE", 0))
+    LINK_CACHE_TTL = int(os.getenv("LINK_CACHE_TTL", 60))
+    LINK_CACHE_NEGATIVE_TTL = int(os.getenv("LINK_CACHE_NEGATIVE_TTL", 5))
+    TIMESERIES_MINUTE_RETENTION = int(os.getenv("TIMESERIES_MINUTE_RETENTION", 2 * 24 * 3600))
+    TIMESERIES_HOUR_RETENTION = int(os.getenv("TIMESERIES_HOUR_RETENTION", 90 * 24 * 3600))
+    TIMESERIES_DAY_RETENTION = int(os.getenv("TIMESERIES_DAY_RETENTION", 2 * 365 * 24 * 3600))
+    TIMESERIES_ROLLUP_DELAY = int(os.getenv("TIMESERIES_ROLLUP_DELAY", 120))
+    TIMESERIES_MAX_POINTS = int(os.getenv("TIMESERIES_MAX_POINTS", 1440))
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    REDIRECT_FAST_PATH = os.getenv("REDIRECT_FAST_PATH", "true").lower() == "true"
+    TRENDING_ENABLED = os.getenv("TRENDING_ENABLED", "true").lower() == "true"
+    TRENDING_FLUSH_INTERVAL = float(os.getenv("TRENDING_FLUSH_INTERVAL", 5.0))
+    TRENDING_SKETCH_SIZE = int(os.getenv("TRENDING_SKETCH_SIZE", 1000))
+    TRENDING_KEEP = int(os.getenv("TRENDING_KEEP", 1000))
+    CLEANUP_INTERVAL = float(os.getenv("CLEANUP_INTERVAL", 60))
+    CLEANUP_BATCH_SIZE = int(os.getenv("CLEANUP_BATCH_SIZE", 500))
+    CLEANUP_MAX_LINKS = int(os.getenv("CLEANUP_MAX_LINKS", 10000))
+    CLEANUP_MAX_INDEXES = int(os.getenv("CLEANUP_MAX_INDEXES", 1000))
+    CLEANUP_CONFIGURE_NOTIFICATIONS = os.getenv("CLEANUP_CONFIGURE_NOTIFICATIONS", "true").lower() == "true"
     CELERY_BROKER_URL = f"redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}"
     CELERY_RESULT_BACKEND = f"redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}"
@@ -0,0 +1,80 @@
+"""WSGI middleware that serves redirects before the Flask app.
+
+A redirect needs one lookup and a 302, but through Flask it also pays for
+request context setup, URL routing, the APIFlask and flask-limiter
+decorators and response building. ``RedirectMiddleware`` answers
+``GET /<short_code>`` itself with the same rate limit, click accounting
+and 302/404/429 responses, and passes every other request to the app.
+``asgi.py`` does the same for the ASGI entry point.
+"""
+import json
+
+from limits import parse
+from werkzeug.urls import iri_to_uri
+
+from config import Config
+import storage
+
+# Same limit as the Flask route.
+REDIRECT_LIMIT = "100 per minute"
+
+
+def json_response(start_response, status, payload, headers=()):
+    body = json.dumps(payload).encode()
+    start_response(status, [
+        ("Content-Type", "application/json"),
+        ("Content-Length", str(len(body))),
+        *headers,
+    ])
+    return [body]
+
+
+class RedirectMiddleware:
+    """Serves ``GET /<short_code>`` for ``flask_app`` without entering it.
+
+    Single-segment paths of the app's own routes (``/trending``, ...) are
+    left to the app. Redirects are rate limited through ``limiter``, the
+    app's flask-limiter instance, so they use its storage and strategy and
+    are only limited while it is enabled.
+    """
+
+    def __init__(self, wsgi_app, flask_app, limiter):
+        self.wsgi_app = wsgi_app
+        self.limiter = limiter
+        self.app_paths = {rule.rule for rule in flask_app.url_map.iter_rules() if not rule.arguments}
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        if (not Config.REDIRECT_FAST_PATH or environ["REQUEST_METHOD"] != "GET"
+                or path in self.app_paths or "/" in path[1:] or len(path) < 2):
+            return self.wsgi_app(environ, start_response)
+        return self.redirect(environ, start_response, path[1:])
+
+    def rate_limited(self, ip, limit):
+        if not self.limiter.enabled:
+            return False
+        return not self.limiter.limiter.hit(limit, "fastpath", "redirect", ip)
+
+    def redirect(self, environ, start_response, short_code):
+        environ["metrics.route"] = "/<short_code>"
+        ip = environ.get("REMOTE_ADDR")
+        limit = parse(REDIRECT_LIMIT)
+        if self.rate_limited(ip, limit):
+            return json_response(start_response, "429 TOO MANY REQUESTS", {
+                "error": "Rate limit exceeded",
+                "message": str(limit),
+            })
+
+        long_url = storage.backend.links.resolve_and_count(
+            short_code,
+            ip,
+            referrer=environ.get("HTTP_REFERER"),
+            user_agent=environ.get("HTTP_USER_AGENT", ""),
+            country=environ.get("HTTP_" + Config.COUNTRY_HEADER.upper().replace("-", "_")),
+        )
+
+        if not long_url:
+            return json_response(start_response, "404 NOT FOUND", {"detail": {}, "message": "URL not found"})
+
+        start_response("302 FOUND", [("Location", iri_to_uri(long_url)), ("Content-Length", "0")])
+        return [b""]
@@ -0,0 +1,357 @@
+"""Prometheus-style metrics for the app, the Redis clients, the limiter and Celery.
+
+Recording is cheap enough for the redirect path: each thread adds to its own
+shard (a plain dict), so the hot path takes no lock, and ``render`` sums the
+shards when ``GET /metrics`` is scraped. Shards of finished threads are
+folded into a retired total so thread churn does not grow the registry.
+
+What is measured:
+
+* ``http_request_duration_seconds{route,method,status}``: time in the app,
+  for the WSGI app (including the redirect fast path) and the ASGI native
+  routes;
+* ``http_request_stage_seconds{route,stage}``: the same time split into
+  ``redis`` (commands sent by the request), ``limiter`` (rate limit checks,
+  their Redis calls included) and ``app`` (the rest);
+* ``redis_commands_total{command}`` and ``redis_call_duration_seconds{command}``
+  for clients from ``redis_client.get_redis``/``get_async_redis``, one
+  round trip per observation (pipelines as ``PIPELINE``);
+* ``ratelimit_decisions_total{decision}`` and ``ratelimit_check_seconds``;
+* ``celery_task_duration_seconds{task,state}``, which workers write to Redis
+  (``metrics:celery:{task}:{state}``) since they are separate processes, and
+  ``celery_queue_length{queue}`` read at scrape time.
+
+``METRICS_ENABLED=false`` turns all of it off and ``/metrics`` returns 404.
+"""
+import bisect
+import contextvars
+import threading
+import time
+
+from config import Config
+
+enabled = Config.METRICS_ENABLED
+
+REQUEST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+REDIS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+TASK_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# One hash holds every task histogram, with fields ``task:state:bucket`` and
+# ``task:state:sum``, so rendering is a single HGETALL.
+CELERY_KEY = "metrics:celery"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._retire()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _retire(self):
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                _merge(self._retired, shard)
+        self._shards = live
+
+    def collect(self):
+        """Sum of every shard: ``{(metric name, label values): value}``."""
+        with self._lock:
+            self._retire()
+            totals = {}
+            _merge(totals, self._retired)
+            for _, shard in self._shards:
+                _merge(totals, shard.copy())
+        return totals
+
+    def clear(self):
+        with self._lock:
+            for _, shard in self._shards:
+                shard.clear()
+            self._retired.clear()
+
+
+def _merge(into, shard):
+    for key, value in shard.items():
+        current = into.get(key)
+        if isinstance(value, list):
+            if current is None:
+                into[key] = list(value)
+            else:
+                for i, v in enumerate(value):
+                    current[i] += v
+        else:
+            into[key] = (current or 0) + value
+
+
+registry = Registry()
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        registry.register(self)
+
+    def inc(self, *label_values, amount=1):
+        shard = registry.shard()
+        key = (self.name, label_values)
+        shard[key] = shard.get(key, 0) + amount
+
+    def samples(self, label_values, value):
+        yield self.name, self.labels, label_values, value
+
+
+class Histogram:
+    """Bucket counts (non-cumulative, last one +Inf) followed by the sum."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=REQUEST_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        registry.register(self)
+
+    def observe(self, value, *label_values):
+        shard = registry.shard()
+        key = (self.name, label_values)
+        series = shard.get(key)
+        if series is None:
+            series = shard[key] = [0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self, label_values, series):
+        labels = self.labels + ("le",)
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), series):
+            cumulative += count
+            yield self.name + "_bucket", labels, label_values + (_format(bound),), cumulative
+        yield self.name + "_sum", self.labels, label_values, series[-1]
+        yield self.name + "_count", self.labels, label_values, cumulative
+
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time spent serving requests.", ("route", "method", "status"))
+REQUEST_STAGE = Histogram(
+    "http_request_stage_seconds", "Request time by stage: redis, limiter or app.", ("route", "stage"))
+REDIS_COMMANDS = Counter("redis_commands_total", "Redis commands sent, pipelined ones included.", ("command",))
+REDIS_DURATION = Histogram(
+    "redis_call_duration_seconds", "Redis round trips; pipelines are PIPELINE.", ("command",), REDIS_BUCKETS)
+REDIS_ERRORS = Counter("redis_errors_total", "Redis round trips that raised.", ("command",))
+LIMITER_DECISIONS = Counter("ratelimit_decisions_total", "Rate limit checks by outcome.", ("decision",))
+LIMITER_DURATION = Histogram("ratelimit_check_seconds", "Time spent checking rate limits.", (), REDIS_BUCKETS)
+TASK_DURATION = Histogram(
+    "celery_task_duration_seconds", "Celery task run time, as reported by the workers.", ("task", "state"),
+    TASK_BUCKETS)
+
+
+# Stage timings of the request being served, per thread or asyncio task.
+class _Stages:
+    __slots__ = ("redis", "limiter", "in_limiter")
+
+    def __init__(self):
+        self.redis = 0.0
+        self.limiter = 0.0
+        self.in_limiter = False
+
+
+_stages = contextvars.ContextVar("metrics_stages", default=None)
+
+
+class RequestTimer:
+    """Times one request: ``with RequestTimer(route, method) as timer: ...; timer.status = 200``."""
+
+    __slots__ = ("route", "method", "status", "start", "stages", "token")
+
+    def __init__(self, route, method):
+        self.route = route
+        self.method = method
+        self.status = 500
+
+    def __enter__(self):
+        self.stages = _Stages()
+        self.token = _stages.set(self.stages)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        _stages.reset(self.token)
+        stages = self.stages
+        REQUEST_DURATION.observe(elapsed, self.route, self.method, str(self.status))
+        REQUEST_STAGE.observe(stages.redis, self.route, "redis")
+        REQUEST_STAGE.observe(stages.limiter, self.route, "limiter")
+        REQUEST_STAGE.observe(max(elapsed - stages.redis - stages.limiter, 0.0), self.route, "app")
+
+
+def record_redis(command, elapsed, commands=None, failed=False):
+    if failed:
+        REDIS_ERRORS.inc(command)
+    REDIS_DURATION.observe(elapsed, command)
+    for name in commands or (command,):
+        REDIS_COMMANDS.inc(name)
+    stages = _stages.get()
+    if stages is not None and not stages.in_limiter:
+        stages.redis += elapsed
+
+
+class WSGIMetrics:
+    """Outermost WSGI middleware timing every request.
+
+    The route label is the Flask rule, set into the environ by
+    ``label_flask_route`` or by the redirect fast path.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        timer = RequestTimer(None, environ["REQUEST_METHOD"])
+
+        def start_response_with_status(status, headers, exc_info=None):
+            timer.status = status.split(" ", 1)[0]
+            return start_response(status, headers, exc_info)
+
+        with timer:
+            try:
+                return self.wsgi_app(environ, start_response_with_status)
+            finally:
+                timer.route = environ.get("metrics.route", "unmatched")
+
+
+def label_flask_route(sender, **extra):
+    """``request_started`` receiver recording the matched rule for ``WSGIMetrics``."""
+    from flask import request
+    if request.url_rule is not None:
+        request.environ["metrics.route"] = request.url_rule.rule
+
+
+class LimitCheck:
+    """Times one rate limit check; set ``allowed`` before leaving the block."""
+
+    __slots__ = ("allowed", "start", "stages")
+
+    def __enter__(self):
+        self.allowed = None
+        self.stages = _stages.get()
+        if self.stages is not None:
+            self.stages.in_limiter = True
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        if self.stages is not None:
+            self.stages.in_limiter = False
+            self.stages.limiter += elapsed
+        if not enabled:
+            return
+        LIMITER_DURATION.observe(elapsed)
+        if self.allowed is not None:
+            LIMITER_DECISIONS.inc("allowed" if self.allowed else "limited")
+
+
+class TimedRateLimiter:
+    """Wraps a ``limits`` strategy to count and time its ``hit`` decisions."""
+
+    def __init__(self, strategy):
+        self.strategy = strategy
+
+    def hit(self, item, *identifiers, cost=1):
+        with LimitCheck() as check:
+            check.allowed = self.strategy.hit(item, *identifiers, cost=cost)
+        return check.allowed
+
+    def __getattr__(self, name):
+        return getattr(self.strategy, name)
+
+
+def instrument_limiter(limiter):
+    """Route the flask-limiter ``limiter``'s checks through ``TimedRateLimiter``."""
+    limiter._limiter = TimedRateLimiter(limiter._limiter)
+
+
+def record_task(client, task, state, elapsed):
+    """Add one task run to the shared Celery histogram in Redis (worker side)."""
+    prefix = f"{task}:{state}:"
+    pipe = client.pipeline(transaction=False)
+    pipe.hincrby(CELERY_KEY, prefix + str(bisect.bisect_left(TASK_BUCKETS, elapsed)), 1)
+    pipe.hincrbyfloat(CELERY_KEY, prefix + "sum", elapsed)
+    pipe.execute()
+
+
+def _celery_series(client):
+    series = {}
+    for field, value in client.hgetall(CELERY_KEY).items():
+        task, state, bucket = field.rsplit(":", 2)
+        values = series.setdefault((task, state), [0] * (len(TASK_BUCKETS) + 2))
+        if bucket == "sum":
+            values[-1] = float(value)
+        else:
+            values[int(bucket)] = int(value)
+    return sorted(series.items())
+
+
+def _format(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _line(name, labels, label_values, value):
+    if labels:
+        pairs = ",".join(f'{label}="{_escape(v)}"' for label, v in zip(labels, label_values))
+        return f"{name}{{{pairs}}} {_format(value)}"
+    return f"{name} {_format(value)}"
+
+
+def render(client=None, queues=("celery",)):
+    """Text exposition of every metric; ``client`` reads the Celery metrics from Redis."""
+    series = {}
+    for (name, label_values), value in registry.collect().items():
+        series.setdefault(name, []).append((label_values, value))
+    if client is not None:
+        series[TASK_DURATION.name] = list(_celery_series(client))
+
+    lines = []
+    for name, metric in registry.metrics.items():
+        lines.append(f"# HELP {name} {metric.help}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for label_values, value in sorted(series.get(name, ())):
+            for sample in metric.samples(label_values, value):
+                lines.append(_line(*sample))
+
+    if client is not None:
+        lines.append("# HELP celery_queue_length Tasks waiting in the Celery queue.")
+        lines.append("# TYPE celery_queue_length gauge")
+        pipe = client.pipeline(transaction=False)
+        for queue in queues:
+            pipe.llen(queue)
+        for queue, length in zip(queues, pipe.execute()):
+            lines.append(_line("celery_queue_length", ("queue",), (queue,), length))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,209 @@
+import json
+from collections import defaultdict
+from datetime import datetime
+
+from shortener import reverse_key
+
+
+def migrate_ip_click_keys(r, batch_size=1000, delete=True):
+    """Fold legacy ``clicks:{code}:ip:{ip}`` keys into per-link HyperLogLogs.
+
+    Walks the keyspace with SCAN so Redis is never blocked, and writes each
+    batch back in a single pipeline. Returns the number of keys migrated.
+    """
+    migrated = 0
+    batch = defaultdict(list)
+    batch_keys = []
+
+    def flush():
+        pipe = r.pipeline(transaction=False)
+        for short_code, ips in batch.items():
+            pipe.pfadd(f"clicks:{short_code}:visitors", *ips)
+        if delete:
+            pipe.delete(*batch_keys)
+        pipe.execute()
+        batch.clear()
+        batch_keys.clear()
+
+    for key in r.scan_iter(match="clicks:*:ip:*", count=batch_size):
+        _, short_code, _, ip = key.split(":", 3)
+        batch[short_code].append(ip)
+        batch_keys.append(key)
+        migrated += 1
+
+        if len(batch_keys) >= batch_size:
+            flush()
+
+    if batch_keys:
+        flush()
+
+    return migrated
+
+
+def migrate_user_link_sets(r, batch_size=1000):
+    """Convert ``user:{id}:links`` sets into ``user:{id}:link_index`` sorted sets.
+
+    Links are scored by the ``created_at`` stored in their metadata; links
+    whose metadata has already expired are dropped. Returns the number of
+    users migrated.
+    """
+    migrated = 0
+
+    for key in r.scan_iter(match="user:*:links", count=batch_size):
+        if r.type(key) != "set":
+            continue
+
+        index_key = key[:-len("links")] + "link_index"
+        codes = list(r.smembers(key))
+
+        pipe = r.pipeline(transaction=False)
+        for short_code in codes:
+            pipe.get(f"metadata:{short_code}")
+        metadata = pipe.execute()
+
+        scores = {}
+        for short_code, metadata_raw in zip(codes, metadata):
+            if metadata_raw:
+                created_at = json.loads(metadata_raw).get("created_at")
+                scores[short_code] = datetime.fromisoformat(created_at).timestamp()
+
+        pipe = r.pipeline()
+        if scores:
+            pipe.zadd(index_key, scores)
+        pipe.delete(key)
+        pipe.execute()
+        migrated += 1
+
+    return migrated
+
+
+def migrate_user_password_hashes(r, batch_size=1000):
+    """Move password hashes out of ``user:id:{id}`` profiles into ``user:password:{id}``.
+
+    Profiles that no longer hold a hash are left alone. Returns the number
+    of users migrated.
+    """
+    migrated = 0
+
+    for key in r.scan_iter(match="user:id:*", count=batch_size):
+        user_id = key.rsplit(":", 1)[1]
+        if not user_id.isdigit():
+            continue
+
+        data = json.loads(r.get(key) or "{}")
+        password_hash = data.pop("password_hash", None)
+        if password_hash is None:
+            continue
+
+        pipe = r.pipeline()
+        pipe.set(f"user:password:{user_id}", password_hash, nx=True)
+        pipe.set(key, json.dumps(data))
+        pipe.execute()
+        migrated += 1
+
+    return migrated
+
+
+def migrate_to_compact_layout(r, batch_size=1000, delete=True):
+    """Convert links from the ``url:``/``metadata:``/``clicks:`` keys to ``link:`` hashes.
+
+    Walks ``url:*`` with SCAN and rewrites each batch in one pipeline: the
+    fields go into ``link:{code}`` with the link's remaining TTL, and the
+    reverse lookup into its digest bucket. Running it again only picks up
+    links created in the old layout since. Returns the number of links
+    migrated.
+    """
+    import compact
+
+    migrated = 0
+    batch = []
+
+    def flush():
+        nonlocal migrated
+        pipe = r.pipeline(transaction=False)
+        for key in batch:
+            short_code = key[len("url:"):]
+            pipe.get(key)
+            pipe.ttl(key)
+            pipe.get(f"metadata:{short_code}")
+            pipe.get(f"clicks:{short_code}")
+        replies = pipe.execute()
+
+        pipe = r.pipeline(transaction=False)
+        for i, key in enumerate(batch):
+            short_code = key[len("url:"):]
+            long_url, ttl, metadata_raw, clicks = replies[i * 4:i * 4 + 4]
+            if long_url is None or ttl == -2:
+                continue
+
+            fields = {"u": long_url}
+            if clicks:
+                fields["c"] = clicks
+            if metadata_raw:
+                metadata = json.loads(metadata_raw)
+                fields["o"] = metadata["user_id"]
+                fields["t"] = datetime.fromisoformat(metadata["created_at"]).timestamp()
+            link_key = compact.link_key(short_code)
+            bucket_key, field = compact.reverse_lookup(long_url)
+            pipe.hset(link_key, mapping=fields)
+            pipe.hset(bucket_key, field, short_code)
+            if ttl > 0:
+                pipe.expire(link_key, ttl)
+                pipe.execute_command("HEXPIRE", bucket_key, ttl, "FIELDS", 1, field)
+            if delete:
+                pipe.delete(key, f"metadata:{short_code}", f"clicks:{short_code}",
+                            reverse_key(long_url), f"long_to_short:{long_url}")
+            migrated += 1
+        pipe.execute()
+        batch.clear()
+
+    for key in r.scan_iter(match="url:*", count=batch_size):
+        batch.append(key)
+        if len(batch) >= batch_size:
+            flush()
+
+    if batch:
+        flush()
+
+    return migrated
+
+
+def migrate_reverse_index(r, batch_size=1000):
+    """Move ``long_to_short:{long_url}`` keys to ``long_to_short:{url digest}``.
+
+    Each entry keeps its code and TTL; a digest key written since by a new
+    shorten wins. The digest is of the canonical URL, so variants of a page
+    find its link from then on. Returns the number of keys migrated.
+    """
+    migrated = 0
+    batch = []
+
+    def flush():
+        pipe = r.pipeline(transaction=False)
+        for key in batch:
+            pipe.get(key)
+            pipe.pttl(key)
+        replies = pipe.execute()
+
+        pipe = r.pipeline(transaction=False)
+        for i, key in enumerate(batch):
+            short_code, pttl = replies[2 * i:2 * i + 2]
+            if short_code is not None and pttl > 0:
+                pipe.set(reverse_key(key[len("long_to_short:"):]), short_code, px=pttl, nx=True)
+            pipe.delete(key)
+        pipe.execute()
+        batch.clear()
+
+    for key in r.scan_iter(match="long_to_short:*", count=batch_size):
+        # Digest keys have no scheme separator.
+        if "://" not in key:
+            continue
+        batch.append(key)
+        migrated += 1
+        if len(batch) >= batch_size:
+            flush()
+
+    if batch:
+        flush()
+
+    return migrated
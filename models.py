@@ -1,80 +1,73 @@
-import redis
-import json
-from argon2 import PasswordHasher
-from argon2.exceptions import VerifyMismatchError
+from cache import MISSING, TTLCache
 from config import Config
+import passwords
+import storage
 
-r = redis.Redis(
-    host=Config.REDIS_HOST,
-    port=Config.REDIS_PORT,
-    db=Config.REDIS_DB,
-    decode_responses=True
-)
-
-ph = PasswordHasher()
+# Users never change their id or email, so authenticated requests can reuse
+# a recently loaded profile instead of reading and decoding it again.
+user_cache = None
+if Config.USER_CACHE_SIZE > 0:
+    user_cache = TTLCache(maxsize=Config.USER_CACHE_SIZE, ttl=Config.USER_CACHE_TTL)
 
 
 class User:
-    def __init__(self, user_id, email, password_hash=None):
+    """A user profile. The password hash is stored apart and only fetched
+    by ``password_hash``, so cached users never hold it."""
+
+    __slots__ = ("user_id", "email")
+
+    def __init__(self, user_id, email):
         self.user_id = user_id
         self.email = email
-        self.password_hash = password_hash
+
+    @property
+    def password_hash(self):
+        return storage.backend.users.get_password_hash(self.user_id)
 
     @staticmethod
     def create(email, password):
-        if r.exists(f"user:email:{email}"):
+        users = storage.backend.users
+        if users.find_by_email(email):
             return None
 
-        user_id = r.incr("user:id:counter")
-        password_hash = ph.hash(password)
-
-        user_data = {
-            "user_id": user_id,
-            "email": email,
-            "password_hash": password_hash
-        }
-
-        r.set(f"user:id:{user_id}", json.dumps(user_data))
-        r.set(f"user:email:{email}", user_id)
+        password_hash = passwords.hash_password(password)
+        user_id = users.create(email, password_hash)
+        if user_id is None:
+            return None
 
-        return User(user_id, email, password_hash)
+        return User(user_id, email)
 
     @staticmethod
     def get_by_email(email):
-        user_id = r.get(f"user:email:{email}")
+        user_id = storage.backend.users.find_by_email(email)
         if not user_id:
             return None
 
-        return User.get_by_id(int(user_id))
+        return User.get_by_id(user_id)
 
     @staticmethod
     def get_by_id(user_id):
-        user_data = r.get(f"user:id:{user_id}")
-        if not user_data:
+        if user_cache is not None:
+            user = user_cache.get(user_id)
+            if user is not MISSING:
+                return user
+
+        data = storage.backend.users.get(user_id)
+        if not data:
             return None
 
-        data = json.loads(user_data)
-        return User(
-            user_id=data["user_id"],
-            email=data["email"],
-            password_hash=data["password_hash"]
-        )
+        user = User(user_id=data["user_id"], email=data["email"])
+        if user_cache is not None:
+            user_cache.set(user_id, user)
+        return user
 
     def verify_password(self, password):
-        try:
-            ph.verify(self.password_hash, password)
-
-            if ph.check_needs_rehash(self.password_hash):
-                self.password_hash = ph.hash(password)
-                self._update_password_hash()
-
-            return True
-        except VerifyMismatchError:
+        """Check ``password``; raises ``passwords.PasswordPoolBusy`` when saturated."""
+        password_hash = self.password_hash
+        if password_hash is None:
             return False
 
-    def _update_password_hash(self):
-        user_data = r.get(f"user:id:{self.user_id}")
-        if user_data:
-            data = json.loads(user_data)
-            data["password_hash"] = self.password_hash
-            r.set(f"user:id:{self.user_id}", json.dumps(data))
\ No newline at end of file
+        matches, new_hash = passwords.verify_password(password_hash, password)
+        if new_hash:
+            storage.backend.users.set_password_hash(self.user_id, new_hash)
+        return matches
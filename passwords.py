@@ -0,0 +1,110 @@
+"""Password hashing on a bounded worker pool.
+
+argon2 is deliberately slow and memory hungry, so a burst of logins run on
+the request threads would take every CPU the redirects also need. Hashes
+are computed by at most ``PASSWORD_HASH_WORKERS`` threads instead (argon2
+releases the GIL while hashing), with at most ``PASSWORD_HASH_MAX_PENDING``
+jobs running or queued per process. A request whose job cannot be queued,
+or that waits longer than ``PASSWORD_HASH_TIMEOUT`` seconds, gets
+``PasswordPoolBusy``, which the app answers with a 503.
+
+The argon2 cost comes from ``ARGON2_TIME_COST``, ``ARGON2_MEMORY_COST``
+(KiB) and ``ARGON2_PARALLELISM``; hashes made with other parameters are
+rehashed on the next successful login.
+"""
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from argon2 import PasswordHasher
+from argon2.exceptions import VerifyMismatchError
+
+from config import Config
+
+hasher = PasswordHasher(
+    time_cost=Config.ARGON2_TIME_COST,
+    memory_cost=Config.ARGON2_MEMORY_COST,
+    parallelism=Config.ARGON2_PARALLELISM,
+)
+
+
+class PasswordPoolBusy(Exception):
+    """No hashing capacity is available for this request."""
+
+
+_executor = None
+_lock = threading.Lock()
+_pending = 0
+rejected = 0
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=Config.PASSWORD_HASH_WORKERS,
+            thread_name_prefix="password-hash",
+        )
+        atexit.register(_executor.shutdown, wait=False)
+    return _executor
+
+
+def _claim_slot():
+    global _pending, rejected
+    with _lock:
+        if _pending >= Config.PASSWORD_HASH_MAX_PENDING:
+            rejected += 1
+            return False
+        _pending += 1
+        return True
+
+
+def _release_slot(_):
+    global _pending
+    with _lock:
+        _pending -= 1
+
+
+def _run(fn, *args):
+    if Config.PASSWORD_HASH_WORKERS <= 0:
+        return fn(*args)
+    if not _claim_slot():
+        raise PasswordPoolBusy()
+    future = _get_executor().submit(fn, *args)
+    future.add_done_callback(_release_slot)
+    try:
+        return future.result(timeout=Config.PASSWORD_HASH_TIMEOUT)
+    except TimeoutError:
+        future.cancel()
+        raise PasswordPoolBusy()
+
+
+def _verify(password_hash, password):
+    try:
+        hasher.verify(password_hash, password)
+    except VerifyMismatchError:
+        return False, None
+    if hasher.check_needs_rehash(password_hash):
+        return True, hasher.hash(password)
+    return True, None
+
+
+def hash_password(password):
+    return _run(hasher.hash, password)
+
+
+def verify_password(password_hash, password):
+    """Check ``password``; returns ``(matches, new_hash)``.
+
+    ``new_hash`` is set when the stored hash was made with other argon2
+    parameters than the configured ones and should replace it.
+    """
+    return _run(_verify, password_hash, password)
+
+
+def stats():
+    return {
+        "workers": Config.PASSWORD_HASH_WORKERS,
+        "pending": _pending,
+        "rejected": rejected,
+    }
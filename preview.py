@@ -0,0 +1,292 @@
+"""Link preview fetching and caching.
+
+A preview only needs a page's ``<title>`` and description meta tag, so the
+fetcher streams the response and stops at ``</head>`` (or the opening
+``<body>``) or after ``PREVIEW_MAX_BYTES``, whichever comes first. Responses
+that are not HTML are closed without reading their body. Connections are
+kept in per-thread ``requests`` sessions and reused across fetches, and
+``fetch_many`` fetches a batch of URLs on a thread pool of
+``PREVIEW_CONCURRENCY`` threads, at most ``PREVIEW_PER_HOST`` of them on
+one host at a time.
+
+Previews are cached per page rather than per short code, keyed by a digest
+of the normalized URL, so every code for the same page (including URLs that
+differ only in tracking parameters or fragment) shares one fetch:
+
+    preview:url:{digest}    the preview JSON, or {"error": ...} for a
+                            failure, cached for PREVIEW_NEGATIVE_TTL
+    preview:lock:{digest}   set while a fetch is queued or running
+    preview:host:{host}     set for PREVIEW_NEGATIVE_TTL after the host
+                            (and port) could not be reached
+"""
+import codecs
+import hashlib
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from html.parser import HTMLParser
+from urllib.parse import urldefrag, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from canonical import canonicalize
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+HTML_TYPES = ("text/html", "application/xhtml+xml")
+CHUNK_SIZE = 8192
+# Chunks read past the head so a short page's connection can be reused;
+# closing a response with unread body drops its connection.
+DRAIN_CHUNKS = 4
+
+
+def normalize_url(url):
+    """The canonical URL (see canonical.py) without its fragment, which the
+    server never sees."""
+    try:
+        return urldefrag(canonicalize(url)).url
+    except ValueError:
+        return url
+
+
+def url_digest(url):
+    return hashlib.blake2b(normalize_url(url).encode(), digest_size=16).hexdigest()
+
+
+def cache_key(digest):
+    return f"preview:url:{digest}"
+
+
+def lock_key(digest):
+    return f"preview:lock:{digest}"
+
+
+def host_key(url):
+    return f"preview:host:{urlsplit(url).netloc.rpartition('@')[2].lower()}"
+
+
+class HeadParser(HTMLParser):
+    """Collects the title and description of a document until its head ends."""
+
+    def __init__(self):
+        super().__init__()
+        self.title = None
+        self.description = ""
+        self.done = False
+        self._title_parts = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "title" and self.title is None:
+            self._title_parts = []
+        elif tag == "meta" and not self.description:
+            attrs = dict(attrs)
+            if (attrs.get("name") or "").lower() == "description":
+                self.description = attrs.get("content") or ""
+        elif tag == "body":
+            self.done = True
+
+    def handle_endtag(self, tag):
+        if tag == "title" and self._title_parts is not None:
+            self.title = "".join(self._title_parts).strip()
+            self._title_parts = None
+        elif tag == "head":
+            self.done = True
+
+    def handle_data(self, data):
+        if self._title_parts is not None:
+            self._title_parts.append(data)
+
+
+def is_html(content_type):
+    return content_type.split(";", 1)[0].strip().lower() in HTML_TYPES
+
+
+def make_decoder(content_type):
+    """Incremental decoder for the header's charset, UTF-8 if absent or unknown.
+
+    ``requests`` would assume ISO-8859-1 for ``text/html`` without a charset,
+    which garbles most pages that do not declare one.
+    """
+    _, _, charset = content_type.lower().partition("charset=")
+    charset = charset.split(";", 1)[0].strip(' "\'') or "utf-8"
+    try:
+        return codecs.getincrementaldecoder(charset)(errors="replace")
+    except LookupError:
+        return codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+
+class PreviewFetcher:
+    """Fetches ``{"title", "description"}`` previews over pooled connections.
+
+    ``requests`` sessions are not thread-safe, so each thread gets its own,
+    keeping up to ``pool_hosts`` hosts' connections open. The thread pool and
+    sessions are created on first use, after Celery has forked its workers.
+    At most ``per_host`` fetches run against one host at once, the rest wait.
+    ``stats()`` reports counts and fetch times.
+    """
+
+    def __init__(self, timeout, max_bytes, concurrency, pool_hosts, per_host):
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.concurrency = concurrency
+        self.pool_hosts = pool_hosts
+        self.per_host = per_host
+        self._local = threading.local()
+        self._pool = None
+        self._lock = threading.Lock()
+        # host -> [semaphore, fetches holding or waiting for it]
+        self._hosts = {}
+        self.fetched = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes_read = 0
+        self.seconds = 0.0
+
+    def session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.pool_hosts, pool_maxsize=1)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._local.session = session
+        return session
+
+    @contextmanager
+    def _host_slot(self, url):
+        host = urlsplit(url).hostname or ""
+        with self._lock:
+            slot = self._hosts.get(host)
+            if slot is None:
+                slot = self._hosts[host] = [threading.Semaphore(self.per_host), 0]
+            slot[1] += 1
+        try:
+            with slot[0]:
+                yield
+        finally:
+            with self._lock:
+                slot[1] -= 1
+                if not slot[1]:
+                    del self._hosts[host]
+
+    def fetch(self, url):
+        """Return the preview of ``url``, or None if it is not an HTML page.
+
+        Raises ``requests.RequestException`` when the fetch fails.
+        """
+        with self._host_slot(url):
+            return self._fetch(url)
+
+    def _fetch(self, url):
+        start = time.perf_counter()
+        read = 0
+        outcome = "failed"
+        try:
+            with self.session().get(url, timeout=self.timeout, stream=True) as response:
+                response.raise_for_status()
+                content_type = response.headers.get("Content-Type", "")
+                if not is_html(content_type):
+                    outcome = "skipped"
+                    return None
+
+                parser = HeadParser()
+                decoder = make_decoder(content_type)
+                chunks = response.iter_content(CHUNK_SIZE)
+                for chunk in chunks:
+                    read += len(chunk)
+                    parser.feed(decoder.decode(chunk))
+                    if parser.done or read >= self.max_bytes:
+                        break
+                for _, chunk in zip(range(DRAIN_CHUNKS), chunks):
+                    read += len(chunk)
+                outcome = "fetched"
+                return {
+                    "title": (parser.title or "No title")[:100],
+                    "description": parser.description[:200],
+                }
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                setattr(self, outcome, getattr(self, outcome) + 1)
+                self.bytes_read += read
+                self.seconds += elapsed
+            logger.debug("Preview of %s %s in %.1fms (%d bytes)", url, outcome, elapsed * 1000, read)
+
+    def _fetch_or_error(self, url):
+        try:
+            return self.fetch(url)
+        except Exception as e:
+            return e
+
+    def fetch_many(self, urls):
+        """Fetch ``urls`` concurrently; returns a preview, None or the exception for each."""
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(self.concurrency, thread_name_prefix="preview")
+        return list(self._pool.map(self._fetch_or_error, urls))
+
+    def stats(self):
+        with self._lock:
+            attempts = self.fetched + self.skipped + self.failed
+            return {
+                "fetched": self.fetched,
+                "skipped": self.skipped,
+                "failed": self.failed,
+                "bytes_read": self.bytes_read,
+                "mean_ms": self.seconds / attempts * 1000 if attempts else 0.0,
+            }
+
+
+fetcher = PreviewFetcher(
+    timeout=Config.PREVIEW_TIMEOUT,
+    max_bytes=Config.PREVIEW_MAX_BYTES,
+    concurrency=Config.PREVIEW_CONCURRENCY,
+    pool_hosts=Config.PREVIEW_POOL_HOSTS,
+    per_host=Config.PREVIEW_PER_HOST,
+)
+
+
+def claim(client, urls):
+    """Return the URLs of ``urls`` whose preview should be fetched, and claim them.
+
+    A URL is left out if its page already has a cached preview or failure,
+    its host was recently unreachable, an earlier URL in ``urls`` is the
+    same page, or another request claimed it first. Two round trips.
+    """
+    pages = {}
+    for url in urls:
+        pages.setdefault(url_digest(url), url)
+
+    pipe = client.pipeline(transaction=False)
+    for digest, url in pages.items():
+        pipe.exists(cache_key(digest), host_key(url))
+    candidates = [digest for digest, known in zip(pages, pipe.execute()) if not known]
+
+    for digest in candidates:
+        pipe.set(lock_key(digest), 1, nx=True, ex=Config.PREVIEW_LOCK_TTL)
+    return [pages[digest] for digest, claimed in zip(candidates, pipe.execute()) if claimed]
+
+
+def queue_result(pipe, url, result):
+    """Queue caching one ``fetch_many`` result on ``pipe`` and releasing its claim."""
+    digest = url_digest(url)
+    if isinstance(result, dict):
+        pipe.setex(cache_key(digest), Config.PREVIEW_TTL, json.dumps(result))
+    else:
+        error = "Not an HTML page" if result is None else str(result)
+        pipe.setex(cache_key(digest), Config.PREVIEW_NEGATIVE_TTL, json.dumps({"error": error[:200]}))
+        if isinstance(result, (requests.ConnectionError, requests.Timeout)):
+            pipe.setex(host_key(url), Config.PREVIEW_NEGATIVE_TTL, 1)
+    pipe.delete(lock_key(digest))
+
+
+def cached(client, url):
+    """Return the cached preview of ``url``'s page, or None."""
+    data = client.get(cache_key(url_digest(url)))
+    data = json.loads(data) if data else None
+    return data if data and "error" not in data else None
@@ -0,0 +1,290 @@
+"""Rate limit storage that counts in process memory and reconciles with Redis.
+
+With the ``redis`` storage every rate limited request costs flask-limiter a
+Redis round trip. ``HybridStorage`` (``RATELIMIT_STORAGE=hybrid``, storage
+URI ``hybrid+redis://``) serves the sliding window counter strategy from
+memory instead: each process keeps, per window key, the total Redis last
+reported plus the hits it has admitted since, and a background thread adds
+those hits to Redis and reads back the totals every
+``RATELIMIT_SYNC_INTERVAL`` seconds.
+
+A process syncs a key at once when its unsynced hits reach
+``RATELIMIT_LOCAL_SHARE`` of the limit, so with N processes a client can get
+at most about ``N * share * limit`` requests past a limit before every
+process sees it. Limits too small to have a local share (e.g. 10 per
+minute at the default 0.1) are checked against Redis on every hit, in one
+script call that adds the hit only if it is allowed, so they cost the same
+single round trip as the plain storage. Fixed window ``incr`` calls always
+go to Redis.
+"""
+import atexit
+import logging
+import math
+import threading
+import time
+
+import redis
+from limits.storage import SlidingWindowCounterSupport, Storage
+from limits.storage.base import TimestampedSlidingWindow
+
+from config import Config
+from redis_client import get_pool
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "hybrid_limit:"
+
+# Adds a process' unsynced hits to both windows of a sliding window counter,
+# then the new hit if it stays within the limit, in one round trip.
+# KEYS: previous window, current window
+# ARGV: previous unsynced hits, current unsynced hits, previous window TTL,
+#       current window TTL, hit amount, limit, weight of the previous window
+# Returns {previous total, current total, 1 if the hit was added else 0}.
+ACQUIRE_LUA = """
+local function add(key, n, ttl)
+    if n == 0 then
+        return tonumber(redis.call('GET', key) or '0')
+    end
+    local total = redis.call('INCRBY', key, n)
+    redis.call('EXPIRE', key, ttl, 'NX')
+    return total
+end
+
+local previous = add(KEYS[1], tonumber(ARGV[1]), ARGV[3])
+local current = add(KEYS[2], tonumber(ARGV[2]), ARGV[4])
+local amount = tonumber(ARGV[5])
+if math.floor(previous * tonumber(ARGV[7]) + current) + amount > tonumber(ARGV[6]) then
+    return {previous, current, 0}
+end
+return {previous, add(KEYS[2], amount, ARGV[4]), 1}
+"""
+
+
+class _Counter:
+    __slots__ = ("shared", "local", "expires_at", "synced")
+
+    def __init__(self, expires_at):
+        self.shared = 0
+        self.local = 0
+        self.expires_at = expires_at
+        self.synced = False
+
+
+class HybridStorage(Storage, SlidingWindowCounterSupport, TimestampedSlidingWindow):
+    STORAGE_SCHEME = ["hybrid+redis"]
+
+    def __init__(self, uri=None, wrap_exceptions=False, connection_pool=None,
+                 sync_interval=1.0, local_share=0.1, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions)
+        if connection_pool is not None:
+            self.storage = redis.Redis(connection_pool=connection_pool)
+        else:
+            self.storage = redis.Redis.from_url(uri.replace("hybrid+", "", 1), **options)
+        self.sync_interval = float(sync_interval)
+        self.local_share = float(local_share)
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._acquire_script = self.storage.register_script(ACQUIRE_LUA)
+        self.syncs = 0
+
+    @property
+    def base_exceptions(self):
+        return redis.RedisError
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name="ratelimit-sync", daemon=True)
+        self._thread.start()
+        atexit.register(self.sync)
+
+    def _run(self):
+        while True:
+            time.sleep(self.sync_interval)
+            try:
+                self.sync()
+            except Exception:
+                logger.exception("Rate limit sync failed, retrying next interval")
+
+    def sync(self, keys=None):
+        """Add this process' unsynced hits to Redis and read back the totals."""
+        now = time.time()
+        with self._lock:
+            if keys is None:
+                keys = list(self._counters)
+            batch = []
+            for key in keys:
+                counter = self._counters.get(key)
+                if counter is None:
+                    continue
+                if counter.expires_at <= now:
+                    del self._counters[key]
+                    continue
+                batch.append((key, counter.local, counter.expires_at))
+                counter.local = 0
+        if not batch:
+            return
+
+        pipe = self.storage.pipeline(transaction=False)
+        for key, pending, expires_at in batch:
+            pipe.incrby(KEY_PREFIX + key, pending)
+            pipe.expire(KEY_PREFIX + key, max(1, math.ceil(expires_at - now)), nx=True)
+        try:
+            replies = pipe.execute()
+        except Exception:
+            with self._lock:
+                for key, pending, _ in batch:
+                    if key in self._counters:
+                        self._counters[key].local += pending
+            raise
+
+        with self._lock:
+            for (key, _, _), total in zip(batch, replies[::2]):
+                counter = self._counters.get(key)
+                if counter is not None:
+                    counter.shared = total
+                    counter.synced = True
+            self.syncs += 1
+
+    def _counter(self, key, expiry, now):
+        counter = self._counters.get(key)
+        if counter is None or counter.expires_at <= now:
+            counter = self._counters[key] = _Counter(now + expiry)
+        return counter
+
+    def _count(self, key, now):
+        counter = self._counters.get(key)
+        if counter is None or counter.expires_at <= now:
+            return 0
+        return counter.shared + counter.local
+
+    def _window(self, previous_key, current_key, expiry, now):
+        previous_count = self._count(previous_key, now)
+        previous_ttl = (1 - (((now - expiry) / expiry) % 1)) * expiry if previous_count else 0.0
+        current_ttl = (1 - ((now / expiry) % 1)) * expiry + expiry
+        return previous_count, previous_ttl, self._count(current_key, now), current_ttl
+
+    def _acquire_in_redis(self, previous_key, current_key, limit, expiry, amount, now):
+        """Decide a hit against the shared totals; see ``ACQUIRE_LUA``."""
+        with self._lock:
+            counters = [self._counters[previous_key], self._counters[current_key]]
+            pending = [counter.local for counter in counters]
+            for counter in counters:
+                counter.local = 0
+
+        weight = 1 - ((now / expiry) % 1)
+        ttls = [max(1, math.ceil(counter.expires_at - now)) for counter in counters]
+        try:
+            previous, current, added = self._acquire_script(
+                keys=[KEY_PREFIX + previous_key, KEY_PREFIX + current_key],
+                args=[*pending, *ttls, amount, limit, repr(weight)],
+            )
+        except Exception:
+            with self._lock:
+                for counter, n in zip(counters, pending):
+                    counter.local += n
+            raise
+
+        with self._lock:
+            for counter, total in zip(counters, (previous, current)):
+                counter.shared = total
+                counter.synced = True
+        return bool(added)
+
+    def acquire_sliding_window_entry(self, key, limit, expiry, amount=1):
+        if amount > limit:
+            return False
+        now = time.time()
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        budget = int(limit * self.local_share)
+
+        with self._lock:
+            if self._thread is None:
+                self._start()
+            self._counter(previous_key, 2 * expiry, now)
+            current = self._counter(current_key, 2 * expiry, now)
+            known = current.synced
+        if budget <= 1:
+            # Too tight for a local share: every hit is decided in Redis.
+            return self._acquire_in_redis(previous_key, current_key, limit, expiry, amount, now)
+        if not known:
+            # A window this process knows nothing about yet.
+            self.sync([previous_key, current_key])
+
+        with self._lock:
+            previous_count, previous_ttl, current_count, _ = self._window(previous_key, current_key, expiry, now)
+            if math.floor(previous_count * previous_ttl / expiry + current_count) + amount > limit:
+                return False
+            current.local += amount
+            unsynced = current.local
+        if unsynced >= budget:
+            self.sync([current_key])
+        return True
+
+    def get_sliding_window(self, key, expiry):
+        now = time.time()
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        with self._lock:
+            return self._window(previous_key, current_key, expiry, now)
+
+    def clear_sliding_window(self, key, expiry):
+        now = time.time()
+        for window_key in self.sliding_window_keys(key, expiry, now):
+            self.clear(window_key)
+
+    def incr(self, key, expiry, amount=1):
+        pipe = self.storage.pipeline(transaction=False)
+        pipe.incrby(KEY_PREFIX + key, amount)
+        pipe.expire(KEY_PREFIX + key, int(expiry), nx=True)
+        return pipe.execute()[0]
+
+    def get(self, key):
+        with self._lock:
+            counter = self._counters.get(key)
+        if counter is not None:
+            return self._count(key, time.time())
+        return int(self.storage.get(KEY_PREFIX + key) or 0)
+
+    def get_expiry(self, key):
+        with self._lock:
+            counter = self._counters.get(key)
+        if counter is not None:
+            return counter.expires_at
+        return time.time() + max(self.storage.ttl(KEY_PREFIX + key), 0)
+
+    def check(self):
+        try:
+            return self.storage.ping()
+        except redis.RedisError:
+            return False
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+        removed = 0
+        for key in self.storage.scan_iter(match=KEY_PREFIX + "*"):
+            removed += self.storage.delete(key)
+        return removed
+
+    def clear(self, key):
+        with self._lock:
+            self._counters.pop(key, None)
+        self.storage.delete(KEY_PREFIX + key)
+
+
+def limiter_settings():
+    """Storage and strategy arguments for the app's ``Limiter``, per ``RATELIMIT_STORAGE``."""
+    if Config.RATELIMIT_STORAGE == "hybrid":
+        return {
+            "storage_uri": "hybrid+" + Config.RATELIMIT_STORAGE_URL,
+            "storage_options": {
+                "connection_pool": get_pool(),
+                "sync_interval": Config.RATELIMIT_SYNC_INTERVAL,
+                "local_share": Config.RATELIMIT_LOCAL_SHARE,
+            },
+            "strategy": "sliding-window-counter",
+        }
+    return {
+        "storage_uri": Config.RATELIMIT_STORAGE_URL,
+        "storage_options": {"connection_pool": get_pool()},
+        "strategy": "fixed-window",
+    }
@@ -0,0 +1,159 @@
+import time
+
+import redis
+import redis.asyncio
+import redis.asyncio.client
+import redis.client
+from redis.asyncio.retry import Retry as AsyncRetry
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import ConnectionError, TimeoutError
+from redis.retry import Retry
+from config import Config
+import metrics
+
+_pool = None
+_async_pool = None
+
+
+def connection_options():
+    """Connection settings shared by the sync and asyncio pools."""
+    return {
+        "host": Config.REDIS_HOST,
+        "port": Config.REDIS_PORT,
+        "db": Config.REDIS_DB,
+        "decode_responses": True,
+        "max_connections": Config.REDIS_MAX_CONNECTIONS,
+        "timeout": Config.REDIS_POOL_TIMEOUT,
+        "socket_timeout": Config.REDIS_SOCKET_TIMEOUT,
+        "socket_connect_timeout": Config.REDIS_SOCKET_CONNECT_TIMEOUT,
+        "socket_keepalive": True,
+        "health_check_interval": Config.REDIS_HEALTH_CHECK_INTERVAL,
+        "retry_on_error": [ConnectionError, TimeoutError],
+    }
+
+
+def _backoff():
+    return ExponentialBackoff(cap=Config.REDIS_RETRY_BACKOFF_CAP, base=Config.REDIS_RETRY_BACKOFF_BASE)
+
+
+def get_pool():
+    """Return the process-wide connection pool, creating it on first use.
+
+    The pool blocks for up to ``REDIS_POOL_TIMEOUT`` seconds when all
+    ``REDIS_MAX_CONNECTIONS`` connections are checked out instead of opening
+    more, and redis-py resets it automatically in forked children.
+    """
+    global _pool
+    if _pool is None:
+        _pool = redis.BlockingConnectionPool(
+            retry=Retry(_backoff(), Config.REDIS_RETRY_ATTEMPTS),
+            **connection_options()
+        )
+    return _pool
+
+
+def get_async_pool():
+    global _async_pool
+    if _async_pool is None:
+        _async_pool = redis.asyncio.BlockingConnectionPool(
+            retry=AsyncRetry(_backoff(), Config.REDIS_RETRY_ATTEMPTS),
+            **connection_options()
+        )
+    return _async_pool
+
+
+class InstrumentedRedis(redis.Redis):
+    """``redis.Redis`` that reports every round trip to metrics.py."""
+
+    def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = super().execute_command(*args, **options)
+            failed = False
+            return result
+        finally:
+            metrics.record_redis(str(args[0]).upper(), time.perf_counter() - start, failed=failed)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class InstrumentedPipeline(redis.client.Pipeline):
+    def execute(self, raise_on_error=True):
+        commands = [str(args[0]).upper() for args, _ in self.command_stack]
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = super().execute(raise_on_error)
+            failed = False
+            return result
+        finally:
+            metrics.record_redis("PIPELINE", time.perf_counter() - start, commands, failed)
+
+
+class InstrumentedAsyncRedis(redis.asyncio.Redis):
+    async def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = await super().execute_command(*args, **options)
+            failed = False
+            return result
+        finally:
+            metrics.record_redis(str(args[0]).upper(), time.perf_counter() - start, failed=failed)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedAsyncPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class InstrumentedAsyncPipeline(redis.asyncio.client.Pipeline):
+    async def execute(self, raise_on_error=True):
+        commands = [str(args[0]).upper() for args, _ in self.command_stack]
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = await super().execute(raise_on_error)
+            failed = False
+            return result
+        finally:
+            metrics.record_redis("PIPELINE", time.perf_counter() - start, commands, failed)
+
+
+def get_redis():
+    client_class = InstrumentedRedis if metrics.enabled else redis.Redis
+    return client_class(connection_pool=get_pool())
+
+
+def get_async_redis():
+    client_class = InstrumentedAsyncRedis if metrics.enabled else redis.asyncio.Redis
+    return client_class(connection_pool=get_async_pool())
+
+
+def celery_settings():
+    """Celery settings that apply the same limits to its broker and result backend.
+
+    Celery cannot share the redis-py pool, so its connections are capped and
+    tuned separately with the same values.
+    """
+    return {
+        "broker_pool_limit": Config.REDIS_MAX_CONNECTIONS,
+        "broker_transport_options": {
+            "max_connections": Config.REDIS_MAX_CONNECTIONS,
+            "socket_timeout": Config.REDIS_SOCKET_TIMEOUT,
+            "socket_connect_timeout": Config.REDIS_SOCKET_CONNECT_TIMEOUT,
+            "socket_keepalive": True,
+            "health_check_interval": Config.REDIS_HEALTH_CHECK_INTERVAL,
+        },
+        "task_publish_retry_policy": {
+            "max_retries": Config.REDIS_RETRY_ATTEMPTS,
+            "interval_start": 0,
+            "interval_step": Config.REDIS_RETRY_BACKOFF_BASE,
+            "interval_max": Config.REDIS_RETRY_BACKOFF_CAP,
+        },
+        "redis_max_connections": Config.REDIS_MAX_CONNECTIONS,
+        "redis_socket_timeout": Config.REDIS_SOCKET_TIMEOUT,
+        "redis_socket_connect_timeout": Config.REDIS_SOCKET_CONNECT_TIMEOUT,
+        "redis_socket_keepalive": True,
+        "redis_backend_health_check_interval": Config.REDIS_HEALTH_CHECK_INTERVAL,
+    }
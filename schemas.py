@@ -1,5 +1,6 @@
 from apiflask import Schema
 from apiflask.fields import String, Boolean, Integer
+from apiflask.validators import Range, OneOf
 
 class ShortenIn(Schema):
     url = String(required=True)
@@ -19,3 +20,51 @@ class ShortenOut(Schema):
         message = String(required=False, metadata={"description": "Info message"})
         user_id = String(required=False, metadata={"description": "Owner user ID"})
         created_at = String(required=False, metadata={"description": "Creation timestamp"})
+
+
+class MyLinksQuery(Schema):
+    limit = Integer(
+        load_default=20,
+        validate=Range(min=1, max=100),
+        metadata={"description": "Page size (1-100)"}
+    )
+    cursor = String(
+        required=False,
+        metadata={"description": "Value of next_cursor from the previous page"}
+    )
+    order = String(
+        load_default="desc",
+        validate=OneOf(["desc", "asc"]),
+        metadata={"description": "Sort by creation time, newest (desc) or oldest (asc) first"}
+    )
+
+
+class TimeseriesQuery(Schema):
+    granularity = String(
+        load_default="hour",
+        validate=OneOf(["minute", "hour", "day"]),
+        metadata={"description": "Bucket size"}
+    )
+    start = Integer(
+        required=False,
+        validate=Range(min=0),
+        metadata={"description": "Unix time of the first bucket (default: 59 buckets before end)"}
+    )
+    end = Integer(
+        required=False,
+        validate=Range(min=0),
+        metadata={"description": "Unix time of the last bucket (default: now)"}
+    )
+
+
+class TrendingQuery(Schema):
+    window = String(
+        load_default="1h",
+        validate=OneOf(["5m", "1h", "1d"]),
+        metadata={"description": "Time window: last 5 minutes, hour or day"}
+    )
+    limit = Integer(
+        load_default=10,
+        validate=Range(min=1, max=100),
+        metadata={"description": "Number of links (1-100)"}
+    )
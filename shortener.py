@@ -1,18 +1,435 @@
-import redis
+import hashlib
+import itertools
+import json
 import secrets
 import string
+from datetime import datetime
 from config import Config
+import compact
+from canonical import canonicalize, dedup_key, url_digest
+from redis_client import get_redis, get_async_redis
 
-r = redis.Redis(
-    host=Config.REDIS_HOST,
-    port=Config.REDIS_PORT,
-    db=Config.REDIS_DB,
-    decode_responses=True
-)
+r = get_redis()
+
+# Used by the ASGI entry point.
+ar = get_async_redis()
+
+CHARACTERS = string.ascii_letters + string.digits
+BASE = len(CHARACTERS)
+
+
+def random_short_code(length=6) -> str:
+    return ''.join(secrets.choice(CHARACTERS) for _ in range(length))
+
+
+def encode_base62(n, length) -> str:
+    chars = []
+    for _ in range(length):
+        n, rem = divmod(n, BASE)
+        chars.append(CHARACTERS[rem])
+    return ''.join(reversed(chars))
+
+
+class RandomCodeAllocator:
+    """Random codes; a code is grown by one character every ``grow_after`` collisions."""
+
+    def __init__(self, length=6, grow_after=3):
+        self.length = length
+        self.grow_after = grow_after
+
+    def _length(self, attempt):
+        return self.length + attempt // self.grow_after
+
+    def allocate(self, client, attempt=0) -> str:
+        return random_short_code(self._length(attempt))
+
+    async def allocate_async(self, client, attempt=0) -> str:
+        return random_short_code(self._length(attempt))
+
+    def allocate_many(self, client, count, attempt=0):
+        return [random_short_code(self._length(attempt)) for _ in range(count)]
+
+
+class CounterCodeAllocator:
+    """Codes derived from a Redis counter, one INCR per code.
+
+    The n-th value is mapped through a keyed Feistel permutation of the
+    ``62**length`` codes of the current length, so consecutive codes look
+    unrelated and never repeat. Once every code of a length is used the
+    counter moves on to codes one character longer.
+    """
+
+    COUNTER_KEY = "code:counter"
+    ROUNDS = 4
+
+    def __init__(self, length=6, secret=""):
+        self.length = length
+        self.secret = hashlib.blake2b(secret.encode(), digest_size=32).digest()
+
+    def _round(self, i, value, bits):
+        digest = hashlib.blake2b(
+            value.to_bytes(16, "big") + bytes([i]), key=self.secret, digest_size=16
+        ).digest()
+        return int.from_bytes(digest, "big") & ((1 << bits) - 1)
+
+    def _permute(self, n, domain):
+        half = (max(domain - 1, 1).bit_length() + 1) // 2
+        mask = (1 << half) - 1
+        while True:
+            left, right = n >> half, n & mask
+            for i in range(self.ROUNDS):
+                left, right = right, left ^ self._round(i, right, half)
+            n = (left << half) | right
+            # Cycle-walk back into the domain, which keeps the mapping bijective.
+            if n < domain:
+                return n
+
+    def encode(self, n) -> str:
+        length = self.length
+        while n >= BASE ** length:
+            n -= BASE ** length
+            length += 1
+        return encode_base62(self._permute(n, BASE ** length), length)
+
+    def allocate(self, client, attempt=0) -> str:
+        return self.encode(client.incr(self.COUNTER_KEY) - 1)
+
+    async def allocate_async(self, client, attempt=0) -> str:
+        return self.encode(await client.incr(self.COUNTER_KEY) - 1)
+
+    def allocate_many(self, client, count, attempt=0):
+        end = client.incrby(self.COUNTER_KEY, count)
+        return [self.encode(n) for n in range(end - count, end)]
+
+
+class PoolCodeAllocator:
+    """Pops codes from a pre-reserved pool that ``refill_code_pool`` keeps filled.
+
+    An empty pool falls back to ``fallback`` so shortening never stalls.
+    """
+
+    POOL_KEY = "code:pool"
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+
+    def allocate(self, client, attempt=0) -> str:
+        return client.spop(self.POOL_KEY) or self.fallback.allocate(client, attempt)
+
+    async def allocate_async(self, client, attempt=0) -> str:
+        return await client.spop(self.POOL_KEY) or await self.fallback.allocate_async(client, attempt)
+
+    def allocate_many(self, client, count, attempt=0):
+        codes = client.spop(self.POOL_KEY, count) or []
+        return codes + self.fallback.allocate_many(client, count - len(codes), attempt)
+
+
+def make_allocator(name):
+    random_allocator = RandomCodeAllocator(Config.SHORT_CODE_LENGTH, Config.SHORT_CODE_GROW_AFTER)
+    if name == "counter":
+        return CounterCodeAllocator(Config.SHORT_CODE_LENGTH, Config.SHORT_CODE_SECRET)
+    if name == "pool":
+        return PoolCodeAllocator(random_allocator)
+    return random_allocator
+
+
+allocator = make_allocator(Config.SHORT_CODE_ALLOCATOR)
+
+# Expiry schedule (code -> expires_at) and owner (code -> user id) of user
+# links, so cleanup.py can unlink them from their user's index.
+EXPIRING_KEY = "links:expiring"
+OWNER_KEY = "links:owner"
+
+
+# Creates a link or returns the existing one atomically.
+# KEYS: url:{code}, long_to_short:{url digest}, metadata:{code}, user:{id}:link_index,
+#       clicks:{code}, clicks:{code}:visitors, links:expiring, links:owner
+# ARGV: long_url, code, expiry, custom ("1"/"0"), metadata json ("" when anonymous),
+#       created_at score, expires_at score, user id, look up existing ("1"/"0")
+# Returns one of:
+#   {"taken", code, url, ttl, clicks, unique}  custom code already in use
+#   {"existing", code, url, ttl}               a live link has the URL's digest
+#   {"collision"}                              generated code already in use
+#   {"created", code, url, ttl}
+# A created link starts with fresh counters, even on a reused custom code.
+# Lua cannot canonicalize the existing link's URL, so callers confirm an
+# "existing" reply with dedup_key and, on a digest collision, run the script
+# again without the lookup.
+# The script also reads url:{existing code}, a key it only learns from
+# long_to_short:{url digest} and so cannot declare in KEYS. That is fine on a
+# single Redis instance (or a replicated primary), which is how this app is
+# deployed, but not on Redis Cluster, where the keys would need a common hash
+# tag to be in one slot.
+SHORTEN_LUA = """
+if ARGV[4] == '1' then
+    local existing_url = redis.call('GET', KEYS[1])
+    if existing_url then
+        return {'taken', ARGV[2], existing_url, redis.call('TTL', KEYS[1]),
+                redis.call('GET', KEYS[5]) or '0', redis.call('PFCOUNT', KEYS[6])}
+    end
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+else
+    local existing_code = ARGV[9] == '1' and redis.call('GET', KEYS[2])
+    if existing_code then
+        local existing_key = 'url:' .. existing_code
+        local existing_url = redis.call('GET', existing_key)
+        if existing_url then
+            return {'existing', existing_code, existing_url, redis.call('TTL', existing_key)}
+        end
+    end
+    if not redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3], 'NX') then
+        return {'collision'}
+    end
+end
+
+redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+redis.call('DEL', KEYS[5], KEYS[6])
+if ARGV[5] ~= '' then
+    redis.call('SET', KEYS[3], ARGV[5], 'EX', ARGV[3])
+    redis.call('ZADD', KEYS[4], ARGV[6], ARGV[2])
+    redis.call('ZADD', KEYS[7], ARGV[7], ARGV[2])
+    redis.call('HSET', KEYS[8], ARGV[2], ARGV[8])
+end
+return {'created', ARGV[2], ARGV[1], tonumber(ARGV[3])}
+"""
+SHORTEN_SCRIPT = r.register_script(SHORTEN_LUA)
+ASYNC_SHORTEN_SCRIPT = ar.register_script(SHORTEN_LUA)
+
+
+def reverse_key(long_url):
+    """Key mapping a long URL to its code in the default layout."""
+    return f"long_to_short:{url_digest(long_url)}"
+
+
+def prepare_link(long_url, custom=None):
+    """Validate a requested link the same way for every entry point.
+
+    Adds ``https://`` to scheme-less URLs, checks that the URL has a
+    canonical form (see canonical.py) and checks the custom code (4-16
+    alphanumeric characters). The URL is returned as submitted, since that
+    is what redirects send visitors to. Returns ``(long_url, custom)`` or
+    raises ``ValueError``.
+    """
+    if not long_url.lower().startswith(('http://', 'https://')):
+        long_url = 'https://' + long_url
+    canonicalize(long_url)
+
+    if custom and not (4 <= len(custom) <= 16 and custom.isalnum()):
+        raise ValueError("Invalid custom code")
+
+    return long_url, custom
+
+
+def _shorten_call(short_code, long_url, expiry_time, custom, user_id, dedup=True):
+    created_at = datetime.now()
+    if compact.enabled():
+        bucket_key, field = compact.reverse_lookup(long_url)
+        keys = [
+            compact.link_key(short_code),
+            bucket_key,
+            f"user:{user_id or ''}:link_index",
+            f"clicks:{short_code}:visitors",
+            EXPIRING_KEY,
+            OWNER_KEY,
+        ]
+        args = [long_url, short_code, expiry_time, "1" if custom else "0", str(user_id or ""),
+                created_at.timestamp(), created_at.timestamp() + expiry_time, field,
+                "1" if dedup else "0"]
+        return keys, args
+
+    keys = [
+        f"url:{short_code}",
+        reverse_key(long_url),
+        f"metadata:{short_code}",
+        f"user:{user_id or ''}:link_index",
+        f"clicks:{short_code}",
+        f"clicks:{short_code}:visitors",
+        EXPIRING_KEY,
+        OWNER_KEY,
+    ]
+    metadata = ""
+    if user_id:
+        metadata = json.dumps({
+            "user_id": str(user_id),
+            "created_at": created_at.isoformat(),
+            "original_url": long_url,
+        })
+    args = [long_url, short_code, expiry_time, "1" if custom else "0", metadata,
+            created_at.timestamp(), created_at.timestamp() + expiry_time, user_id or "",
+            "1" if dedup else "0"]
+    return keys, args
+
+
+def _shorten_script(asynchronous=False):
+    if compact.enabled():
+        return compact.ASYNC_SHORTEN_SCRIPT if asynchronous else compact.SHORTEN_SCRIPT
+    return ASYNC_SHORTEN_SCRIPT if asynchronous else SHORTEN_SCRIPT
+
+
+def _shorten_result(result):
+    status, short_code, original_url, ttl = result[:4]
+    link = {
+        "status": status,
+        "short_code": short_code,
+        "original_url": original_url,
+        "expires_in_seconds": int(ttl),
+    }
+    if status == "taken":
+        link["total_clicks"] = int(result[4])
+        link["unique_ips"] = int(result[5])
+    return link
+
+
+def _is_other_page(result, long_url):
+    """Whether an ``existing`` reply is a different page whose URL digest collides."""
+    return result[0] == "existing" and dedup_key(result[2]) != dedup_key(long_url)
+
+
+def shorten_url(long_url, expiry_time, custom=None, user_id=None):
+    """Create a short link, or return the one that already exists, atomically.
+
+    The whole create-or-return flow is one server-side script, so concurrent
+    requests for the same long URL or custom code cannot both create a link
+    and a reverse mapping never points at a code it was not written with.
+    Generated codes that collide are retried with the next candidate. Returns
+    a dict whose ``status`` is ``created``, ``existing`` (long URL already
+    shortened) or ``taken`` (custom code already in use).
+    """
+    dedup = True
+    for attempt in itertools.count():
+        short_code = custom or allocator.allocate(r, attempt)
+        keys, args = _shorten_call(short_code, long_url, expiry_time, custom, user_id, dedup)
+        result = _shorten_script()(keys=keys, args=args, client=r)
+        if _is_other_page(result, long_url):
+            dedup = False
+        elif result[0] != "collision":
+            return _shorten_result(result)
+
+
+async def shorten_url_async(long_url, expiry_time, custom=None, user_id=None):
+    dedup = True
+    for attempt in itertools.count():
+        short_code = custom or await allocator.allocate_async(ar, attempt)
+        keys, args = _shorten_call(short_code, long_url, expiry_time, custom, user_id, dedup)
+        result = await _shorten_script(asynchronous=True)(keys=keys, args=args, client=ar)
+        if _is_other_page(result, long_url):
+            dedup = False
+        elif result[0] != "collision":
+            return _shorten_result(result)
+
+
+def shorten_many(items, expiry_time, user_id=None):
+    """Bulk ``shorten_url`` for a list of ``(long_url, custom_code)`` pairs.
+
+    Existing links are found with one MGET of their reverse mappings (plus one
+    pipeline to confirm them), codes for the rest are allocated in one call,
+    and the shorten script runs for all of them in a single pipeline, so a
+    chunk costs a handful of round trips however large it is. Repeats of a
+    page (one canonical URL) within ``items`` resolve to the same code. Returns the results
+    in input order.
+    """
+    results = [None] * len(items)
+    first_seen = {}
+    repeats = []
+    todo = []
+
+    for i, (long_url, custom) in enumerate(items):
+        if custom:
+            todo.append(i)
+        elif dedup_key(long_url) in first_seen:
+            repeats.append(i)
+        else:
+            first_seen[dedup_key(long_url)] = i
+
+    generated = list(first_seen.values())
+    skip_lookup = set()
+    if generated:
+        if compact.enabled():
+            pipe = r.pipeline(transaction=False)
+            for i in generated:
+                pipe.hget(*compact.reverse_lookup(items[i][0]))
+            existing_codes = pipe.execute()
+        else:
+            existing_codes = r.mget([reverse_key(items[i][0]) for i in generated])
+        known = [(i, code) for i, code in zip(generated, existing_codes) if code]
+
+        pipe = r.pipeline(transaction=False)
+        for _, code in known:
+            if compact.enabled():
+                pipe.hget(compact.link_key(code), "u")
+                pipe.ttl(compact.link_key(code))
+            else:
+                pipe.get(f"url:{code}")
+                pipe.ttl(f"url:{code}")
+        replies = pipe.execute() if known else []
+
+        confirmed = set()
+        for n, (i, code) in enumerate(known):
+            url, ttl = replies[2 * n:2 * n + 2]
+            if url is None:
+                continue
+            if dedup_key(url) == dedup_key(items[i][0]):
+                results[i] = _shorten_result(["existing", code, url, ttl])
+                confirmed.add(i)
+            else:
+                # A different page whose URL digest collides.
+                skip_lookup.add(i)
+        todo += [i for i in generated if i not in confirmed]
+
+    for attempt in itertools.count():
+        if not todo:
+            break
+
+        needs_code = [i for i in todo if not items[i][1]]
+        codes = iter(allocator.allocate_many(r, len(needs_code), attempt))
+
+        pipe = r.pipeline(transaction=False)
+        for i in todo:
+            long_url, custom = items[i]
+            short_code = custom or next(codes)
+            keys, args = _shorten_call(short_code, long_url, expiry_time, custom, user_id,
+                                       dedup=i not in skip_lookup)
+            _shorten_script()(keys=keys, args=args, client=pipe)
+
+        retry = []
+        for i, result in zip(todo, pipe.execute()):
+            if _is_other_page(result, items[i][0]):
+                skip_lookup.add(i)
+                retry.append(i)
+            elif result[0] == "collision":
+                retry.append(i)
+            else:
+                results[i] = _shorten_result(result)
+        todo = retry
+
+    for i in repeats:
+        results[i] = dict(results[first_seen[dedup_key(items[i][0])]], status="existing")
+
+    return results
+
+
+def refill_code_pool(client, target, batch_size=1000, length=None):
+    """Top the code pool up to ``target`` free random codes.
+
+    Candidates are checked against existing links in pipelined batches.
+    Returns the number of codes added.
+    """
+    length = length or Config.SHORT_CODE_LENGTH
+    added = 0
 
-def generate_short_code(length=6) -> str:
-    characters = string.ascii_letters + string.digits
     while True:
-        short_code = ''.join(secrets.choice(characters) for _ in range(length))
-        if not r.exists(f"url:{short_code}"):
-            return short_code
\ No newline at end of file
+        missing = target - client.scard(PoolCodeAllocator.POOL_KEY)
+        if missing <= 0:
+            return added
+
+        candidates = [random_short_code(length) for _ in range(min(missing, batch_size))]
+        pipe = client.pipeline(transaction=False)
+        for code in candidates:
+            pipe.exists(f"url:{code}", compact.link_key(code))
+        taken = pipe.execute()
+
+        free = [code for code, exists in zip(candidates, taken) if not exists]
+        new = client.sadd(PoolCodeAllocator.POOL_KEY, *free) if free else 0
+        if not new:
+            return added
+        added += new
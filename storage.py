@@ -0,0 +1,506 @@
+"""Storage backends for links, click counters and users.
+
+The app reads and writes this data through ``backend``, chosen with
+``STORAGE_BACKEND``:
+
+* ``redis`` (default): the Redis layouts in shortener.py, clicks.py and
+  compact.py, with everything built on them (link cache, click counting
+  modes, time series, trending);
+* ``sqlite``: one local SQLite file in WAL mode, for single-node
+  deployments and benchmarks. Redis is still used by Celery, the rate
+  limiter and the Redis-only analytics (time series, breakdowns, trending).
+
+Every backend exposes ``links``, ``counters`` and ``users`` with the same
+methods, which tests/test_storage.py checks for all of them.
+"""
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import clicks
+import compact
+import shortener
+import trending
+from canonical import dedup_key, url_digest
+from config import Config
+from redis_client import get_redis
+from shortener import RandomCodeAllocator
+
+r = get_redis()
+
+
+def parse_cursor(cursor):
+    """Split a ``/my-links`` cursor into ``(score, code)``; raises ValueError."""
+    score, _, after_code = cursor.partition(":")
+    return float(score), after_code
+
+
+def make_cursor(score, short_code):
+    return f"{score!r}:{short_code}"
+
+
+class RedisLinkStore:
+    def shorten(self, long_url, expiry_time, custom=None, user_id=None):
+        """Create a link or return the existing one; see ``shortener.shorten_url``."""
+        if custom:
+            clicks.flush_clicks()
+        link = shortener.shorten_url(long_url, expiry_time, custom=custom, user_id=user_id)
+        if link["status"] == "created":
+            clicks.invalidate_link(link["short_code"])
+        return link
+
+    def shorten_many(self, items, expiry_time, user_id=None):
+        links = shortener.shorten_many(items, expiry_time, user_id=user_id)
+        for link in links:
+            if link["status"] == "created":
+                clicks.invalidate_link(link["short_code"])
+        return links
+
+    def resolve_and_count(self, short_code, ip, referrer="", user_agent="", country=""):
+        return clicks.resolve_and_count(short_code, ip, referrer, user_agent, country)
+
+    def get_url(self, short_code):
+        """Return the long URL of a live link without counting a click, or None."""
+        if compact.enabled():
+            return r.hget(compact.link_key(short_code), "u")
+        return r.get(f"url:{short_code}")
+
+    def user_links(self, user_id, limit, descending=True, cursor=None):
+        """Return ``(links, total, next_cursor)`` for one page of a user's links.
+
+        The cursor is the creation score and code of the last entry served,
+        so links created or removed between requests do not shift later
+        pages. Raises ValueError for a malformed cursor.
+        """
+        index_key = f"user:{user_id}:link_index"
+        if cursor:
+            score, after_code = parse_cursor(cursor)
+
+        clicks.flush_clicks()
+
+        pipe = r.pipeline(transaction=False)
+        pipe.zcard(index_key)
+        if not cursor:
+            if descending:
+                pipe.zrevrangebyscore(index_key, "+inf", "-inf", start=0, num=limit + 1, withscores=True)
+            else:
+                pipe.zrangebyscore(index_key, "-inf", "+inf", start=0, num=limit + 1, withscores=True)
+        else:
+            # Entries sharing the cursor's score, then the strictly older/newer ones.
+            pipe.zrangebyscore(index_key, score, score, withscores=True)
+            if descending:
+                pipe.zrevrangebyscore(index_key, f"({score!r}", "-inf", start=0, num=limit + 1, withscores=True)
+            else:
+                pipe.zrangebyscore(index_key, f"({score!r}", "+inf", start=0, num=limit + 1, withscores=True)
+        total, *ranges = pipe.execute()
+
+        entries = ranges[-1]
+        if cursor:
+            ties = sorted(
+                (entry for entry in ranges[0]
+                 if (entry[0] < after_code if descending else entry[0] > after_code)),
+                reverse=descending,
+            )
+            entries = ties + entries
+        has_more = len(entries) > limit
+        entries = entries[:limit]
+        links_codes = [short_code for short_code, _ in entries]
+
+        pipe = r.pipeline(transaction=False)
+        for short_code in links_codes:
+            if compact.enabled():
+                pipe.hmget(compact.link_key(short_code), "o", "t", "u")
+                pipe.ttl(compact.link_key(short_code))
+            else:
+                pipe.get(f"metadata:{short_code}")
+                pipe.ttl(f"url:{short_code}")
+            clicks.queue_click_total(pipe, short_code)
+            pipe.pfcount(f"clicks:{short_code}:visitors")
+        results = pipe.execute()
+
+        links = []
+        expired = []
+
+        for i, short_code in enumerate(links_codes):
+            metadata_raw, ttl, total_clicks, unique_ips = results[i * 4:i * 4 + 4]
+            if compact.enabled():
+                metadata = compact.metadata(*metadata_raw)
+            else:
+                metadata = json.loads(metadata_raw) if metadata_raw else None
+            # A code that expired may since have been reused for another user's link.
+            if not metadata or metadata.get("user_id") != str(user_id):
+                expired.append(short_code)
+                continue
+
+            links.append({
+                "short_code": short_code,
+                "original_url": metadata.get("original_url"),
+                "created_at": metadata.get("created_at"),
+                "total_clicks": int(total_clicks or 0),
+                "unique_ips": unique_ips,
+                "expires_in_seconds": ttl if ttl > 0 else 0
+            })
+
+        if expired:
+            r.zrem(index_key, *expired)
+            total -= len(expired)
+
+        next_cursor = make_cursor(entries[-1][1], entries[-1][0]) if has_more else None
+        return links, total, next_cursor
+
+    def purge_expired(self, limit=10000):
+        """Expired links go away on their own; cleanup.py unlinks their index entries."""
+        return 0
+
+
+class RedisCounterStore:
+    def record(self, short_code, ip):
+        clicks.count_click(short_code, ip)
+
+    def totals(self, short_code):
+        """Return ``(total_clicks, unique_visitors)``."""
+        clicks.flush_clicks()
+        pipe = r.pipeline(transaction=False)
+        clicks.queue_click_total(pipe, short_code)
+        pipe.pfcount(f"clicks:{short_code}:visitors")
+        total_clicks, unique_ips = pipe.execute()
+        return int(total_clicks or 0), unique_ips
+
+
+class RedisUserStore:
+    """Users as a ``user:id:{id}`` profile, with the password hash kept
+    apart in ``user:password:{id}`` so profile reads never load it."""
+
+    def create(self, email, password_hash):
+        """Store a new user; returns its id, or None if the email is taken."""
+        user_id = r.incr("user:id:counter")
+        pipe = r.pipeline()
+        pipe.set(f"user:id:{user_id}", json.dumps({"user_id": user_id, "email": email}))
+        pipe.set(f"user:password:{user_id}", password_hash)
+        pipe.execute()
+        # The email is claimed last, so it never points at a missing record.
+        if not r.set(f"user:email:{email}", user_id, nx=True):
+            r.delete(f"user:id:{user_id}", f"user:password:{user_id}")
+            return None
+        return user_id
+
+    def get(self, user_id):
+        """Return ``{"user_id", "email"}`` or None."""
+        user_data = r.get(f"user:id:{user_id}")
+        if not user_data:
+            return None
+        data = json.loads(user_data)
+        return {"user_id": data["user_id"], "email": data["email"]}
+
+    def get_password_hash(self, user_id):
+        password_hash = r.get(f"user:password:{user_id}")
+        if password_hash is None:
+            # Profiles written before the hash moved out still hold it.
+            user_data = r.get(f"user:id:{user_id}")
+            password_hash = json.loads(user_data).get("password_hash") if user_data else None
+        return password_hash
+
+    def find_by_email(self, email):
+        user_id = r.get(f"user:email:{email}")
+        return int(user_id) if user_id else None
+
+    def set_password_hash(self, user_id, password_hash):
+        r.set(f"user:password:{user_id}", password_hash)
+
+
+class RedisStorage:
+    name = "redis"
+
+    def __init__(self):
+        self.links = RedisLinkStore()
+        self.counters = RedisCounterStore()
+        self.users = RedisUserStore()
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS links (
+    code TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    digest TEXT,
+    owner TEXT,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    clicks INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS links_owner ON links (owner, created_at, code);
+CREATE INDEX IF NOT EXISTS links_expires ON links (expires_at);
+CREATE TABLE IF NOT EXISTS visitors (
+    code TEXT NOT NULL,
+    ip TEXT NOT NULL,
+    PRIMARY KEY (code, ip)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    email TEXT NOT NULL UNIQUE,
+    password_hash TEXT NOT NULL
+);
+"""
+
+
+class SqliteDatabase:
+    """One connection per thread to a SQLite file in WAL mode.
+
+    WAL lets readers run alongside the single writer, and every write runs
+    in a ``BEGIN IMMEDIATE`` transaction so concurrent writers queue on the
+    busy timeout instead of failing halfway.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+        db = self.connection()
+        db.executescript(SCHEMA)
+        self._index_by_digest(db)
+
+    def _index_by_digest(self, db):
+        """Look links up by ``url_digest`` instead of their exact URL.
+
+        Files created before the ``digest`` column get it, filled in from
+        the stored URLs.
+        """
+        columns = [row[1] for row in db.execute("PRAGMA table_info(links)")]
+        if "digest" not in columns:
+            db.create_function("url_digest", 1, url_digest, deterministic=True)
+            with self.transaction():
+                db.execute("ALTER TABLE links ADD COLUMN digest TEXT")
+                db.execute("UPDATE links SET digest = url_digest(url)")
+        db.execute("DROP INDEX IF EXISTS links_url")
+        db.execute("CREATE INDEX IF NOT EXISTS links_digest ON links (digest, expires_at)")
+
+    def connection(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=Config.SQLITE_BUSY_TIMEOUT, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def transaction(self):
+        return _Transaction(self.connection())
+
+
+class _Transaction:
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+class SqliteLinkStore:
+    def __init__(self, database):
+        self.database = database
+        self.allocator = RandomCodeAllocator(Config.SHORT_CODE_LENGTH, Config.SHORT_CODE_GROW_AFTER)
+
+    def _create(self, db, long_url, expiry_time, custom, user_id, now):
+        if custom:
+            row = db.execute(
+                "SELECT url, expires_at, clicks FROM links WHERE code = ? AND expires_at > ?",
+                (custom, now),
+            ).fetchone()
+            if row:
+                unique_ips = db.execute("SELECT COUNT(*) FROM visitors WHERE code = ?", (custom,)).fetchone()[0]
+                return {
+                    "status": "taken",
+                    "short_code": custom,
+                    "original_url": row[0],
+                    "expires_in_seconds": int(row[1] - now),
+                    "total_clicks": row[2],
+                    "unique_ips": unique_ips,
+                }
+            short_code = custom
+        else:
+            rows = db.execute(
+                "SELECT code, url, expires_at FROM links WHERE digest = ? AND expires_at > ? "
+                "ORDER BY created_at DESC",
+                (url_digest(long_url), now),
+            ).fetchall()
+            for existing_code, existing_url, expires_at in rows:
+                if dedup_key(existing_url) == dedup_key(long_url):
+                    return {
+                        "status": "existing",
+                        "short_code": existing_code,
+                        "original_url": existing_url,
+                        "expires_in_seconds": int(expires_at - now),
+                    }
+            for attempt in range(100):
+                short_code = self.allocator.allocate(None, attempt)
+                live = db.execute(
+                    "SELECT 1 FROM links WHERE code = ? AND expires_at > ?", (short_code, now)
+                ).fetchone()
+                if not live:
+                    break
+            else:
+                raise RuntimeError("could not allocate a short code")
+
+        # A code whose link expired starts over.
+        db.execute("DELETE FROM links WHERE code = ?", (short_code,))
+        db.execute("DELETE FROM visitors WHERE code = ?", (short_code,))
+        db.execute(
+            "INSERT INTO links (code, url, digest, owner, created_at, expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (short_code, long_url, url_digest(long_url), str(user_id) if user_id else None,
+             now, now + expiry_time),
+        )
+        return {
+            "status": "created",
+            "short_code": short_code,
+            "original_url": long_url,
+            "expires_in_seconds": int(expiry_time),
+        }
+
+    def shorten(self, long_url, expiry_time, custom=None, user_id=None):
+        with self.database.transaction() as db:
+            return self._create(db, long_url, expiry_time, custom, user_id, time.time())
+
+    def shorten_many(self, items, expiry_time, user_id=None):
+        now = time.time()
+        with self.database.transaction() as db:
+            return [self._create(db, long_url, expiry_time, custom, user_id, now)
+                    for long_url, custom in items]
+
+    def resolve_and_count(self, short_code, ip, referrer="", user_agent="", country=""):
+        with self.database.transaction() as db:
+            row = db.execute(
+                "SELECT url FROM links WHERE code = ? AND expires_at > ?", (short_code, time.time())
+            ).fetchone()
+            if not row:
+                return None
+            db.execute("UPDATE links SET clicks = clicks + 1 WHERE code = ?", (short_code,))
+            db.execute("INSERT OR IGNORE INTO visitors (code, ip) VALUES (?, ?)", (short_code, ip))
+        trending.record(short_code)
+        return row[0]
+
+    def get_url(self, short_code):
+        row = self.database.connection().execute(
+            "SELECT url FROM links WHERE code = ? AND expires_at > ?", (short_code, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def user_links(self, user_id, limit, descending=True, cursor=None):
+        now = time.time()
+        order = "DESC" if descending else "ASC"
+        query = ("SELECT code, url, created_at, expires_at, clicks, "
+                 "(SELECT COUNT(*) FROM visitors WHERE visitors.code = links.code) "
+                 "FROM links WHERE owner = ? AND expires_at > ?")
+        params = [str(user_id), now]
+        if cursor:
+            score, after_code = parse_cursor(cursor)
+            query += f" AND (created_at, code) {'<' if descending else '>'} (?, ?)"
+            params += [score, after_code]
+        query += f" ORDER BY created_at {order}, code {order} LIMIT ?"
+        params.append(limit + 1)
+
+        db = self.database.connection()
+        rows = db.execute(query, params).fetchall()
+        total = db.execute(
+            "SELECT COUNT(*) FROM links WHERE owner = ? AND expires_at > ?", (str(user_id), now)
+        ).fetchone()[0]
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        links = [{
+            "short_code": short_code,
+            "original_url": long_url,
+            "created_at": datetime.fromtimestamp(created_at).isoformat(),
+            "total_clicks": total_clicks,
+            "unique_ips": unique_ips,
+            "expires_in_seconds": int(expires_at - now),
+        } for short_code, long_url, created_at, expires_at, total_clicks, unique_ips in rows]
+        next_cursor = make_cursor(rows[-1][2], rows[-1][0]) if has_more else None
+        return links, total, next_cursor
+
+    def purge_expired(self, limit=10000):
+        """Delete up to ``limit`` expired links and their visitors; returns how many."""
+        with self.database.transaction() as db:
+            codes = [row[0] for row in db.execute(
+                "SELECT code FROM links WHERE expires_at <= ? LIMIT ?", (time.time(), limit)
+            )]
+            db.executemany("DELETE FROM visitors WHERE code = ?", [(code,) for code in codes])
+            db.executemany("DELETE FROM links WHERE code = ?", [(code,) for code in codes])
+        return len(codes)
+
+
+class SqliteCounterStore:
+    def __init__(self, database):
+        self.database = database
+
+    def record(self, short_code, ip):
+        with self.database.transaction() as db:
+            if db.execute("UPDATE links SET clicks = clicks + 1 WHERE code = ?", (short_code,)).rowcount:
+                db.execute("INSERT OR IGNORE INTO visitors (code, ip) VALUES (?, ?)", (short_code, ip))
+
+    def totals(self, short_code):
+        db = self.database.connection()
+        row = db.execute("SELECT clicks FROM links WHERE code = ?", (short_code,)).fetchone()
+        unique_ips = db.execute("SELECT COUNT(*) FROM visitors WHERE code = ?", (short_code,)).fetchone()[0]
+        return (row[0] if row else 0), unique_ips
+
+
+class SqliteUserStore:
+    def __init__(self, database):
+        self.database = database
+
+    def create(self, email, password_hash):
+        try:
+            with self.database.transaction() as db:
+                cursor = db.execute(
+                    "INSERT INTO users (email, password_hash) VALUES (?, ?)", (email, password_hash)
+                )
+                return cursor.lastrowid
+        except sqlite3.IntegrityError:
+            return None
+
+    def get(self, user_id):
+        row = self.database.connection().execute(
+            "SELECT id, email FROM users WHERE id = ?", (user_id,)
+        ).fetchone()
+        if not row:
+            return None
+        return {"user_id": row[0], "email": row[1]}
+
+    def get_password_hash(self, user_id):
+        row = self.database.connection().execute(
+            "SELECT password_hash FROM users WHERE id = ?", (user_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def find_by_email(self, email):
+        row = self.database.connection().execute(
+            "SELECT id FROM users WHERE email = ?", (email,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_password_hash(self, user_id, password_hash):
+        with self.database.transaction() as db:
+            db.execute("UPDATE users SET password_hash = ? WHERE id = ?", (password_hash, user_id))
+
+
+class SqliteStorage:
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.database = SqliteDatabase(path)
+        self.links = SqliteLinkStore(self.database)
+        self.counters = SqliteCounterStore(self.database)
+        self.users = SqliteUserStore(self.database)
+
+
+def make_storage(name, sqlite_path=None):
+    if name == "sqlite":
+        return SqliteStorage(sqlite_path or Config.SQLITE_PATH)
+    return RedisStorage()
+
+
+backend = make_storage(Config.STORAGE_BACKEND)
@@ -25,15 +25,38 @@ def runner(app):
     return app.test_cli_runner()
 
 
+@pytest.fixture
+def auth_headers(client):
+    """Authorization header of a freshly registered user"""
+    response = client.post('/auth/register', json={
+        'email': 'links@example.com',
+        'password': 'password123'
+    })
+    token = response.get_json()['access_token']
+    return {'Authorization': f'Bearer {token}'}
+
+
 @pytest.fixture(autouse=True)
 def mock_redis(monkeypatch):
     fake_redis = fakeredis.FakeRedis(decode_responses=True)
 
     import shortener
+    import clicks
+    import storage
+    import trending
+    import models
     import app as app_module
 
     monkeypatch.setattr(shortener, "r", fake_redis)
+    monkeypatch.setattr(clicks, "r", fake_redis)
+    monkeypatch.setattr(storage, "r", fake_redis)
+    monkeypatch.setattr(trending, "r", fake_redis)
+    # Tests that need the trending tracker install their own.
+    monkeypatch.setattr(trending, "tracker", None)
     monkeypatch.setattr(app_module, "r", fake_redis)
+    # User ids restart with every fake Redis.
+    if models.user_cache is not None:
+        models.user_cache.clear()
 
     try:
         from app import limiter
@@ -42,4 +65,6 @@ def mock_redis(monkeypatch):
         pass
 
     yield fake_redis
+    # Buffered time series clicks belong to this test's Redis.
+    clicks.flush_clicks()
     fake_redis.flushall()
\ No newline at end of file
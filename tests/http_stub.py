@@ -0,0 +1,90 @@
+"""A local HTTP server standing in for the sites previews are fetched from.
+
+    /page/<n>           a small HTML page titled "Page <n>"
+    /large?kb=<n>       a page whose head is followed by <n> KB of body
+    /nohead?kb=<n>      <n> KB of HTML without a head
+    /image              a PNG body
+    /missing            404
+
+Every route accepts ``delay=<seconds>`` to simulate a slow site. The server
+counts the connections it accepted and the body bytes it managed to send.
+"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+HEAD = ('<html><head><title>{title}</title>'
+        '<meta name="description" content="About {title}"></head>')
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes; with Nagle on, a kept-alive
+    # connection waits for the client's delayed ACK between them.
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        time.sleep(float(query.get("delay", 0)))
+        filler = "<p>" + "x" * 1020 + "</p>"
+        kb = int(query.get("kb", 0))
+
+        if url.path.startswith("/page/"):
+            n = url.path.rsplit("/", 1)[1]
+            self.send(200, "text/html; charset=utf-8", HEAD.format(title=f"Page {n}") + "<body></body></html>")
+        elif url.path == "/large":
+            self.send(200, "text/html", HEAD.format(title="Large") + "<body>" + filler * kb + "</body></html>")
+        elif url.path == "/nohead":
+            self.send(200, "text/html", "<html>" + filler * kb + "</html>")
+        elif url.path == "/image":
+            self.send(200, "image/png", "\x89PNG" + "x" * 100000)
+        else:
+            self.send(404, "text/plain", "not found")
+
+    def send(self, status, content_type, body):
+        body = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            for start in range(0, len(body), 65536):
+                self.wfile.write(body[start:start + 65536])
+                with self.server.lock:
+                    self.server.bytes_sent += len(body[start:start + 65536])
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.bytes_sent = 0
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+
+    def handle_error(self, request, client_address):
+        # Clients hang up after reading a page's head.
+        pass
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,165 @@
+import asyncio
+import json
+
+import fakeredis
+import pytest
+
+
+@pytest.fixture
+def async_redis(monkeypatch, mock_redis):
+    import asgi
+    import clicks
+    import shortener
+
+    server = mock_redis.connection_pool.connection_kwargs["server"]
+    fake_async = fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+
+    monkeypatch.setattr(shortener, "ar", fake_async)
+    monkeypatch.setattr(clicks, "ar", fake_async)
+    monkeypatch.setattr(asgi, "ar", fake_async)
+    return fake_async
+
+
+async def call(method, path, body=None, headers=()):
+    from asgi import application
+
+    request = json.dumps(body).encode() if body is not None else b""
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": b"",
+        "headers": [(b"content-type", b"application/json"), *headers],
+        "client": ("10.0.0.1", 1234),
+        "server": ("testserver", 80),
+        "scheme": "http",
+        "root_path": "",
+        "http_version": "1.1",
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": request, "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await application(scope, receive, send)
+
+    start = messages[0]
+    payload = b"".join(m.get("body", b"") for m in messages[1:])
+    response_headers = {k.decode(): v.decode() for k, v in start["headers"]}
+    return start["status"], response_headers, json.loads(payload) if payload.startswith(b"{") else None
+
+
+def test_asgi_shorten_redirect_and_stats(async_redis):
+    """Test the native async routes end to end"""
+    async def scenario():
+        status, _, data = await call("POST", "/shorten", {
+            "url": "example.com",
+            "custom_code": "async1"
+        })
+        assert status == 201
+        assert data["original_url"] == "https://example.com"
+
+        status, headers, _ = await call("GET", "/async1")
+        assert status == 302
+        assert headers["location"] == "https://example.com"
+
+        status, _, data = await call("GET", "/stats/async1")
+        assert status == 200
+        assert data["total_clicks"] == 1
+        assert data["unique_ips"] == 1
+
+        status, _, data = await call("POST", "/shorten", {
+            "url": "https://other.com",
+            "custom_code": "async1"
+        })
+        assert status == 200
+        assert data["already_existed"] is True
+        assert data["total_clicks"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_asgi_errors(async_redis):
+    """Test 404, validation errors and invalid custom codes"""
+    async def scenario():
+        status, _, data = await call("GET", "/missing")
+        assert status == 404
+        assert "not found" in data["message"].lower()
+
+        status, _, _ = await call("POST", "/shorten", {"custom_code": "abcd"})
+        assert status == 422
+
+        status, _, _ = await call("POST", "/shorten", {
+            "url": "https://example.com",
+            "custom_code": "abc"
+        })
+        assert status == 400
+
+    asyncio.run(scenario())
+
+
+def test_asgi_redirect_encodes_iri(async_redis):
+    """Test non-ASCII hosts and paths are sent as an ASCII Location, like the WSGI fast path"""
+    async def scenario():
+        await call("POST", "/shorten", {"url": "https://bücher.example/straße", "custom_code": "idn1"})
+
+        status, headers, _ = await call("GET", "/idn1")
+        assert status == 302
+        assert headers["location"] == "https://xn--bcher-kva.example/stra%C3%9Fe"
+
+    asyncio.run(scenario())
+
+
+def test_asgi_falls_back_to_flask(async_redis):
+    """Test Flask-only routes are served through the WSGI app"""
+    async def scenario():
+        status, _, data = await call("GET", "/cache/stats")
+        assert status == 200
+        assert "enabled" in data
+
+        status, _, _ = await call("GET", "/my-links")
+        assert status == 401
+
+    asyncio.run(scenario())
+
+
+def test_asgi_bad_tokens_match_flask(client, async_redis):
+    """Test invalid and expired tokens get the same answer in both serving modes"""
+    from datetime import timedelta
+    from flask_jwt_extended import create_access_token
+    from app import app
+
+    with app.app_context():
+        expired = create_access_token(identity="1", expires_delta=timedelta(seconds=-10))
+
+    for token in ("garbage", expired):
+        header = f"Bearer {token}"
+        flask_response = client.post('/shorten', json={'url': 'example.com'},
+                                     headers={'Authorization': header})
+        status, _, data = asyncio.run(call("POST", "/shorten", {"url": "example.com"},
+                                           [(b"authorization", header.encode())]))
+        assert (status, data) == (flask_response.status_code, flask_response.get_json())
+        assert status in (401, 422)
+
+
+def test_asgi_rate_limit_uses_app_limiter(async_redis, mock_redis, monkeypatch):
+    """Test ASGI limits go through the app's limiter storage, not a Redis window of their own"""
+    from limits.strategies import SlidingWindowCounterRateLimiter
+    import asgi
+    from app import limiter
+    from ratelimit import HybridStorage
+    storage = HybridStorage(connection_pool=mock_redis.connection_pool)
+    monkeypatch.setattr(limiter, "_limiter", SlidingWindowCounterRateLimiter(storage))
+    monkeypatch.setattr(limiter, "enabled", True)
+    monkeypatch.setattr(asgi, "REDIRECT_LIMIT", "2 per minute")
+
+    async def scenario():
+        await call("POST", "/shorten", {"url": "example.com", "custom_code": "limit1"})
+        statuses = [(await call("GET", "/limit1"))[0] for _ in range(3)]
+        assert statuses == [302, 302, 429]
+
+    asyncio.run(scenario())
+    assert mock_redis.keys("asgi_limit:*") == []
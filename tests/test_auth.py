@@ -0,0 +1,94 @@
+import json
+
+import storage
+from migrations import migrate_user_password_hashes
+from models import User
+
+
+def register(client, email='user@example.com', password='password123'):
+    return client.post('/auth/register', json={'email': email, 'password': password}).get_json()
+
+
+def test_register_login_and_me(client):
+    """Test a registered user can log in and read their profile"""
+    user = register(client)
+
+    login = client.post('/auth/login', json={'email': 'user@example.com', 'password': 'password123'})
+    wrong = client.post('/auth/login', json={'email': 'user@example.com', 'password': 'nope'})
+    me = client.get('/auth/me', headers={'Authorization': f"Bearer {login.get_json()['access_token']}"})
+
+    assert login.status_code == 200
+    assert wrong.status_code == 401
+    assert me.get_json() == {'user_id': user['user_id'], 'email': 'user@example.com'}
+
+
+def test_password_hash_stored_apart(client, mock_redis):
+    """Test the profile holds no password hash and users are loaded without it"""
+    user_id = register(client)['user_id']
+
+    assert 'password_hash' not in json.loads(mock_redis.get(f'user:id:{user_id}'))
+    assert mock_redis.get(f'user:password:{user_id}').startswith('$argon2')
+    assert User.__slots__ == ('user_id', 'email')
+
+
+def test_me_uses_cached_user_and_claims(client, app, monkeypatch):
+    """Test repeated authenticated reads skip the user store and token decoding"""
+    headers = {'Authorization': f"Bearer {register(client)['access_token']}"}
+    client.get('/auth/me', headers=headers)
+
+    calls = []
+    monkeypatch.setattr(storage.backend.users, 'get', lambda user_id: calls.append(user_id))
+    monkeypatch.setattr('jwt.decode', lambda *args, **kwargs: calls.append('decode'))
+
+    assert client.get('/auth/me', headers=headers).status_code == 200
+    assert calls == []
+
+
+def test_legacy_profiles_log_in_and_migrate(client, mock_redis):
+    """Test users whose profile still holds the hash log in before and after migration"""
+    user_id = register(client)['user_id']
+    password_hash = mock_redis.get(f'user:password:{user_id}')
+    mock_redis.delete(f'user:password:{user_id}')
+    mock_redis.set(f'user:id:{user_id}', json.dumps({
+        'user_id': user_id, 'email': 'user@example.com', 'password_hash': password_hash,
+    }))
+    credentials = {'email': 'user@example.com', 'password': 'password123'}
+
+    assert client.post('/auth/login', json=credentials).status_code == 200
+    assert migrate_user_password_hashes(mock_redis) == 1
+    assert migrate_user_password_hashes(mock_redis) == 0
+    assert mock_redis.get(f'user:password:{user_id}') == password_hash
+    assert client.post('/auth/login', json=credentials).status_code == 200
+
+
+def test_login_rehashes_with_new_cost(client, mock_redis, monkeypatch):
+    """Test a login replaces hashes made with other argon2 parameters"""
+    from argon2 import PasswordHasher
+    import passwords
+    user_id = register(client)['user_id']
+    old_hash = mock_redis.get(f'user:password:{user_id}')
+    monkeypatch.setattr(passwords, 'hasher', PasswordHasher(time_cost=1, memory_cost=8192, parallelism=1))
+
+    login = client.post('/auth/login', json={'email': 'user@example.com', 'password': 'password123'})
+
+    new_hash = mock_redis.get(f'user:password:{user_id}')
+    assert login.status_code == 200
+    assert new_hash != old_hash and 'm=8192,t=1,p=1' in new_hash
+
+
+def test_saturated_hash_pool_returns_503(client, monkeypatch):
+    """Test logins are refused with 503 when the hashing pool is full or slow"""
+    import passwords
+    from config import Config
+    register(client)
+    credentials = {'email': 'user@example.com', 'password': 'password123'}
+
+    monkeypatch.setattr(Config, 'PASSWORD_HASH_MAX_PENDING', 0)
+    full = client.post('/auth/login', json=credentials)
+    monkeypatch.setattr(Config, 'PASSWORD_HASH_MAX_PENDING', 16)
+    monkeypatch.setattr(Config, 'PASSWORD_HASH_TIMEOUT', 0.001)
+    slow = client.post('/auth/login', json=credentials)
+
+    assert full.status_code == 503 and slow.status_code == 503
+    assert full.headers['Retry-After'] == '1'
+    assert passwords.stats()['rejected'] >= 1
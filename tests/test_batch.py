@@ -0,0 +1,58 @@
+import json
+
+
+def read_lines(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_batch_shorten_json(client, auth_headers, mock_redis):
+    """Test a JSON batch creates, dedups and reports per-item results"""
+    client.post('/shorten', json={'url': 'https://example.com/old'})
+
+    response = client.post('/shorten/batch', json={'urls': [
+        'example.com/a',
+        {'url': 'https://example.com/b', 'custom_code': 'batch1'},
+        'https://example.com/old',
+        'example.com/a',
+        {'url': 'https://example.com/c', 'custom_code': 'no'},
+    ]}, headers=auth_headers)
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    lines = read_lines(response)
+
+    assert [line['index'] for line in lines] == [0, 1, 2, 3, 4]
+    assert [line['status'] for line in lines] == ['created', 'created', 'existing', 'existing', 'error']
+    assert lines[0]['original_url'] == 'https://example.com/a'
+    assert lines[3]['short_url'] == lines[0]['short_url']
+    assert lines[1]['short_url'].endswith('/batch1')
+
+    data = client.get('/my-links', headers=auth_headers).get_json()
+    assert data['total'] == 2
+
+
+def test_batch_shorten_ndjson_chunks(client, auth_headers, monkeypatch):
+    """Test an NDJSON stream is processed across several chunks"""
+    from config import Config
+    monkeypatch.setattr(Config, "BATCH_CHUNK_SIZE", 3)
+
+    body = "\n".join(json.dumps({'url': f'https://example.com/{i}'}) for i in range(7))
+    body += "\nnot json\n"
+
+    response = client.post('/shorten/batch', data=body, headers={
+        **auth_headers, 'Content-Type': 'application/x-ndjson'
+    })
+    lines = read_lines(response)
+
+    assert len(lines) == 8
+    assert all(line['status'] == 'created' for line in lines[:7])
+    assert len({line['short_url'] for line in lines[:7]}) == 7
+    assert lines[7]['status'] == 'error'
+
+
+def test_batch_shorten_requires_list(client, auth_headers):
+    """Test malformed batch bodies are rejected"""
+    response = client.post('/shorten/batch', json={'url': 'https://example.com'},
+                           headers=auth_headers)
+
+    assert response.status_code == 400
@@ -0,0 +1,84 @@
+import pytest
+
+from canonical import canonicalize
+from config import Config
+from migrations import migrate_reverse_index
+import shortener
+from shortener import reverse_key
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("HTTP://Example.COM", "http://example.com/"),
+    ("https://example.com:443/a", "https://example.com/a"),
+    ("http://example.com:8080/a", "http://example.com:8080/a"),
+    ("https://example.com/a?b=2&a=1&utm_source=x&fbclid=y", "https://example.com/a?a=1&b=2"),
+    ("https://example.com/?q=a%2Fb&q=c#part", "https://example.com/?q=a%2Fb&q=c#part"),
+    ("https://bücher.example/Path", "https://xn--bcher-kva.example/Path"),
+    ("https://user:pw@Example.com/", "https://user:pw@example.com/"),
+])
+def test_canonicalize(url, expected):
+    """Test URLs for the same page share one canonical form"""
+    assert canonicalize(url) == expected
+
+
+def test_canonicalize_rejects_invalid_urls():
+    """Test URLs without a host or with a bad port are rejected"""
+    for url in ("https://", "ftp://example.com", "https://example.com:99999/"):
+        with pytest.raises(ValueError):
+            canonicalize(url)
+
+
+def test_strip_params_are_configurable(monkeypatch):
+    """Test only the configured parameters are stripped"""
+    monkeypatch.setattr(Config, "URL_STRIP_PARAMS", ("ref",))
+
+    assert canonicalize("https://example.com/?utm_source=x&ref=y") == "https://example.com/?utm_source=x"
+
+
+def test_variants_share_one_code(client, mock_redis):
+    """Test shortening variants of one URL returns the first code"""
+    first = client.post('/shorten', json={'url': 'HTTP://Example.com/a?b=1&a=2'})
+    again = client.post('/shorten', json={'url': 'http://example.com:80/a?a=2&b=1&utm_medium=mail'})
+
+    assert again.get_json()['already_existed'] is True
+    assert again.get_json()['short_url'] == first.get_json()['short_url']
+    assert first.get_json()['original_url'] == 'HTTP://Example.com/a?b=1&a=2'
+    assert mock_redis.keys('long_to_short:*') == [reverse_key('http://example.com/a?a=2&b=1')]
+
+
+def test_redirect_keeps_submitted_query(client):
+    """Test dedup matches a variant while the redirect keeps the submitted query"""
+    url = 'https://example.com/p?utm_source=newsletter&utm_campaign=fall&b=2&a=1'
+    first = client.post('/shorten', json={'url': url})
+    again = client.post('/shorten', json={'url': 'https://example.com/p?a=1&b=2'})
+
+    assert first.get_json()['original_url'] == url
+    assert again.get_json()['already_existed'] is True
+    assert again.get_json()['short_url'] == first.get_json()['short_url']
+
+    short_code = first.get_json()['short_url'].rsplit('/', 1)[1]
+    assert client.get(f'/{short_code}').location == url
+
+
+def test_digest_collision_gets_its_own_code(mock_redis, monkeypatch):
+    """Test a different page behind the same digest is not returned as existing"""
+    monkeypatch.setattr(shortener, "url_digest", lambda long_url: "0" * 16)
+
+    first = shortener.shorten_url('https://example.com/one', 60)
+    other = shortener.shorten_url('https://example.com/two', 60)
+
+    assert other['status'] == 'created'
+    assert other['short_code'] != first['short_code']
+    assert other['original_url'] == 'https://example.com/two'
+
+
+def test_migrate_reverse_index(mock_redis):
+    """Test legacy URL-keyed lookups move to digest keys with their TTL"""
+    mock_redis.set('url:old1', 'https://example.com/old', ex=600)
+    mock_redis.set('long_to_short:https://example.com/old', 'old1', ex=600)
+
+    assert migrate_reverse_index(mock_redis) == 1
+
+    assert mock_redis.keys('long_to_short:*') == [reverse_key('https://example.com/old')]
+    assert 0 < mock_redis.ttl(reverse_key('https://example.com/old')) <= 600
+    assert migrate_reverse_index(mock_redis) == 0
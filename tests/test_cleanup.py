@@ -0,0 +1,93 @@
+import time
+
+from cleanup import (SWEEP_CURSOR_KEY, drain_expired_links, handle_expired_key,
+                     record_run, sweep_link_indexes)
+from shortener import EXPIRING_KEY, OWNER_KEY
+
+
+def create_links(client, auth_headers, codes):
+    for code in codes:
+        client.post('/shorten', json={
+            'url': f'https://example.com/{code}',
+            'custom_code': code
+        }, headers=auth_headers)
+
+
+def expire(mock_redis, code):
+    """Simulate Redis expiring a link"""
+    mock_redis.delete(f"url:{code}", f"metadata:{code}")
+    mock_redis.zadd(EXPIRING_KEY, {code: time.time() - 1})
+
+
+def test_shorten_schedules_user_links(client, auth_headers, mock_redis):
+    """Test user links are recorded with their expiry and owner"""
+    create_links(client, auth_headers, ['sched1'])
+    client.post('/shorten', json={'url': 'https://example.com/anonymous'})
+
+    assert mock_redis.zrange(EXPIRING_KEY, 0, -1) == ['sched1']
+    assert mock_redis.zscore(EXPIRING_KEY, 'sched1') > time.time() + 604000
+    assert mock_redis.hget(OWNER_KEY, 'sched1') is not None
+
+
+def test_drain_removes_only_expired_links(client, auth_headers, mock_redis):
+    """Test due links are unlinked and live ones are left alone"""
+    create_links(client, auth_headers, ['gone1', 'gone2', 'live1'])
+    expire(mock_redis, 'gone1')
+    expire(mock_redis, 'gone2')
+
+    stats = drain_expired_links(mock_redis, batch_size=1)
+
+    assert stats == {"scanned": 2, "removed": 2}
+    index_key = next(mock_redis.scan_iter(match="user:*:link_index"))
+    assert mock_redis.zrange(index_key, 0, -1) == ['live1']
+    assert mock_redis.zrange(EXPIRING_KEY, 0, -1) == ['live1']
+    assert mock_redis.hkeys(OWNER_KEY) == ['live1']
+
+
+def test_drain_reschedules_links_that_are_still_alive(client, auth_headers, mock_redis):
+    """Test a due link whose key has not expired is moved to its real expiry"""
+    create_links(client, auth_headers, ['early1'])
+    mock_redis.zadd(EXPIRING_KEY, {'early1': time.time() - 1})
+
+    assert drain_expired_links(mock_redis) == {"scanned": 1, "removed": 0}
+    assert mock_redis.zscore(EXPIRING_KEY, 'early1') > time.time()
+    assert drain_expired_links(mock_redis) == {"scanned": 0, "removed": 0}
+
+
+def test_expiry_event_unlinks_link(client, auth_headers, mock_redis):
+    """Test an expired url key removes the link from its owner's index"""
+    create_links(client, auth_headers, ['event1'])
+    mock_redis.delete('url:event1')
+
+    assert handle_expired_key(mock_redis, 'url:event1') == 1
+    assert handle_expired_key(mock_redis, 'metadata:event1') == 0
+    assert mock_redis.zcard(EXPIRING_KEY) == 0
+
+
+def test_sweep_resumes_from_saved_cursor(mock_redis):
+    """Test the sweep works in slices and removes dead or reused entries"""
+    for user_id in range(20):
+        mock_redis.zadd(f"user:{user_id}:link_index", {f"live{user_id}": 1, f"dead{user_id}": 2})
+        mock_redis.set(f"metadata:live{user_id}", f'{{"user_id": "{user_id}"}}')
+    mock_redis.set("metadata:dead0", '{"user_id": "99"}')
+
+    runs = []
+    while not runs or not runs[-1]["pass_completed"]:
+        runs.append(sweep_link_indexes(mock_redis, batch_size=5, max_indexes=5))
+
+    assert len(runs) > 1
+    assert sum(run["removed"] for run in runs) == 20
+    assert mock_redis.get(SWEEP_CURSOR_KEY) == "0"
+    for user_id in range(20):
+        assert mock_redis.zrange(f"user:{user_id}:link_index", 0, -1) == [f"live{user_id}"]
+
+
+def test_record_run_keeps_totals(mock_redis):
+    """Test run counters accumulate and the last run is kept"""
+    record_run(mock_redis, {"links_removed": 3})
+    record_run(mock_redis, {"links_removed": 2})
+
+    stats = mock_redis.hgetall("cleanup:stats")
+    assert stats["links_removed"] == "5"
+    assert stats["last_links_removed"] == "2"
+    assert stats["runs"] == "2"
@@ -0,0 +1,122 @@
+import pytest
+
+import click_stream
+from clicks import STREAM_KEY
+from config import Config
+
+CHROME_ANDROID = ("Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 "
+                  "(KHTML, like Gecko) Chrome/124.0 Mobile Safari/537.36")
+
+
+@pytest.fixture
+def stream_mode(monkeypatch, mock_redis):
+    monkeypatch.setattr(Config, "CLICK_COUNT_MODE", "stream")
+    click_stream.ensure_group(mock_redis)
+
+
+def click(client, code, referrer=None, country=None):
+    headers = {'User-Agent': CHROME_ANDROID}
+    if referrer:
+        headers['Referer'] = referrer
+    if country:
+        headers[Config.COUNTRY_HEADER] = country
+    return client.get(f'/{code}', headers=headers)
+
+
+def test_redirect_only_appends_event(client, mock_redis, stream_mode):
+    """Test a redirect writes one stream entry and no counters"""
+    client.post('/shorten', json={'url': 'https://example.com', 'custom_code': 'strm1'})
+
+    response = click(client, 'strm1', referrer='https://www.google.com/search', country='de')
+
+    assert response.status_code == 302
+    assert not mock_redis.exists('clicks:strm1')
+    [(_, event)] = mock_redis.xrange(STREAM_KEY)
+    assert event['c'] == 'strm1'
+    assert event['g'] == 'DE'
+    assert click(client, 'missing').status_code == 404
+    assert mock_redis.xlen(STREAM_KEY) == 1
+
+
+def test_consumer_applies_counters_and_breakdowns(client, mock_redis, stream_mode):
+    """Test consumed events update totals and per-dimension breakdowns"""
+    client.post('/shorten', json={'url': 'https://example.com', 'custom_code': 'strm2'})
+    click(client, 'strm2', referrer='https://www.google.com/search', country='DE')
+    click(client, 'strm2')
+
+    assert click_stream.consume(mock_redis, 'test', 100) == 2
+
+    stats = client.get('/stats/strm2').get_json()
+    assert stats['total_clicks'] == 2
+    assert stats['unique_ips'] == 1
+    data = client.get('/stats/strm2/breakdown').get_json()
+    assert data['referrer'] == {'google.com': 1, 'direct': 1}
+    assert data['device'] == {'mobile': 2}
+    assert data['browser'] == {'Chrome': 2}
+    assert data['country'] == {'DE': 1, 'unknown': 1}
+    assert click_stream.stream_lag(mock_redis)['pending'] == 0
+
+
+def test_breakdowns_expire_with_their_link(client, mock_redis, stream_mode):
+    """Test breakdown hashes get their link's TTL and are not recreated after it"""
+    client.post('/shorten', json={'url': 'https://example.com', 'custom_code': 'strm5'})
+    click(client, 'strm5')
+    click_stream.consume(mock_redis, 'test', 100)
+
+    assert 0 < mock_redis.pttl('analytics:strm5') <= mock_redis.pttl('url:strm5')
+
+    click(client, 'strm5')
+    mock_redis.delete('url:strm5', 'analytics:strm5')
+    click_stream.consume(mock_redis, 'test', 100)
+
+    assert not mock_redis.exists('analytics:strm5')
+
+
+def test_stale_entries_are_claimed(client, mock_redis, stream_mode, monkeypatch):
+    """Test entries a dead consumer never acknowledged are processed by another"""
+    client.post('/shorten', json={'url': 'https://example.com', 'custom_code': 'strm3'})
+    click(client, 'strm3')
+    mock_redis.xreadgroup(click_stream.GROUP, 'crashed', {STREAM_KEY: '>'})
+    assert click_stream.stream_lag(mock_redis)['pending'] == 1
+
+    monkeypatch.setattr(Config, "CLICK_STREAM_CLAIM_IDLE_MS", 0)
+    assert click_stream.claim_stale(mock_redis, 'survivor', 100) == 1
+
+    assert mock_redis.get('clicks:strm3') == '1'
+    assert click_stream.stream_lag(mock_redis)['pending'] == 0
+
+
+def test_replay_rebuilds_breakdowns_only(client, mock_redis, stream_mode):
+    """Test a replay recounts breakdowns without double counting totals"""
+    client.post('/shorten', json={'url': 'https://example.com', 'custom_code': 'strm4'})
+    click(client, 'strm4')
+    click_stream.consume(mock_redis, 'test', 100)
+    mock_redis.delete('analytics:strm4')
+
+    assert click_stream.replay(mock_redis) == 1
+
+    assert mock_redis.hget('analytics:strm4', 'device:mobile') == '1'
+    assert mock_redis.get('clicks:strm4') == '1'
+
+
+def test_lag_reports_events_trimmed_before_delivery(mock_redis, stream_mode):
+    """Test clicks lost to the stream length cap show up in the lag metrics"""
+    for _ in range(3):
+        mock_redis.xadd(STREAM_KEY, {'c': 'trim1', 'i': '1.2.3.4'}, maxlen=1, approximate=False)
+
+    lag = click_stream.stream_lag(mock_redis)
+
+    assert lag['length'] == 1
+    assert lag['unread_trimmed'] == 2
+
+
+def test_worker_task_drains_stream(client, mock_redis, stream_mode, monkeypatch):
+    """Test the beat task counts clicks without a standalone consumer"""
+    import worker
+    monkeypatch.setattr(worker, "r", mock_redis)
+    client.post('/shorten', json={'url': 'https://example.com', 'custom_code': 'strm5'})
+    click(client, 'strm5')
+    click(client, 'strm5')
+
+    assert worker.consume_click_stream() == 2
+    assert mock_redis.get('clicks:strm5') == '2'
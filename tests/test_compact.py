@@ -0,0 +1,136 @@
+import time
+
+import pytest
+
+import compact
+from cleanup import drain_expired_links, handle_expired_key
+from config import Config
+from migrations import migrate_to_compact_layout
+from shortener import EXPIRING_KEY
+
+
+@pytest.fixture
+def compact_layout(monkeypatch):
+    monkeypatch.setattr(Config, "LINK_LAYOUT", "compact")
+
+
+def test_link_is_one_hash(client, mock_redis, compact_layout):
+    """Test a link and its reverse lookup use no per-field string keys"""
+    response = client.post('/shorten', json={'url': 'https://example.com/compact'})
+    code = response.get_json()['short_url'].rsplit('/', 1)[1]
+
+    bucket_key, field = compact.reverse_lookup('https://example.com/compact')
+    link_keys = [key for key in mock_redis.keys() if not key.startswith('preview:')]
+    assert sorted(link_keys) == [bucket_key, compact.link_key(code)]
+    assert mock_redis.hgetall(compact.link_key(code)) == {'u': 'https://example.com/compact'}
+    assert 0 < mock_redis.ttl(compact.link_key(code)) <= 86400
+    assert mock_redis.hget(bucket_key, field) == code
+
+    again = client.post('/shorten', json={'url': 'https://example.com/compact'})
+    assert again.get_json()['already_existed'] is True
+    assert again.get_json()['short_url'] == response.get_json()['short_url']
+
+
+@pytest.mark.parametrize("expected, chars", [(1000, 1), (10_000_000, 5), (50_000_000, 5), (1_000_000_000, 6)])
+def test_bucket_count_follows_expected_links(monkeypatch, expected, chars):
+    """Test buckets are sized to stay within the listpack entry limit"""
+    monkeypatch.setattr(Config, "LINK_EXPECTED_COUNT", expected)
+
+    assert compact.bucket_chars() == chars
+    assert expected / 16 ** chars <= compact.LINK_BUCKET_TARGET
+    monkeypatch.setattr(Config, "LINK_DIGEST_BUCKET_CHARS", 3)
+    assert compact.bucket_chars() == 3
+    assert len(compact.reverse_lookup('https://example.com/')[0]) == len('l2s:') + 3
+
+
+def test_redirect_and_stats(client, mock_redis, compact_layout):
+    """Test clicks are counted in the link hash"""
+    client.post('/shorten', json={'url': 'https://example.com', 'custom_code': 'cmp1'})
+    assert client.get('/cmp1').status_code == 302
+    assert client.get('/cmp1').status_code == 302
+    assert client.get('/nope1').status_code == 404
+
+    assert mock_redis.hget('link:cmp1', 'c') == '2'
+    stats = client.get('/stats/cmp1').get_json()
+    assert stats['total_clicks'] == 2
+    assert stats['unique_ips'] == 1
+
+    taken = client.post('/shorten', json={'url': 'https://other.com', 'custom_code': 'cmp1'})
+    assert taken.get_json()['total_clicks'] == 2
+
+
+def test_late_clicks_do_not_resurrect_links(mock_redis, compact_layout):
+    """Test aggregated clicks for an expired link are dropped"""
+    from clicks import write_click_counts
+    write_click_counts({'gone9': 3}, {'gone9': {'1.2.3.4'}}, {})
+
+    assert not mock_redis.exists('link:gone9')
+    assert not mock_redis.exists('clicks:gone9:visitors')
+
+
+def test_reused_custom_code_starts_fresh(client, mock_redis, compact_layout):
+    """Test a custom code created again after expiry reports no old visitors"""
+    client.post('/shorten', json={'url': 'https://example.com', 'custom_code': 'promo'})
+    for ip in ('10.0.0.1', '10.0.0.2'):
+        client.get('/promo', environ_base={'REMOTE_ADDR': ip})
+    assert 0 < mock_redis.ttl('clicks:promo:visitors') <= 86400
+    mock_redis.delete('link:promo')
+
+    client.post('/shorten', json={'url': 'https://other.com', 'custom_code': 'promo'})
+    stats = client.get('/stats/promo').get_json()
+
+    assert stats['total_clicks'] == 0
+    assert stats['unique_ips'] == 0
+
+
+def test_my_links_and_cleanup(client, auth_headers, mock_redis, compact_layout):
+    """Test user links list from the hash and are unlinked when they expire"""
+    for code in ('own1', 'own2'):
+        client.post('/shorten', json={'url': f'https://example.com/{code}', 'custom_code': code},
+                    headers=auth_headers)
+    client.get('/own1')
+
+    data = client.get('/my-links', headers=auth_headers).get_json()
+    assert [link['short_code'] for link in data['links']] == ['own2', 'own1']
+    assert data['links'][1]['total_clicks'] == 1
+    assert data['links'][1]['original_url'] == 'https://example.com/own1'
+
+    mock_redis.delete('link:own1')
+    assert handle_expired_key(mock_redis, 'link:own1') == 1
+    mock_redis.delete('link:own2')
+    mock_redis.zadd(EXPIRING_KEY, {'own2': time.time() - 1})
+    assert drain_expired_links(mock_redis) == {"scanned": 1, "removed": 1}
+    assert client.get('/my-links', headers=auth_headers).get_json()['total'] == 0
+
+
+def test_batch_reuses_existing_links(client, auth_headers, compact_layout):
+    """Test bulk shortening finds links through the digest buckets"""
+    first = client.post('/shorten', json={'url': 'https://example.com/bulk'}, headers=auth_headers)
+
+    response = client.post('/shorten/batch', json=['https://example.com/bulk', 'https://example.com/new'],
+                           headers=auth_headers)
+
+    lines = [line for line in response.get_data(as_text=True).splitlines()]
+    assert '"status": "existing"' in lines[0]
+    assert first.get_json()['short_url'] in lines[0]
+    assert '"status": "created"' in lines[1]
+
+
+def test_migration_moves_links(client, auth_headers, mock_redis, monkeypatch):
+    """Test links created in the default layout keep working after migrating"""
+    client.post('/shorten', json={'url': 'https://example.com/old', 'custom_code': 'old1'},
+                headers=auth_headers)
+    client.get('/old1')
+
+    assert migrate_to_compact_layout(mock_redis) == 1
+    monkeypatch.setattr(Config, "LINK_LAYOUT", "compact")
+
+    assert not list(mock_redis.scan_iter(match='url:*'))
+    assert not list(mock_redis.scan_iter(match='long_to_short:*'))
+    assert mock_redis.ttl('link:old1') > 0
+    assert client.get('/old1').headers['Location'] == 'https://example.com/old'
+    assert client.get('/stats/old1').get_json()['total_clicks'] == 2
+    again = client.post('/shorten', json={'url': 'https://example.com/old'}, headers=auth_headers)
+    assert again.get_json()['short_url'].endswith('/old1')
+    links = client.get('/my-links', headers=auth_headers).get_json()['links']
+    assert [link['short_code'] for link in links] == ['old1']
@@ -0,0 +1,55 @@
+import pytest
+
+import fastpath
+from config import Config
+
+
+@pytest.fixture(params=[True, False], ids=["fast", "flask"])
+def fast_path(request, monkeypatch):
+    monkeypatch.setattr(Config, "REDIRECT_FAST_PATH", request.param)
+    return request.param
+
+
+def test_same_semantics_as_flask(client, mock_redis, fast_path):
+    """Test the fast path and the Flask route answer and count alike"""
+    client.post('/shorten', json={'url': 'https://example.com/ü?q=1', 'custom_code': 'fast1'})
+
+    response = client.get('/fast1', headers={'Referer': 'https://news.example/'})
+    missing = client.get('/missing1')
+
+    assert response.status_code == 302
+    assert response.location == 'https://example.com/%C3%BC?q=1'
+    assert missing.status_code == 404
+    assert missing.get_json()['message'] == 'URL not found'
+    assert mock_redis.get('clicks:fast1') == '1'
+    assert not mock_redis.exists('clicks:missing1')
+
+
+def test_fast_path_skips_flask(client, app, monkeypatch):
+    """Test redirects never enter the Flask app while other routes do"""
+    seen = []
+    monkeypatch.setattr(app, "before_request_funcs", {None: [lambda: seen.append(1)]})
+    client.post('/shorten', json={'url': 'https://example.com', 'custom_code': 'fast2'})
+    seen.clear()
+
+    assert client.get('/fast2').status_code == 302
+    assert seen == []
+    assert client.get('/trending').status_code == 200
+    assert client.get('/fast2/').status_code == 404
+    assert len(seen) == 2
+
+
+def test_fast_path_rate_limit(client, mock_redis, monkeypatch):
+    """Test the fast path applies the redirect rate limit"""
+    from limits.strategies import SlidingWindowCounterRateLimiter
+    from app import limiter
+    from ratelimit import HybridStorage
+    client.post('/shorten', json={'url': 'https://example.com', 'custom_code': 'fast3'})
+    storage = HybridStorage(connection_pool=mock_redis.connection_pool)
+    monkeypatch.setattr(limiter, "_limiter", SlidingWindowCounterRateLimiter(storage))
+    monkeypatch.setattr(limiter, "enabled", True)
+    monkeypatch.setattr(fastpath, "REDIRECT_LIMIT", "2 per minute")
+
+    statuses = [client.get('/fast3').status_code for _ in range(3)]
+
+    assert statuses == [302, 302, 429]
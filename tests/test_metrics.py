@@ -0,0 +1,108 @@
+import threading
+
+import pytest
+
+import metrics
+from redis_client import InstrumentedRedis
+
+
+@pytest.fixture(autouse=True)
+def clear_metrics():
+    metrics.registry.clear()
+
+
+def sample(text, line_start):
+    """Value of the first exposition line starting with ``line_start``."""
+    for line in text.splitlines():
+        if line.startswith(line_start):
+            return float(line.rsplit(" ", 1)[1])
+    return None
+
+
+def test_request_latency_by_route(client):
+    """Test requests are timed per route, fast path included, and split into stages"""
+    client.post('/shorten', json={'url': 'https://example.com', 'custom_code': 'met1'})
+    client.get('/met1')
+    client.get('/nope1')
+
+    text = client.get('/metrics').get_data(as_text=True)
+
+    assert sample(text, 'http_request_duration_seconds_count{route="/<short_code>",method="GET",status="302"}') == 1
+    assert sample(text, 'http_request_duration_seconds_count{route="/<short_code>",method="GET",status="404"}') == 1
+    assert sample(text, 'http_request_duration_seconds_count{route="/shorten",method="POST",status="201"}') == 1
+    assert sample(text, 'http_request_stage_seconds_count{route="/<short_code>",stage="app"}') == 2
+    assert sample(text, 'http_request_duration_seconds_bucket{route="/shorten",method="POST",status="201",le="+Inf"}') == 1
+
+
+def test_redis_client_counts_commands(mock_redis):
+    """Test the instrumented client reports commands and pipelined round trips"""
+    client = InstrumentedRedis(connection_pool=mock_redis.connection_pool)
+    client.set('a', 1)
+    client.get('a')
+    pipe = client.pipeline(transaction=False)
+    pipe.incr('a')
+    pipe.incr('a')
+    pipe.execute()
+
+    text = metrics.render()
+
+    assert sample(text, 'redis_commands_total{command="INCRBY"}') == 2
+    assert sample(text, 'redis_commands_total{command="GET"}') == 1
+    assert sample(text, 'redis_call_duration_seconds_count{command="PIPELINE"}') == 1
+    assert sample(text, 'redis_call_duration_seconds_count{command="INCRBY"}') is None
+
+
+def test_limiter_decisions(client, mock_redis, monkeypatch):
+    """Test rate limit checks are counted by outcome and timed as their own stage"""
+    import fastpath
+    from limits.strategies import SlidingWindowCounterRateLimiter
+    from app import limiter
+    from ratelimit import HybridStorage
+    client.post('/shorten', json={'url': 'https://example.com', 'custom_code': 'met2'})
+    strategy = SlidingWindowCounterRateLimiter(HybridStorage(connection_pool=mock_redis.connection_pool))
+    monkeypatch.setattr(limiter, "_limiter", metrics.TimedRateLimiter(strategy))
+    monkeypatch.setattr(limiter, "enabled", True)
+    monkeypatch.setattr(fastpath, "REDIRECT_LIMIT", "2 per minute")
+
+    for _ in range(3):
+        client.get('/met2')
+    text = client.get('/metrics').get_data(as_text=True)
+
+    assert sample(text, 'ratelimit_decisions_total{decision="allowed"}') == 2
+    assert sample(text, 'ratelimit_decisions_total{decision="limited"}') == 1
+    assert sample(text, 'http_request_stage_seconds_count{route="/<short_code>",stage="limiter"}') == 3
+
+
+def test_celery_tasks_and_queue(client, mock_redis):
+    """Test task durations reported by workers and the queue length are exposed"""
+    metrics.record_task(mock_redis, 'worker.fetch_url_previews', 'SUCCESS', 0.3)
+    metrics.record_task(mock_redis, 'worker.fetch_url_previews', 'SUCCESS', 2.0)
+    mock_redis.rpush('celery', 'task1', 'task2')
+
+    text = client.get('/metrics').get_data(as_text=True)
+    series = '{task="worker.fetch_url_previews",state="SUCCESS"'
+
+    assert sample(text, f'celery_task_duration_seconds_count{series}}}') == 2
+    assert sample(text, f'celery_task_duration_seconds_bucket{series},le="0.5"}}') == 1
+    assert sample(text, f'celery_task_duration_seconds_sum{series}}}') == pytest.approx(2.3)
+    assert sample(text, 'celery_queue_length{queue="celery"}') == 2
+
+
+def test_finished_threads_keep_their_counts():
+    """Test shards of finished threads are folded in rather than lost"""
+    counter = metrics.REDIS_ERRORS
+    threads = [threading.Thread(target=counter.inc, args=("GET",)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+        thread.join()
+    counter.inc("GET")
+
+    assert metrics.registry.collect()[(counter.name, ("GET",))] == 6
+    assert len(metrics.registry._shards) <= 2
+
+
+def test_metrics_can_be_disabled(client, monkeypatch):
+    """Test the endpoint is gone when metrics are switched off"""
+    monkeypatch.setattr(metrics, "enabled", False)
+
+    assert client.get('/metrics').status_code == 404
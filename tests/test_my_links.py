@@ -0,0 +1,96 @@
+def test_my_links_returns_all_links(client, auth_headers):
+    """Test every link is returned with correct totals, newest first"""
+    for i in range(3):
+        client.post('/shorten', json={
+            'url': f'https://example.com/{i}',
+            'custom_code': f'mine{i}'
+        }, headers=auth_headers)
+    client.get('/mine1')
+
+    response = client.get('/my-links', headers=auth_headers)
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['total'] == 3
+    assert data['next_cursor'] is None
+    assert [link['short_code'] for link in data['links']] == ['mine2', 'mine1', 'mine0']
+    assert data['links'][1]['total_clicks'] == 1
+    assert data['links'][1]['unique_ips'] == 1
+
+
+def test_my_links_pagination(client, auth_headers):
+    """Test cursor pagination walks the index in order"""
+    for i in range(5):
+        client.post('/shorten', json={
+            'url': f'https://example.com/{i}',
+            'custom_code': f'page{i}'
+        }, headers=auth_headers)
+
+    seen = []
+    cursor = ''
+    while cursor is not None:
+        data = client.get(f'/my-links?limit=2&order=asc&cursor={cursor}',
+                          headers=auth_headers).get_json()
+        assert data['total'] == 5
+        seen += [link['short_code'] for link in data['links']]
+        cursor = data['next_cursor']
+
+    assert seen == [f'page{i}' for i in range(5)]
+
+
+def test_my_links_pages_are_stable_under_inserts(client, auth_headers):
+    """Test links created between page requests do not repeat entries"""
+    for i in range(4):
+        client.post('/shorten', json={
+            'url': f'https://example.com/{i}',
+            'custom_code': f'stab{i}'
+        }, headers=auth_headers)
+
+    data = client.get('/my-links?limit=2', headers=auth_headers).get_json()
+    seen = [link['short_code'] for link in data['links']]
+    client.post('/shorten', json={
+        'url': 'https://example.com/new',
+        'custom_code': 'stabnew'
+    }, headers=auth_headers)
+    data = client.get(f"/my-links?limit=2&cursor={data['next_cursor']}",
+                      headers=auth_headers).get_json()
+    seen += [link['short_code'] for link in data['links']]
+
+    assert seen == ['stab3', 'stab2', 'stab1', 'stab0']
+    assert data['next_cursor'] is None
+
+
+def test_my_links_skips_codes_reused_by_others(client, auth_headers, mock_redis):
+    """Test an expired code now owned by another user is not listed"""
+    client.post('/shorten', json={
+        'url': 'https://example.com/mine',
+        'custom_code': 'reuse1'
+    }, headers=auth_headers)
+    mock_redis.set('metadata:reuse1', '{"user_id": "someone-else"}')
+
+    data = client.get('/my-links', headers=auth_headers).get_json()
+
+    assert data['links'] == []
+    assert data['total'] == 0
+    assert not list(mock_redis.scan_iter(match='user:*:link_index'))
+
+
+def test_my_links_drops_expired(client, auth_headers, mock_redis):
+    """Test expired links are removed from the index and the total"""
+    for i in range(3):
+        client.post('/shorten', json={
+            'url': f'https://example.com/{i}',
+            'custom_code': f'gone{i}'
+        }, headers=auth_headers)
+    mock_redis.delete('metadata:gone1', 'url:gone1')
+
+    data = client.get('/my-links?limit=2', headers=auth_headers).get_json()
+
+    assert data['total'] == 2
+    assert [link['short_code'] for link in data['links']] == ['gone2']
+    assert data['next_cursor'] is not None
+
+    data = client.get(f"/my-links?limit=2&cursor={data['next_cursor']}",
+                      headers=auth_headers).get_json()
+    assert [link['short_code'] for link in data['links']] == ['gone0']
+    assert data['next_cursor'] is None
@@ -0,0 +1,135 @@
+import time
+
+import pytest
+
+import preview
+from tests.http_stub import StubServer
+
+
+@pytest.fixture
+def stub():
+    with StubServer() as server:
+        yield server
+
+
+@pytest.fixture
+def fetcher():
+    return preview.PreviewFetcher(timeout=5, max_bytes=16384, concurrency=8, pool_hosts=10, per_host=8)
+
+
+def test_title_and_description(stub, fetcher):
+    """Test the preview comes from the page head"""
+    assert fetcher.fetch(f"{stub.url}/page/1") == {"title": "Page 1", "description": "About Page 1"}
+
+
+def test_stops_reading_after_head(stub, fetcher):
+    """Test a large page is read only a little past its head"""
+    result = fetcher.fetch(f"{stub.url}/large?kb=2048")
+
+    assert result["title"] == "Large"
+    assert fetcher.stats()["bytes_read"] <= preview.CHUNK_SIZE * (preview.DRAIN_CHUNKS + 1)
+
+
+def test_caps_pages_without_head(stub, fetcher):
+    """Test a page without a head end is cut at max_bytes"""
+    result = fetcher.fetch(f"{stub.url}/nohead?kb=2048")
+
+    assert result == {"title": "No title", "description": ""}
+    assert fetcher.stats()["bytes_read"] < fetcher.max_bytes + preview.CHUNK_SIZE * (preview.DRAIN_CHUNKS + 1)
+
+
+def test_skips_non_html(stub, fetcher):
+    """Test non-HTML responses are skipped unread and failures raise"""
+    assert fetcher.fetch(f"{stub.url}/image") is None
+    with pytest.raises(Exception):
+        fetcher.fetch(f"{stub.url}/missing")
+
+    stats = fetcher.stats()
+    assert (stats["skipped"], stats["failed"], stats["bytes_read"]) == (1, 1, 0)
+
+
+def test_reuses_connections(stub, fetcher):
+    """Test consecutive fetches from one thread share a connection"""
+    for i in range(5):
+        fetcher.fetch(f"{stub.url}/page/{i}")
+
+    assert stub.connections == 1
+    assert fetcher.stats()["fetched"] == 5
+
+
+def test_fetch_many_is_concurrent(stub, fetcher):
+    """Test a batch of slow pages is fetched in parallel, in order"""
+    urls = [f"{stub.url}/page/{i}?delay=0.2" for i in range(8)] + [f"{stub.url}/missing"]
+
+    start = time.perf_counter()
+    results = fetcher.fetch_many(urls)
+
+    assert time.perf_counter() - start < 1.0
+    assert [result["title"] for result in results[:8]] == [f"Page {i}" for i in range(8)]
+    assert isinstance(results[8], Exception)
+
+
+def test_per_host_cap(stub, fetcher):
+    """Test fetches to one host wait for its cap while other hosts proceed"""
+    fetcher.per_host = 1
+    start = time.perf_counter()
+    fetcher.fetch_many([f"{stub.url}/page/{i}?delay=0.2" for i in range(3)])
+    assert time.perf_counter() - start >= 0.6
+
+    other = stub.url.replace("127.0.0.1", "localhost")
+    start = time.perf_counter()
+    fetcher.fetch_many([f"{stub.url}/page/1?delay=0.2", f"{other}/page/2?delay=0.2"])
+    assert time.perf_counter() - start < 0.4
+
+
+def test_normalize_url():
+    """Test URLs differing only in presentation or tracking share a page"""
+    assert preview.normalize_url("HTTPS://Example.COM:443/a?b=2&utm_source=x&a=1&fbclid=y#top") == \
+        "https://example.com/a?a=1&b=2"
+    assert preview.normalize_url("http://example.com:8080") == "http://example.com:8080/"
+    assert preview.url_digest("https://example.com/a?utm_medium=mail") == \
+        preview.url_digest("https://example.com/a")
+
+
+def test_claim_dedups_pages(mock_redis):
+    """Test one fetch is claimed per page, in a batch and across requests"""
+    urls = ["https://example.com/a?utm_source=x", "https://example.com/a", "https://example.com/b"]
+
+    assert preview.claim(mock_redis, urls) == ["https://example.com/a?utm_source=x", "https://example.com/b"]
+    assert preview.claim(mock_redis, ["https://example.com/a"]) == []
+
+
+def test_worker_caches_previews(stub, fetcher, mock_redis, monkeypatch):
+    """Test the task caches previews and failures and releases its claims"""
+    import worker
+    monkeypatch.setattr(worker, "r", mock_redis)
+    monkeypatch.setattr(preview, "fetcher", fetcher)
+    urls = [f"{stub.url}/page/1", f"{stub.url}/image", "http://127.0.0.1:9/dead"]
+    preview.claim(mock_redis, urls)
+
+    assert worker.fetch_url_previews(urls) == "Saved 1 of 3 previews"
+
+    assert preview.cached(mock_redis, f"{stub.url}/page/1?utm_campaign=z")["title"] == "Page 1"
+    assert preview.cached(mock_redis, f"{stub.url}/image") is None
+    assert not mock_redis.keys("preview:lock:*")
+    # Cached failures and unreachable hosts are not fetched again.
+    assert preview.claim(mock_redis, urls + ["http://127.0.0.1:9/other"]) == []
+
+
+def test_preview_shared_between_codes(client, mock_redis, monkeypatch):
+    """Test codes for the same page read one cached preview"""
+    import app as app_module
+    queued = []
+    monkeypatch.setattr(app_module.fetch_url_previews, "delay", queued.append)
+    client.post('/shorten', json={'url': 'https://example.com/p', 'custom_code': 'prv1'})
+    client.post('/shorten', json={'url': 'https://example.com/p?utm_source=mail', 'custom_code': 'prv2'})
+
+    assert queued == [['https://example.com/p']]
+    assert client.get('/preview/prv2').status_code == 404
+
+    pipe = mock_redis.pipeline()
+    preview.queue_result(pipe, 'https://example.com/p', {'title': 'P', 'description': ''})
+    pipe.execute()
+    assert client.get('/preview/prv1').get_json() == {'title': 'P', 'description': ''}
+    assert client.get('/preview/prv2').get_json() == {'title': 'P', 'description': ''}
+    assert client.get('/preview/nope1').status_code == 404
@@ -0,0 +1,77 @@
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import SlidingWindowCounterRateLimiter
+
+from ratelimit import KEY_PREFIX, HybridStorage
+
+
+def make_limiter(mock_redis, local_share=0.1):
+    storage = HybridStorage(connection_pool=mock_redis.connection_pool, local_share=local_share)
+    return storage, SlidingWindowCounterRateLimiter(storage)
+
+
+def shared_count(mock_redis):
+    return sum(int(mock_redis.get(key)) for key in mock_redis.keys(KEY_PREFIX + "*"))
+
+
+def test_hits_are_counted_locally(mock_redis):
+    """Test hits reach Redis in batches of the local share"""
+    storage, limiter = make_limiter(mock_redis)
+    limit = parse("100 per minute")
+
+    assert all(limiter.hit(limit, "client") for _ in range(9))
+    assert shared_count(mock_redis) == 0
+
+    assert limiter.hit(limit, "client")
+    assert shared_count(mock_redis) == 10
+    assert limiter.get_window_stats(limit, "client").remaining == 90
+
+
+def test_limit_is_shared_between_processes(mock_redis):
+    """Test processes enforce one limit within the error bound"""
+    limit = parse("20 per minute")
+    processes = [make_limiter(mock_redis) for _ in range(2)]
+
+    admitted = 0
+    for i in range(60):
+        storage, limiter = processes[i % 2]
+        admitted += limiter.hit(limit, "client")
+        if i % 10 == 9:
+            for storage, _ in processes:
+                storage.sync()
+
+    assert 20 <= admitted <= 20 + 2 * 2
+
+
+def test_tight_limits_are_exact(mock_redis):
+    """Test limits without a local share are checked against Redis each hit"""
+    limit = parse("5 per minute")
+    processes = [make_limiter(mock_redis) for _ in range(3)]
+
+    admitted = sum(processes[i % 3][1].hit(limit, "login") for i in range(15))
+
+    assert admitted == 5
+    assert shared_count(mock_redis) == 5
+
+
+def test_tight_limit_hit_is_one_round_trip(mock_redis, monkeypatch):
+    """Test a tight limit decides each hit in a single script call"""
+    storage, limiter = make_limiter(mock_redis)
+    calls = []
+    monkeypatch.setattr(storage, "sync", lambda keys=None: calls.append("sync"))
+    script = storage._acquire_script
+    monkeypatch.setattr(storage, "_acquire_script", lambda **kw: calls.append("script") or script(**kw))
+
+    assert limiter.hit(parse("5 per minute"), "login")
+
+    assert calls == ["script"]
+
+
+def test_registered_as_storage_scheme(mock_redis):
+    """Test flask-limiter can build the storage from its URI"""
+    storage = storage_from_string("hybrid+redis://localhost:6379/0",
+                                  connection_pool=mock_redis.connection_pool, local_share=0.2)
+
+    assert isinstance(storage, HybridStorage)
+    assert storage.local_share == 0.2
+    assert storage.check()
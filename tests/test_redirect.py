@@ -1,3 +1,6 @@
+import pytest
+
+
 def test_redirect_success(client):
     """Test successful redirect"""
     response = client.post('/shorten', json={
@@ -31,4 +34,64 @@ def test_redirect_increments_clicks(client, mock_redis):
         client.get('/clicktest')
 
     clicks = mock_redis.get('clicks:clicktest')
-    assert int(clicks) == 3
\ No newline at end of file
+    assert int(clicks) == 3
+
+def test_redirect_not_found_records_nothing(client, mock_redis):
+    """Test unknown codes do not create click counters"""
+    client.get('/missing1')
+
+    assert mock_redis.exists('clicks:missing1') == 0
+    assert mock_redis.exists('clicks:missing1:visitors') == 0
+
+
+@pytest.fixture
+def link_cache(monkeypatch):
+    import clicks
+    from cache import LinkCache
+
+    cache = LinkCache(maxsize=2, ttl=60, negative_ttl=5)
+    monkeypatch.setattr(clicks, "link_cache", cache)
+    return cache
+
+
+def test_redirect_served_from_cache(client, mock_redis, link_cache):
+    """Test cached codes redirect without reading url: again"""
+    client.post('/shorten', json={
+        'url': 'https://example.com',
+        'custom_code': 'cached1'
+    })
+    client.get('/cached1')
+    mock_redis.set('url:cached1', 'https://changed.example.com', keepttl=True)
+
+    response = client.get('/cached1')
+
+    assert response.headers['Location'] == 'https://example.com'
+    assert int(mock_redis.get('clicks:cached1')) == 2
+    assert link_cache.hits == 1
+
+
+def test_redirect_negative_cache_invalidated_by_shorten(client, link_cache):
+    """Test 404s are cached until shorten creates the code"""
+    assert client.get('/cached2').status_code == 404
+    assert client.get('/cached2').status_code == 404
+    assert link_cache.negative_hits == 1
+
+    client.post('/shorten', json={
+        'url': 'https://example.com',
+        'custom_code': 'cached2'
+    })
+
+    assert client.get('/cached2').status_code == 302
+
+
+def test_cache_stats_reports_evictions(client, link_cache):
+    """Test cache counters are exposed"""
+    for code in ('evict1', 'evict2', 'evict3'):
+        client.get(f'/{code}')
+
+    data = client.get('/cache/stats').get_json()
+
+    assert data['enabled'] is True
+    assert data['size'] == 2
+    assert data['misses'] == 3
+    assert data['evictions'] == 1
@@ -0,0 +1,27 @@
+import redis_client
+from config import Config
+
+
+def test_clients_share_one_pool():
+    """Test every module-level client uses the process-wide pool"""
+    import app
+    import storage
+    import worker
+
+    pool = redis_client.get_pool()
+
+    assert redis_client.get_redis().connection_pool is pool
+    assert storage.get_redis().connection_pool is pool
+    assert worker.r.connection_pool is pool
+    assert app.limiter.storage.storage.connection_pool is pool
+
+
+def test_pool_uses_config():
+    """Test pool limits and timeouts come from Config"""
+    pool = redis_client.get_pool()
+
+    assert pool.max_connections == Config.REDIS_MAX_CONNECTIONS
+    assert pool.timeout == Config.REDIS_POOL_TIMEOUT
+    assert pool.connection_kwargs["socket_timeout"] == Config.REDIS_SOCKET_TIMEOUT
+    assert pool.connection_kwargs["health_check_interval"] == Config.REDIS_HEALTH_CHECK_INTERVAL
+    assert pool.connection_kwargs["retry"]._retries == Config.REDIS_RETRY_ATTEMPTS
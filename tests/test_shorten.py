@@ -86,4 +86,19 @@ def test_shorten_same_url_twice(client):
     assert data['already_existed'] is True
     short_code2 = data['short_url'].split('/')[-1]
 
-    assert short_code1 == short_code2
\ No newline at end of file
+    assert short_code1 == short_code2
+
+def test_reused_custom_code_starts_fresh(client, mock_redis):
+    """Test a custom code created again after expiry reports no old clicks"""
+    client.post('/shorten', json={'url': 'https://example.com', 'custom_code': 'promo'})
+    for ip in ('10.0.0.1', '10.0.0.2', '10.0.0.3'):
+        client.get('/promo', environ_base={'REMOTE_ADDR': ip})
+    assert 0 < mock_redis.ttl('clicks:promo:visitors') <= 86400
+    assert 0 < mock_redis.ttl('clicks:promo') <= 86400
+    mock_redis.delete('url:promo')
+
+    client.post('/shorten', json={'url': 'https://other.com', 'custom_code': 'promo'})
+    stats = client.get('/stats/promo').get_json()
+
+    assert stats['total_clicks'] == 0
+    assert stats['unique_ips'] == 0
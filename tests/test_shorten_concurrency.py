@@ -0,0 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import shortener
+from shortener import RandomCodeAllocator, reverse_key, shorten_url
+
+
+def assert_no_orphans(mock_redis):
+    for key in mock_redis.scan_iter(match="long_to_short:*"):
+        short_code = mock_redis.get(key)
+        assert reverse_key(mock_redis.get(f"url:{short_code}")) == key
+
+
+def test_parallel_same_url_creates_one_code(mock_redis):
+    """Test concurrent shortens of one URL all get the same code"""
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        links = list(pool.map(lambda _: shorten_url("https://example.com/same", 60), range(64)))
+
+    assert len({link["short_code"] for link in links}) == 1
+    assert sum(link["status"] == "created" for link in links) == 1
+    assert len(mock_redis.keys("url:*")) == 1
+    assert_no_orphans(mock_redis)
+
+
+def test_parallel_same_custom_code_has_one_winner(mock_redis):
+    """Test concurrent claims of one custom code let exactly one URL win"""
+    def claim(i):
+        return shorten_url(f"https://example.com/{i}", 60, custom="race1")
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        links = list(pool.map(claim, range(64)))
+
+    winners = [link for link in links if link["status"] == "created"]
+    assert len(winners) == 1
+    assert all(link["original_url"] == winners[0]["original_url"] for link in links)
+    assert len(mock_redis.keys("long_to_short:*")) == 1
+    assert_no_orphans(mock_redis)
+
+
+def test_parallel_generated_codes_are_unique(mock_redis, monkeypatch):
+    """Test colliding generated codes are retried, never shared"""
+    monkeypatch.setattr(shortener, "allocator", RandomCodeAllocator(length=1, grow_after=2))
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        links = list(pool.map(lambda i: shorten_url(f"https://example.com/{i}", 60), range(200)))
+
+    assert all(link["status"] == "created" for link in links)
+    assert len({link["short_code"] for link in links}) == 200
+    assert len(mock_redis.keys("url:*")) == 200
+    assert_no_orphans(mock_redis)
@@ -0,0 +1,60 @@
+import shortener
+from shortener import CounterCodeAllocator, PoolCodeAllocator, RandomCodeAllocator, refill_code_pool
+
+
+def test_counter_allocator_is_bijective():
+    """Test counter codes never repeat and grow once a length is exhausted"""
+    allocator = CounterCodeAllocator(length=2, secret="test")
+
+    codes = [allocator.encode(n) for n in range(62 ** 2)]
+
+    assert len(set(codes)) == 62 ** 2
+    assert all(len(code) == 2 for code in codes)
+    assert codes[:3] != ['00', '01', '02']
+    assert len(allocator.encode(62 ** 2)) == 3
+
+
+def test_counter_allocator_uses_redis_counter(mock_redis):
+    """Test each allocation costs one INCR"""
+    allocator = CounterCodeAllocator(length=6, secret="test")
+
+    first = allocator.allocate(mock_redis)
+    second = allocator.allocate(mock_redis)
+
+    assert first != second
+    assert first == allocator.encode(0)
+    assert int(mock_redis.get(CounterCodeAllocator.COUNTER_KEY)) == 2
+
+
+def test_shorten_grows_length_on_collisions(mock_redis, monkeypatch):
+    """Test collisions are retried with longer codes"""
+    monkeypatch.setattr(shortener, "allocator", RandomCodeAllocator(length=1, grow_after=1))
+    for code in shortener.CHARACTERS:
+        mock_redis.set(f"url:{code}", "https://taken.com")
+
+    link = shortener.shorten_url("https://example.com", 60)
+    short_code = link["short_code"]
+
+    assert link["status"] == "created"
+    assert len(short_code) >= 2
+    assert mock_redis.get(f"url:{short_code}") == "https://example.com"
+    assert 0 < mock_redis.ttl(f"url:{short_code}") <= 60
+
+
+def test_pool_allocator_pops_reserved_codes(mock_redis):
+    """Test the pool is refilled with free codes and popped one at a time"""
+    mock_redis.set("url:taken", "https://taken.com")
+
+    added = refill_code_pool(mock_redis, target=50, length=4)
+
+    assert added == 50
+    assert mock_redis.scard(PoolCodeAllocator.POOL_KEY) == 50
+
+    allocator = PoolCodeAllocator(RandomCodeAllocator(length=8))
+    code = allocator.allocate(mock_redis)
+
+    assert len(code) == 4
+    assert mock_redis.scard(PoolCodeAllocator.POOL_KEY) == 49
+
+    mock_redis.delete(PoolCodeAllocator.POOL_KEY)
+    assert len(allocator.allocate(mock_redis)) == 8
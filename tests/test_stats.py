@@ -29,4 +29,69 @@ def test_stats_after_clicks(client):
     data = response.get_json()
 
     assert data['total_clicks'] == 2
-    assert data['unique_ips'] == 1
\ No newline at end of file
+    assert data['unique_ips'] == 1
+
+def test_stats_counts_migrated_ip_keys(client, runner, mock_redis):
+    """Test legacy per-IP click keys are folded into the unique counter"""
+    client.post('/shorten', json={
+        'url': 'https://example.com',
+        'custom_code': 'stats3'
+    })
+
+    mock_redis.set('clicks:stats3', 3)
+    mock_redis.set('clicks:stats3:ip:10.0.0.1', 2)
+    mock_redis.set('clicks:stats3:ip:2001:db8::1', 1)
+
+    result = runner.invoke(args=['migrate-unique-visitors'])
+    assert 'Migrated 2' in result.output
+    assert mock_redis.keys('clicks:stats3:ip:*') == []
+
+    data = client.get('/stats/stats3').get_json()
+    assert data['total_clicks'] == 3
+    assert data['unique_ips'] == 2
+
+
+def test_stats_with_buffered_clicks(client, mock_redis, monkeypatch):
+    """Test buffered clicks are batched and visible to stats"""
+    import clicks
+    from clicks import ClickBuffer
+    from config import Config
+
+    buffer = ClickBuffer(flush_interval=3600, flush_threshold=1000, max_pending=1000)
+    monkeypatch.setattr(Config, "CLICK_COUNT_MODE", "buffered")
+    monkeypatch.setattr(clicks, "click_buffer", buffer)
+
+    client.post('/shorten', json={
+        'url': 'https://example.com',
+        'custom_code': 'stats4'
+    })
+    for _ in range(5):
+        client.get('/stats4')
+
+    assert mock_redis.get('clicks:stats4') is None
+    assert buffer.pending == 5
+
+    data = client.get('/stats/stats4').get_json()
+    assert data['total_clicks'] == 5
+    assert data['unique_ips'] == 1
+    assert buffer.pending == 0
+    assert buffer.flushes == 1
+
+
+def test_async_clicks_over_the_limit_are_dropped(client, mock_redis, monkeypatch):
+    """Test async mode drops clicks instead of queueing them without bound"""
+    import clicks
+    from config import Config
+
+    monkeypatch.setattr(Config, "CLICK_COUNT_MODE", "async")
+    monkeypatch.setattr(Config, "CLICK_ASYNC_MAX_PENDING", 0)
+    monkeypatch.setattr(clicks, "async_dropped", 0)
+
+    client.post('/shorten', json={
+        'url': 'https://example.com',
+        'custom_code': 'stats5'
+    })
+    assert client.get('/stats5').status_code == 302
+
+    assert clicks.async_dropped == 1
+    assert mock_redis.get('clicks:stats5') is None
@@ -0,0 +1,156 @@
+import sqlite3
+
+import pytest
+
+import storage
+
+
+@pytest.fixture(params=["redis", "sqlite"])
+def backend(request, tmp_path, mock_redis):
+    return storage.make_storage(request.param, tmp_path / "links.db")
+
+
+@pytest.fixture
+def sqlite_backend(monkeypatch, tmp_path):
+    backend = storage.make_storage("sqlite", tmp_path / "app.db")
+    monkeypatch.setattr(storage, "backend", backend)
+    return backend
+
+
+def test_shorten_and_resolve(backend):
+    """Test a link is created once, found again and redirects"""
+    created = backend.links.shorten("https://example.com/a", 3600)
+    again = backend.links.shorten("https://example.com/a", 3600)
+
+    assert created["status"] == "created"
+    assert again["status"] == "existing"
+    assert again["short_code"] == created["short_code"]
+    assert backend.links.resolve_and_count(created["short_code"], "1.2.3.4") == "https://example.com/a"
+    assert backend.links.resolve_and_count("missing1", "1.2.3.4") is None
+    assert backend.links.get_url(created["short_code"]) == "https://example.com/a"
+    assert backend.links.get_url("missing1") is None
+
+
+def test_variants_share_one_link(backend):
+    """Test a variant of a page finds its link, which keeps the submitted URL"""
+    created = backend.links.shorten("https://example.com/a?utm_source=x&b=2&a=1", 3600)
+    again = backend.links.shorten("HTTPS://EXAMPLE.com/a?a=1&b=2", 3600)
+
+    assert again["status"] == "existing"
+    assert again["short_code"] == created["short_code"]
+    assert backend.links.get_url(created["short_code"]) == "https://example.com/a?utm_source=x&b=2&a=1"
+
+
+def test_sqlite_adds_digest_column(tmp_path):
+    """Test a database file without the digest column is indexed on open"""
+    path = tmp_path / "old.db"
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE links (code TEXT PRIMARY KEY, url TEXT NOT NULL, owner TEXT, "
+               "created_at REAL NOT NULL, expires_at REAL NOT NULL, clicks INTEGER NOT NULL DEFAULT 0)")
+    db.execute("INSERT INTO links (code, url, created_at, expires_at) VALUES "
+               "('old1', 'https://example.com/old?b=1&a=2', 0, 9999999999)")
+    db.commit()
+    db.close()
+
+    backend = storage.make_storage("sqlite", path)
+
+    assert backend.links.shorten("https://example.com/old?a=2&b=1", 3600)["short_code"] == "old1"
+
+
+def test_custom_code_taken(backend):
+    """Test a live custom code is reported as taken with its counters"""
+    backend.links.shorten("https://example.com/a", 3600, custom="cust1")
+    backend.links.resolve_and_count("cust1", "1.2.3.4")
+
+    taken = backend.links.shorten("https://example.com/b", 3600, custom="cust1")
+
+    assert taken["status"] == "taken"
+    assert taken["original_url"] == "https://example.com/a"
+    assert int(taken["total_clicks"]) == 1
+
+
+def test_counters(backend):
+    """Test totals count every click and each visitor once"""
+    backend.links.shorten("https://example.com", 3600, custom="cnt1")
+    backend.links.resolve_and_count("cnt1", "1.1.1.1")
+    backend.links.resolve_and_count("cnt1", "1.1.1.1")
+    backend.counters.record("cnt1", "2.2.2.2")
+
+    assert backend.counters.totals("cnt1") == (3, 2)
+
+
+def test_shorten_many(backend):
+    """Test a batch creates, deduplicates and reports taken codes"""
+    links = backend.links.shorten_many(
+        [("https://example.com/1", None), ("https://example.com/1", None),
+         ("https://example.com/2", "many1"), ("https://example.com/3", "many1")],
+        3600,
+    )
+
+    assert [link["status"] for link in links] == ["created", "existing", "created", "taken"]
+
+
+def test_user_links_pages(backend):
+    """Test a user's links page by cursor and exclude other users"""
+    for i in range(5):
+        backend.links.shorten(f"https://example.com/{i}", 3600, custom=f"page{i}", user_id=7)
+    backend.links.shorten("https://example.com/other", 3600, custom="other1", user_id=8)
+
+    first, total, cursor = backend.links.user_links(7, 3)
+    second, _, end = backend.links.user_links(7, 3, cursor=cursor)
+
+    assert total == 5
+    assert len(first) == 3 and len(second) == 2
+    assert end is None
+    codes = {link["short_code"] for link in first + second}
+    assert codes == {f"page{i}" for i in range(5)}
+    with pytest.raises(ValueError):
+        backend.links.user_links(7, 3, cursor="bogus")
+
+
+def test_users(backend):
+    """Test users are created once per email and their hash is read apart"""
+    user_id = backend.users.create("a@example.com", "hash1")
+
+    assert backend.users.create("a@example.com", "hash2") is None
+    assert backend.users.find_by_email("a@example.com") == user_id
+    assert backend.users.find_by_email("b@example.com") is None
+    assert backend.users.get(user_id) == {"user_id": user_id, "email": "a@example.com"}
+    assert backend.users.get_password_hash(user_id) == "hash1"
+    backend.users.set_password_hash(user_id, "hash3")
+    assert backend.users.get_password_hash(user_id) == "hash3"
+    assert backend.users.get(user_id + 1) is None
+    assert backend.users.get_password_hash(user_id + 1) is None
+
+
+def test_sqlite_purges_expired_links(sqlite_backend):
+    """Test expired SQLite links stop resolving and are purged"""
+    sqlite_backend.links.shorten("https://example.com", -1, custom="old1")
+
+    assert sqlite_backend.links.resolve_and_count("old1", "1.2.3.4") is None
+    assert sqlite_backend.links.purge_expired() == 1
+    assert sqlite_backend.links.shorten("https://example.com", 3600, custom="old1")["status"] == "created"
+
+
+def test_sqlite_never_reuses_a_live_code(sqlite_backend, monkeypatch):
+    """Test running out of allocation attempts fails instead of overwriting a link"""
+    sqlite_backend.links.shorten("https://example.com/a", 3600, custom="live1")
+    monkeypatch.setattr(sqlite_backend.links.allocator, "allocate", lambda client, attempt: "live1")
+
+    with pytest.raises(RuntimeError):
+        sqlite_backend.links.shorten("https://example.com/b", 3600)
+
+    assert sqlite_backend.links.get_url("live1") == "https://example.com/a"
+
+
+def test_app_on_sqlite(sqlite_backend, client, auth_headers, mock_redis):
+    """Test the API serves links, redirects and stats from SQLite"""
+    response = client.post('/shorten', json={'url': 'https://example.com', 'custom_code': 'sql1'},
+                           headers=auth_headers)
+    assert response.status_code == 201
+
+    assert client.get('/sql1').status_code == 302
+    assert client.get('/stats/sql1').get_json()['total_clicks'] == 1
+    links = client.get('/my-links', headers=auth_headers).get_json()
+    assert [link['short_code'] for link in links['links']] == ['sql1']
+    assert not mock_redis.keys('url:*')
@@ -0,0 +1,94 @@
+import time
+
+import clicks
+import timeseries
+
+# 2024-01-01T10:00:00Z
+HOUR = 1704103200
+
+
+def minute_clicks(mock_redis, counts):
+    pipe = mock_redis.pipeline()
+    timeseries.add_minute_counts(pipe, counts)
+    pipe.execute()
+
+
+def test_redirect_records_minute_bucket(client, mock_redis, monkeypatch):
+    """Test a redirect counts the click in the current minute"""
+    monkeypatch.setattr(clicks, "minute_buffer", clicks.ClickBuffer(3600, 1000, 1000))
+    client.post('/shorten', json={'url': 'https://example.com', 'custom_code': 'tick1'})
+    client.get('/tick1')
+    client.get('/tick1')
+    # The redirect itself writes no time series; the buffer flush does.
+    assert list(mock_redis.scan_iter(match='ts:*')) == []
+
+    response = client.get('/stats/tick1/timeseries?granularity=minute')
+
+    assert response.status_code == 200
+    points = response.get_json()['points']
+    assert len(points) == 60
+    assert sum(point['clicks'] for point in points) == 2
+    key = next(mock_redis.scan_iter(match='ts:tick1:minute:*'))
+    assert 0 < mock_redis.ttl(key) <= timeseries.RETENTION['minute']
+    hour = int(key.rsplit(':', 1)[1])
+    assert mock_redis.smembers(timeseries.active_key(hour)) == {'tick1'}
+    assert 0 < mock_redis.ttl(timeseries.active_key(hour)) <= timeseries.RETENTION['minute']
+
+
+def test_rollup_builds_hour_and_day_buckets(mock_redis):
+    """Test finished hours are rolled up and later queries read the rollups"""
+    minute_clicks(mock_redis, {
+        ('roll1', HOUR + 60): 2,
+        ('roll1', HOUR + 3599): 1,
+        ('roll1', HOUR + 3600): 4,
+        ('roll2', HOUR): 5,
+    })
+    mock_redis.set(timeseries.ROLLED_UP_KEY, HOUR)
+
+    stats = timeseries.rollup(mock_redis, now=HOUR + 7200 + 600)
+
+    assert stats == {"hours": 2, "links": 3}
+    assert mock_redis.smembers(timeseries.active_key(HOUR)) == {'roll1', 'roll2'}
+    assert mock_redis.get(timeseries.ROLLED_UP_KEY) == str(HOUR + 7200)
+
+    mock_redis.delete(timeseries.bucket('roll1', 'minute', HOUR)[0])
+    now = HOUR + 7200 + 600
+    hours = timeseries.query(mock_redis, 'roll1', 'hour', HOUR, HOUR + 3600, now=now)
+    days = timeseries.query(mock_redis, 'roll1', 'day', HOUR, HOUR, now=now)
+    assert hours == [(HOUR, 3), (HOUR + 3600, 4)]
+    assert days == [(HOUR - 36000, 7)]
+
+
+def test_rollup_stops_after_max_hours(mock_redis):
+    """Test a backlog of hours is rolled up over several runs"""
+    minute_clicks(mock_redis, {('slow1', HOUR): 1, ('slow1', HOUR + 3600): 1})
+    mock_redis.set(timeseries.ROLLED_UP_KEY, HOUR)
+
+    assert timeseries.rollup(mock_redis, now=HOUR + 7200 + 600, max_hours=1) == {"hours": 1, "links": 1}
+    assert mock_redis.get(timeseries.ROLLED_UP_KEY) == str(HOUR + 3600)
+    assert timeseries.rollup(mock_redis, now=HOUR + 7200 + 600) == {"hours": 1, "links": 1}
+    assert timeseries.rollup(mock_redis, now=HOUR + 7200 + 600) == {"hours": 0, "links": 0}
+
+
+def test_query_includes_hours_not_rolled_up(mock_redis):
+    """Test hour and day queries sum minute buckets past the rollup point"""
+    minute_clicks(mock_redis, {('live1', HOUR): 2, ('live1', HOUR + 3600): 3})
+    mock_redis.set(timeseries.ROLLED_UP_KEY, HOUR)
+    timeseries.rollup(mock_redis, now=HOUR + 3600 + 600)
+    minute_clicks(mock_redis, {('live1', HOUR + 3660): 1})
+
+    now = HOUR + 3600 + 900
+    assert timeseries.query(mock_redis, 'live1', 'hour', HOUR, now, now=now) == [
+        (HOUR, 2), (HOUR + 3600, 4)
+    ]
+    assert timeseries.query(mock_redis, 'live1', 'day', now, now, now=now) == [(HOUR - 36000, 6)]
+
+
+def test_timeseries_rejects_oversized_range(client):
+    """Test queries are capped in the number of buckets"""
+    end = int(time.time())
+    response = client.get(f'/stats/abc/timeseries?granularity=minute&start={end - 86400 * 2}&end={end}')
+    assert response.status_code == 400
+
+    response = client.get(f'/stats/abc/timeseries?start={end}&end={end - 60}')
+    assert response.status_code == 400
@@ -0,0 +1,70 @@
+import pytest
+
+import trending
+
+# 2024-01-01T10:00:00Z
+NOW = 1704103200
+
+
+@pytest.fixture
+def tracker(monkeypatch):
+    tracker = trending.TrendingTracker(flush_interval=3600, sketch_size=10, keep=3)
+    monkeypatch.setattr(trending, "tracker", tracker)
+    return tracker
+
+
+def test_heavy_hitters_keep_frequent_codes():
+    """Test the summary stays bounded and keeps the codes with most clicks"""
+    sketch = trending.HeavyHitters(3)
+    for i in range(1000):
+        sketch.add('hot' if i % 2 else f'cold{i}')
+
+    assert len(sketch) <= 3
+    assert max(sketch.counts, key=sketch.counts.get) == 'hot'
+    assert sketch.counts['hot'] >= 500 - 1000 // 4
+
+
+def test_redirects_feed_trending_endpoint(client, mock_redis, tracker):
+    """Test clicked links are listed most clicked first"""
+    for code, n in (('trnd1', 3), ('trnd2', 1), ('trnd3', 2)):
+        client.post('/shorten', json={'url': f'https://example.com/{code}', 'custom_code': code})
+        for _ in range(n):
+            client.get(f'/{code}')
+    client.get('/missing')
+
+    response = client.get('/trending?window=5m&limit=2')
+
+    assert response.status_code == 200
+    links = response.get_json()['links']
+    assert [(link['short_code'], link['clicks']) for link in links] == [('trnd1', 3), ('trnd3', 2)]
+
+
+def test_windows_read_their_buckets(mock_redis, tracker):
+    """Test older buckets drop out of the short window but not the long ones"""
+    tracker.add('old1')
+    tracker.add('old1')
+    tracker.flush(now=NOW - 600)
+    tracker.add('new1')
+    tracker.flush(now=NOW)
+
+    assert trending.top(mock_redis, '5m', 10, now=NOW) == [('new1', 1)]
+    assert trending.top(mock_redis, '1h', 10, now=NOW) == [('old1', 2), ('new1', 1)]
+    assert trending.top(mock_redis, '1d', 10, now=NOW) == [('old1', 2), ('new1', 1)]
+    assert trending.top(mock_redis, '1h', 10, now=NOW + 3600) == []
+
+
+def test_buckets_are_trimmed_and_expire(mock_redis, tracker):
+    """Test each bucket keeps only its best codes and has a TTL"""
+    for i in range(6):
+        for _ in range(i + 1):
+            tracker.add(f'code{i}')
+    tracker.flush(now=NOW)
+
+    key = trending.bucket_key('minute', NOW)
+    assert mock_redis.zrevrange(key, 0, -1) == ['code5', 'code4', 'code3']
+    assert 0 < mock_redis.ttl(key) <= trending.RETENTION['minute']
+
+
+def test_trending_rejects_unknown_window(client):
+    """Test only the supported windows are accepted"""
+    assert client.get('/trending?window=2h').status_code == 422
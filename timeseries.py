@@ -0,0 +1,191 @@
+"""Per-link click counts over time.
+
+Clicks are counted into minute buckets in batches, off the redirect path
+(see ``ClickBuffer`` in clicks.py and click_stream.py), and the
+``rollup_timeseries`` worker task folds every finished hour into hour and
+day buckets. Each granularity keeps one small hash per link and span:
+
+    ts:{code}:minute:{hour_start}   minute of the hour -> clicks
+    ts:{code}:hour:{day_start}      hour of the day -> clicks
+    ts:{code}:day:{span_start}      day of a 64-day span -> clicks
+
+so a range query costs one HGETALL per span it covers, and every hash stays
+small enough for Redis' compact encoding. Each hash expires after its
+granularity's retention period. Writing a minute bucket also adds its link
+to the hour's set of clicked links,
+
+    ts:active:{hour_start}          codes with a minute hash for that hour
+
+which is what the rollup walks, so its cost follows the links clicked rather
+than the size of the keyspace.
+"""
+import time
+
+from config import Config
+
+# granularity: (bucket seconds, seconds covered by one hash)
+GRANULARITIES = {
+    "minute": (60, 3600),
+    "hour": (3600, 86400),
+    "day": (86400, 86400 * 64),
+}
+
+RETENTION = {
+    "minute": Config.TIMESERIES_MINUTE_RETENTION,
+    "hour": Config.TIMESERIES_HOUR_RETENTION,
+    "day": Config.TIMESERIES_DAY_RETENTION,
+}
+
+# Start of the first hour that has not been rolled up yet.
+ROLLED_UP_KEY = "ts:rolled_up_until"
+
+
+def active_key(hour):
+    return f"ts:active:{hour}"
+
+
+def bucket(short_code, granularity, timestamp):
+    """Return the ``(key, field)`` holding the bucket that contains ``timestamp``."""
+    size, span = GRANULARITIES[granularity]
+    timestamp = int(timestamp)
+    start = timestamp - timestamp % span
+    return f"ts:{short_code}:{granularity}:{start}", (timestamp - start) // size
+
+
+def add_minute_counts(pipe, counts):
+    """Queue the writes for ``{(code, timestamp): clicks}`` on a pipeline.
+
+    Every hour touched gets one SADD of its clicked codes, which the batch
+    has already aggregated, so the shared set costs a write per flush rather
+    than per click.
+    """
+    active = {}
+    for (short_code, timestamp), n in counts.items():
+        key, field = bucket(short_code, "minute", timestamp)
+        pipe.hincrby(key, field, n)
+        pipe.expire(key, RETENTION["minute"], nx=True)
+        active.setdefault(int(timestamp) // 3600 * 3600, set()).add(short_code)
+    for hour, codes in active.items():
+        pipe.sadd(active_key(hour), *codes)
+        pipe.expire(active_key(hour), RETENTION["minute"], nx=True)
+
+
+def _clicked_codes(client, hour, batch_size):
+    """The codes that have a minute hash for ``hour``."""
+    return set(client.sscan_iter(active_key(hour), count=batch_size))
+
+
+def _rollup_hour(client, hour, codes, batch_size):
+    codes = list(codes)
+    for i in range(0, len(codes), batch_size):
+        batch = codes[i:i + batch_size]
+
+        pipe = client.pipeline(transaction=False)
+        for short_code in batch:
+            pipe.hvals(bucket(short_code, "minute", hour)[0])
+        totals = [sum(map(int, values)) for values in pipe.execute()]
+
+        # Each hour hash covers exactly one day, so the day bucket is
+        # recomputed from it, which keeps a repeated rollup harmless.
+        pipe = client.pipeline(transaction=False)
+        for short_code, total in zip(batch, totals):
+            key, field = bucket(short_code, "hour", hour)
+            pipe.hset(key, field, total)
+            pipe.expire(key, RETENTION["hour"])
+            pipe.hvals(key)
+        replies = pipe.execute()
+
+        pipe = client.pipeline(transaction=False)
+        for short_code, hours in zip(batch, replies[2::3]):
+            key, field = bucket(short_code, "day", hour)
+            pipe.hset(key, field, sum(map(int, hours)))
+            pipe.expire(key, RETENTION["day"])
+        pipe.execute()
+
+    return len(codes)
+
+
+def rollup(client, now=None, batch_size=500, max_hours=24):
+    """Roll every finished minute bucket up into hour and day buckets.
+
+    Picks up from the first hour not rolled up yet, and only rolls an hour up
+    ``TIMESERIES_ROLLUP_DELAY`` seconds after it ends so buffered clicks
+    have landed. The links of each hour are read from its ``ts:active`` set.
+    Returns ``{"hours": n, "links": n}``.
+    """
+    now = time.time() if now is None else now
+    last_finished = int(now - Config.TIMESERIES_ROLLUP_DELAY) // 3600 * 3600 - 3600
+    first = int(client.get(ROLLED_UP_KEY) or last_finished)
+    hours = range(first, min(last_finished + 1, first + max_hours * 3600), 3600)
+    stats = {"hours": 0, "links": 0}
+    if not hours:
+        return stats
+
+    for hour in hours:
+        clicked = _clicked_codes(client, hour, batch_size)
+        stats["links"] += _rollup_hour(client, hour, clicked, batch_size)
+        stats["hours"] += 1
+        client.set(ROLLED_UP_KEY, hour + 3600)
+
+    return stats
+
+
+def _hash_values(hashes):
+    return {int(field): int(value) for field, value in hashes.items()}
+
+
+def query(client, short_code, granularity, start, end, now=None):
+    """Return ``[(bucket_start, clicks), ...]`` for every bucket in ``[start, end]``.
+
+    Costs two pipelined round trips: one HGETALL per span of the requested
+    granularity, then, for hours and days, the minute hashes of hours that
+    have not been rolled up yet so recent traffic is included.
+    """
+    size, span = GRANULARITIES[granularity]
+    now = time.time() if now is None else now
+    start = int(start) - int(start) % size
+    end = int(end) - int(end) % size
+    buckets = range(start, end + 1, size)
+    spans = sorted({ts - ts % span for ts in buckets})
+
+    pipe = client.pipeline(transaction=False)
+    pipe.get(ROLLED_UP_KEY)
+    for span_start in spans:
+        pipe.hgetall(bucket(short_code, granularity, span_start)[0])
+    rolled_up, *hashes = pipe.execute()
+    stored = {
+        span_start + field * size: value
+        for span_start, values in zip(spans, hashes)
+        for field, value in _hash_values(values).items()
+    }
+
+    if granularity != "minute":
+        # Hours after the rollup point are summed from their minute buckets.
+        first_live = max(
+            int(rolled_up or 0),
+            int(now - RETENTION["minute"]) // 3600 * 3600,
+            start - start % 3600,
+        )
+        live_hours = range(first_live, min(end + size, int(now) + 1), 3600)
+        live_days = sorted({hour - hour % 86400 for hour in live_hours})
+
+        pipe = client.pipeline(transaction=False)
+        for hour in live_hours:
+            pipe.hvals(bucket(short_code, "minute", hour)[0])
+        if granularity == "day":
+            for day in live_days:
+                pipe.hgetall(bucket(short_code, "hour", day)[0])
+        replies = pipe.execute()
+
+        live = {hour: sum(map(int, values)) for hour, values in zip(live_hours, replies)}
+        if granularity == "hour":
+            stored.update(live)
+        else:
+            for day, hours in zip(live_days, replies[len(live_hours):]):
+                rolled = _hash_values(hours)
+                stored[day] = sum(
+                    live[day + h * 3600] if day + h * 3600 in live else rolled.get(h, 0)
+                    for h in range(24)
+                )
+
+    return [(ts, stored.get(ts, 0)) for ts in buckets]
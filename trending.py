@@ -0,0 +1,165 @@
+"""Most clicked links over the last 5 minutes, hour and day.
+
+Each process counts its clicks in a small heavy-hitters summary and a
+background thread adds it to shared leaderboards every
+``TRENDING_FLUSH_INTERVAL`` seconds:
+
+    trending:minute:{minute_start}   code -> clicks in that minute
+    trending:hour:{hour_start}       code -> clicks in that hour
+
+After every flush a leaderboard is trimmed to its ``TRENDING_KEEP`` best
+codes, and it expires once no window reads it any more, so memory stays
+bounded whatever the number of links. A click costs one dictionary update
+on the redirect path; Redis sees one ZINCRBY per distinct hot code and
+bucket per flush.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from config import Config
+from shortener import r
+
+logger = logging.getLogger(__name__)
+
+# window: (bucket granularity, number of buckets)
+WINDOWS = {
+    "5m": ("minute", 5),
+    "1h": ("minute", 60),
+    "1d": ("hour", 24),
+}
+BUCKET_SECONDS = {"minute": 60, "hour": 3600}
+# Kept one bucket longer than the widest window that reads them.
+RETENTION = {"minute": 61 * 60, "hour": 25 * 3600}
+
+
+def bucket_key(granularity, timestamp):
+    size = BUCKET_SECONDS[granularity]
+    timestamp = int(timestamp)
+    return f"trending:{granularity}:{timestamp - timestamp % size}"
+
+
+class HeavyHitters:
+    """Misra-Gries summary of at most ``size`` codes.
+
+    A code's count is too low by at most ``n / (size + 1)`` after ``n``
+    clicks, so every code with more than that share of the traffic is kept.
+    ``add`` is amortized O(1).
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.counts = {}
+
+    def add(self, key):
+        if key in self.counts:
+            self.counts[key] += 1
+        elif len(self.counts) < self.size:
+            self.counts[key] = 1
+        else:
+            # The new key's click and one click of every kept key cancel out.
+            self.counts = {k: n - 1 for k, n in self.counts.items() if n > 1}
+
+    def __len__(self):
+        return len(self.counts)
+
+
+class TrendingTracker:
+    """Feeds this process' clicks into the shared leaderboards.
+
+    Like the click buffer, a daemon thread flushes every ``flush_interval``
+    seconds and once more at exit. The leaderboards are approximate, so a
+    failed flush is logged and its counts dropped rather than retried.
+    """
+
+    def __init__(self, flush_interval, sketch_size, keep):
+        self.flush_interval = flush_interval
+        self.sketch_size = sketch_size
+        self.keep = keep
+        self._sketch = HeavyHitters(sketch_size)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self.flushes = 0
+
+    def add(self, short_code):
+        with self._lock:
+            self._sketch.add(short_code)
+            if self._thread is None:
+                self._start()
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name="trending-flush", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Trending flush failed, dropping its counts")
+
+    def flush(self, now=None):
+        with self._flush_lock:
+            with self._lock:
+                if not len(self._sketch):
+                    return
+                counts = self._sketch.counts
+                self._sketch = HeavyHitters(self.sketch_size)
+
+            now = time.time() if now is None else now
+            pipe = r.pipeline(transaction=False)
+            for granularity in BUCKET_SECONDS:
+                key = bucket_key(granularity, now)
+                for short_code, n in counts.items():
+                    pipe.zincrby(key, n, short_code)
+                pipe.zremrangebyrank(key, 0, -self.keep - 1)
+                pipe.expire(key, RETENTION[granularity], nx=True)
+            pipe.execute()
+            self.flushes += 1
+
+
+tracker = None
+if Config.TRENDING_ENABLED:
+    tracker = TrendingTracker(
+        flush_interval=Config.TRENDING_FLUSH_INTERVAL,
+        sketch_size=Config.TRENDING_SKETCH_SIZE,
+        keep=Config.TRENDING_KEEP,
+    )
+
+
+def record(short_code):
+    if tracker is not None:
+        tracker.add(short_code)
+
+
+def flush_trending():
+    """Add this process' pending clicks so reads see its own traffic."""
+    if tracker is not None:
+        try:
+            tracker.flush()
+        except Exception:
+            logger.exception("Trending flush failed, dropping its counts")
+
+
+def top(client, window, limit, now=None):
+    """Return ``[(code, clicks), ...]`` for the ``limit`` most clicked codes.
+
+    The window is the current bucket plus the ones before it, merged with
+    one ZUNIONSTORE in a transaction, so a query is one round trip.
+    """
+    granularity, count = WINDOWS[window]
+    size = BUCKET_SECONDS[granularity]
+    now = time.time() if now is None else now
+    keys = [bucket_key(granularity, now - i * size) for i in range(count)]
+    dest = f"trending:top:{window}"
+
+    pipe = client.pipeline()
+    pipe.zunionstore(dest, keys)
+    pipe.zrevrange(dest, 0, limit - 1, withscores=True)
+    pipe.delete(dest)
+    _, entries, _ = pipe.execute()
+    return [(short_code, int(clicks)) for short_code, clicks in entries]
@@ -1,52 +1,117 @@
+import logging
+import time
+
 from celery import Celery
+from celery.signals import task_postrun, task_prerun
 from config import Config
-from bs4 import BeautifulSoup
-import redis, requests, json
+from redis_client import get_redis, celery_settings
+from shortener import refill_code_pool
+from cleanup import drain_expired_links, sweep_link_indexes, record_run
+import storage
+import timeseries
+import click_stream
+import preview
+import metrics
 
 celery = Celery('tasks',
                 broker=Config.RATELIMIT_STORAGE_URL,
                 backend=Config.RATELIMIT_STORAGE_URL)
+celery.conf.update(celery_settings())
 
-r = redis.Redis(host=Config.REDIS_HOST,
-                port=Config.REDIS_PORT,
-                db=Config.REDIS_DB,
-                decode_responses=True)
+r = get_redis()
+logger = logging.getLogger(__name__)
 
-@celery.task
-def fetch_url_preview(short_code, long_url):
-    try:
-        response = requests.get(long_url, timeout=5)
-        soup = BeautifulSoup(response.text, 'html.parser')
+_task_started = {}
 
-        title = soup.title.string if soup.title else "No title"
-        description = ""
+@task_prerun.connect
+def _start_task_timer(task_id=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
 
-        desc_tag = soup.find("meta", attrs={"name": "description"})
-        if desc_tag:
-            description = desc_tag.get("content", "")
+@task_postrun.connect
+def _record_task_duration(task_id=None, task=None, state=None, **kwargs):
+    """Report run times to Redis, where the web process' ``/metrics`` reads them."""
+    started = _task_started.pop(task_id, None)
+    if started is None or not metrics.enabled:
+        return
+    try:
+        metrics.record_task(r, task.name, state or "UNKNOWN", time.perf_counter() - started)
+    except Exception:
+        logger.warning("Could not record the duration of %s", task.name, exc_info=True)
 
-        preview_data = {
-            "title": title[:100],
-            "description": description[:200],
-        }
-        r.setex(f"preview:{short_code}", 86400 * 7, json.dumps(preview_data))
-        return f"Preview saved for {short_code}"
-    except Exception as e:
-        return f"Failed to fetch preview:{str(e)}"
+@celery.task
+def fetch_url_previews(urls):
+    """Fetch ``urls`` concurrently and cache their previews; see preview.py."""
+    results = preview.fetcher.fetch_many(urls)
+    pipe = r.pipeline(transaction=False)
+    for url, result in zip(urls, results):
+        preview.queue_result(pipe, url, result)
+    pipe.execute()
+    saved = sum(isinstance(result, dict) for result in results)
+    return f"Saved {saved} of {len(urls)} previews"
 
 @celery.task
 def cleanup_expired_links():
-    user_keys = r.keys("user:*:links")
-    for key in user_keys:
-        links = r.smembers(key)
-        for link_code in links:
-            if not r.exists(f"url:{link_code}"):
-                r.srem(key, link_code)
-    return "Cleanup completed"
+    """One slice of index cleanup; see cleanup.py. Returns the run's counters."""
+    due = drain_expired_links(r, Config.CLEANUP_BATCH_SIZE, Config.CLEANUP_MAX_LINKS)
+    swept = sweep_link_indexes(r, Config.CLEANUP_BATCH_SIZE, Config.CLEANUP_MAX_INDEXES)
+    stats = {
+        "due_scanned": due["scanned"],
+        "due_removed": due["removed"],
+        "indexes_scanned": swept["indexes"],
+        "links_scanned": swept["links"],
+        "links_removed": swept["removed"],
+        "sweeps_completed": swept["pass_completed"],
+        "purged": storage.backend.links.purge_expired(Config.CLEANUP_MAX_LINKS),
+    }
+    record_run(r, stats)
+    return stats
+
+@celery.task
+def refill_short_code_pool():
+    if Config.SHORT_CODE_ALLOCATOR != "pool":
+        return "Code pool disabled"
+    added = refill_code_pool(r, Config.CODE_POOL_TARGET)
+    return f"Added {added} codes to the pool"
+
+@celery.task
+def rollup_timeseries():
+    return timeseries.rollup(r)
+
+@celery.task
+def consume_click_stream(max_batches=20):
+    """Drain the click stream in ``stream`` mode.
+
+    Scheduled by beat so clicks are counted even without the standalone
+    consumer (``python click_stream.py consume``), which follows the stream
+    continuously and with lower latency.
+    """
+    click_stream.ensure_group(r)
+    consumer = "celery"
+    processed = click_stream.claim_stale(r, consumer, Config.CLICK_STREAM_BATCH_SIZE)
+    for _ in range(max_batches):
+        n = click_stream.consume(r, consumer, Config.CLICK_STREAM_BATCH_SIZE)
+        processed += n
+        if n < Config.CLICK_STREAM_BATCH_SIZE:
+            break
+    return processed
 
 celery.conf.beat_schedule = {
-    'daily-cleanup': {
+    'cleanup-expired-links': {
         'task': 'worker.cleanup_expired_links',
-        'schedule': 3600.0,
+        'schedule': Config.CLEANUP_INTERVAL,
     },
-}
\ No newline at end of file
+    'rollup-timeseries': {
+        'task': 'worker.rollup_timeseries',
+        'schedule': 300.0,
+    },
+    'refill-code-pool': {
+        'task': 'worker.refill_short_code_pool',
+        'schedule': 60.0,
+    },
+}
+
+if Config.CLICK_COUNT_MODE == "stream":
+    celery.conf.beat_schedule['consume-click-stream'] = {
+        'task': 'worker.consume_click_stream',
+        'schedule': Config.CLICK_STREAM_DRAIN_INTERVAL,
+    }